@@ -22,26 +22,6 @@ from mpi4py import MPI
 
 # TODO: analyse tools
 # from guppy import hpy
-import cProfile
-
-# Profiling decorator for ``cProfile`` suggested in
-# https://stackoverflow.com/questions/33503176/profile-parallelized-python-script-with-mpi4py
-def profile(filename=None, comm=MPI.COMM_WORLD):
-    def prof_decorator(f):
-        def wrap_f(*args, **kwargs):
-            prof = cProfile.Profile()
-            prof.enable()
-            result = f(*args, **kwargs)
-            prof.disable()
-
-            if filename is None:
-                prof.print_stats()
-            else:
-                prof.dump_stats( "{0}.{1}".fortmat(filename, comm.rank) )
-
-            return result
-        return wrap_f
-    return prof_decorator
 
 # TODO: remove in alpha release
 sys.path.insert( 0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0])))) )
@@ -49,6 +29,15 @@ import sn4sp
 from sn4sp import readwrite
 from sn4sp import parallel
 
+# Profiling decorator for ``cProfile``. Profiles of all processes are merged into `filename`.
+def profile(filename=None, comm=MPI.COMM_WORLD):
+    def prof_decorator(f):
+        def wrap_f(*args, **kwargs):
+            with parallel.profiling(filename, comm):
+                return f(*args, **kwargs)
+        return wrap_f
+    return prof_decorator
+
 def get_arguments():
     """ Get the argument from the command line.
     By default, we use exponential damping and half-length scale set to 5 km.
@@ -12,35 +12,10 @@ import logging
 import platform
 import sys
 import os
-import time
-import datetime as dt
-import numpy as np
-from scipy import linalg as la
-import math
-import h5py
 from mpi4py import MPI
-import pandas as pd
-import pickle, gzip
-
-# Workaround to run on machines with old versions of numpy
-np_isin = np.isin if np.__version__ >= "1.13" else np.in1d
-
-r_earth=6.3781*10**6
-
-def GeoDist(lat1, lon1, lat2, lon2):
-    lat1 = math.radians(lat1)
-    lon1 = math.radians(lon1)
-    lat2 = math.radians(lat2)
-    lon2 = math.radians(lon2)
-    
-    dlon = lon1 - lon2
-    
-    y = math.sqrt((math.cos(lat2) * math.sin(dlon)) ** 2+ (math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(dlon)) ** 2)
-    x = math.sin(lat1) * math.sin(lat2) + math.cos(lat1) * math.cos(lat2) * math.cos(dlon)
-    c = math.atan2(y, x)
-    return r_earth * c
-
 
+sys.path.insert( 0, os.path.dirname(os.path.abspath(sys.argv[0])) )
+from sn4sp.readwrite import stream_preprocess_synpop_h5, convert_geodata_h5, read_geodata_h5
 
 def preprocessing(comm, size, rank):
     import getpass
@@ -62,142 +37,23 @@ def preprocessing(comm, size, rank):
         out_file=os.path.join(os.getcwd(), 'synthetic_population_ppd.h5')
         helper=os.path.join(os.getcwd(), 'geodata.gz')
 
-    with h5py.File(in_file, 'r') as f:
-        logging.info(' starting #'+str(rank))
-        sys.stdout.flush()
-        
-        # l0=0 refers to the Turin county
-        turin_hh_area=f['household'][f['household']['l0']==0]
-        # l1=0 refers to the Turin municipality. I am selecting households in the Turin municipality
-        turin_hh=turin_hh_area[turin_hh_area['l1']==569]['id']
-        # I am selecting agents whose households is in the Turin municipality
-        selection=np_isin(f['agent']['hh'], turin_hh)
-        # where is the exact position in the list of agents
-        where_to=np.where(selection)[0]
-        
-        
-        # I am reducing the sample
-        #### WHEN EVERYTHING IS FINE, REMOVE THIS BLOCK
-        #a=np.arange(len(where_to))
-        #np.random.shuffle(a)
-        #sel_l=int(np.round(1*len(where_to)/10))
-        #sel=list(np.sort(a[:sel_l]))
-        #where_to=where_to[sel]
-        #### WHEN EVERYTHING IS FINE, REMOVE THIS BLOCK
-        
-        
-        lt=len(f['agent'])
-        lr=len(where_to)
-        
-        logging.info(' lr='+str(lr)+' #'+str(rank))
-        sys.stdout.flush()
-        
-        # Here I am calculating the efforts per processor
-        effort=np.floor(1.*lr/size)*np.ones(size)
-        remainder=lr % size
-        offset=np.zeros(size, dtype='>i4')
-        for i in range(size):
-            if i<remainder:
-                effort[i]+=1
-            if i>0:
-                offset[i]=offset[i-1]+effort[i-1]
-    
-        my_chunk=range(int(offset[rank]),int(offset[rank]+effort[rank]))
-        logging.info(' effort='+str(int(effort[rank]))+' #'+str(rank))
-        logging.info(' my_chunk=['+str(my_chunk[0])+', '+str(my_chunk[-1])+'] #'+str(rank))
-        sys.stdout.flush()
-
-        # I am reading data and putting them into a buffer
-
-
-        ags_dataset = f["agent"]
-        ags_ids = np.array(ags_dataset["id"])
-        ags_hhi = np.array(ags_dataset["hh"])
-        ags_wpi = np.array(ags_dataset["wp"])
-        ags_sex = np.array(ags_dataset["sex"])
-        ags_age = np.array(ags_dataset["age"])
-        ags_rol = np.array(ags_dataset["role"])
-        ags_edu = np.array(ags_dataset["edu"])
-        ags_emp = np.array(ags_dataset["employed"])
-        ags_inc = np.array(ags_dataset["income"])
-        
-        wps_dataset = f["workplace"]
-        wps_ids = np.array(wps_dataset["id"])
-        wps_lat = np.array(wps_dataset["lat"])
-        wps_lon = np.array(wps_dataset["lon"])
-        wps_l1  = np.array(wps_dataset["l1"])
-        wps_l2  = np.array(wps_dataset["l2"])
-        
-        hhs_dataset = f["household"]
-        hhs_ids = np.array(hhs_dataset["id"])
-        hhs_lat = np.array(hhs_dataset["lat"])
-        hhs_lon = np.array(hhs_dataset["lon"])
-        hhs_l1 = np.array(hhs_dataset["l1"])
-        hhs_l2 = np.array(hhs_dataset["l2"])
-
-
     # the helper file contains the information about the bounders of the different municipality and the relative codes. This is necessary in order to assign the possible link to the municipality, i.e. in order to assign every agent to a municipality (identified by its code).
 
-    geoDataFrame = pickle.load(gzip.open(helper, "rb"))#, encoding='latin1'
-    turin=geoDataFrame[2][geoDataFrame[2]['l0']==0]
-    logging.info(' turin.iloc[0][code]='+str(turin.iloc[0]['code'])+' #'+str(rank))
+    # The helper file is converted once to columnar HDF5 cache,
+    # then the root process reads only the needed columns and broadcasts them.
+    geodata_cache=os.path.splitext(os.path.splitext(helper)[0])[0]+'.h5'
+    if not comm.bcast(os.path.exists(geodata_cache) if rank == 0 else None, root=0):
+        if rank == 0:
+            convert_geodata_h5(helper, geodata_cache)
+        comm.Barrier()
+    geodata=read_geodata_h5(geodata_cache, 2, ['l0', 'code'], comm)
+    logging.info(' turin code='+str(geodata['code'][geodata['l0']==0][0])+' #'+str(rank))
     sys.stdout.flush()
 
 
-    with h5py.File(out_file, 'w', driver='mpio', comm=comm, libver='latest') as g:
-        ppd_g=g.create_group('SPP10pc')
-        # pre-processed data
-        ppd_da=ppd_g.create_dataset('da', data=np.array(['c', 'o', 'c','c', 'c', 'o','g','g','g','g','o']))
-        
-        dtype=np.dtype([('sex','i8'),('age','i8'), ('role','i8'), ('edu','i8'), ('employed','i8'), ('income','i8'), ('wp_lon','f8'), ('wp_lat','f8'), ('hh_lon','f8'), ('hh_lat','f8'), ('wp_hh','i8')])
-        # In principle this step could be automatized, but since some of the original entries (like the wp code)
-        # are in a non trivial form, it would not in principle deserve the effort, since it should change from
-        # synthetic population to syntehtic population.
-        ppd=ppd_g.create_dataset('ppd', (lr,), dtype=dtype)
-        for i in my_chunk:
-            if i % 10000==0:
-                logging.info(' i='+str(i)+' #'+str(rank))
-                sys.stdout.flush()
-            j=where_to[i]
-            assert j<lt, '{:%Y-%m-%d %H:%M:%S}'.format(dt.datetime.now())+' odd index j='+str(j)+' #'+str(rank)
-            
-            where_hh = hhs_ids==ags_hhi[j]
-            
-            aux_hh_lon = hhs_lon[where_hh]
-            aux_hh_lat = hhs_lat[where_hh]
-            aux_hh_l1 = hhs_l1[where_hh][0]
-            aux_hh_l2 = hhs_l2[where_hh][0]
-            
-            
-            
-            tmp_wp_idx = ags_wpi[j]
-            if tmp_wp_idx > 0:
-                where_wp = wps_ids == tmp_wp_idx
-                aux_wp_lon = wps_lon[where_wp]
-                aux_wp_lat = wps_lat[where_wp]
-                wp_hh=np.array([GeoDist(aux_hh_lat, aux_hh_lon, aux_wp_lat, aux_wp_lon)])
-            else:
-                aux_wp_lon = aux_hh_lon
-                aux_wp_lat = aux_hh_lat
-                wp_hh = np.zeros(1)
-            if i==0:
-                logging.info('int(ags_sex[j])='+str(int(ags_sex[j]))+' # '+str(rank))
-            
-            #ppd[i]['sex']=int(ags_sex[j])
-            #ppd[i]['age']=int(ags_age[j])
-            #ppd[i]['edu']=int(ags_edu[j])
-            #ppd[i]['role']=int(ags_rol[j])
-            #ppd[i]['employed']=int(ags_emp[j])
-            #ppd[i]['income']=int(np.round(ags_inc[j]/1000))
-            #ppd[i]['wp_lon']=aux_wp_lon[0]
-            #ppd[i]['wp_lat']=aux_wp_lat[0]
-            #ppd[i]['hh_lon']=aux_hh_lon[0]
-            #ppd[i]['hh_lat']=aux_hh_lat[0]
-            #ppd[i]['wp_hh']=int(np.round(wp_hh/1000))
-            
-            
-            
-            ppd[i]=(int(ags_sex[j]), int(ags_age[j]), int(ags_rol[j]), int(ags_edu[j]), int(ags_emp[j]), int(np.round(ags_inc[j]/1000)), aux_wp_lat[0], aux_wp_lon[0], aux_hh_lat[0], aux_hh_lon[0],int(np.round(wp_hh/1000)))
+    # l0=0 refers to the Turin county, l1=569 refers to the Turin municipality:
+    # select agents whose households are in the Turin municipality
+    stream_preprocess_synpop_h5(in_file, out_file, comm, region={'l0' : 0, 'l1' : 569})
 
     logging.info(' just finished #'+str(rank))
     logging.info(' We all finished #'+str(rank))
@@ -179,10 +179,11 @@ def setup_package():
         package_data = package_data,
         install_requires = ["mpi4py", "numpy"],
         extras_require = {
-            "all"     : ["argparse", "h5py", "logging", "psutil"],
+            "all"     : ["argparse", "h5py", "logging", "psutil", "scipy"],
             "hdf5"    : ["h5py"],
             "utils"   : ["argparse", "h5py", "logging"],
             "logging" : ["logging", "psutil"],
+            "linalg"  : ["scipy"],
         },
         # test_suite='nose.collector',
         # cmdclass={"sdist": sdist},
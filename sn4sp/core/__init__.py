@@ -2,5 +2,9 @@
 Core classes of the SN4SP package.
 """
 from .similarity_network import SimilarityGraph
+from .frequencies import SampleFrequencies, ExactFrequencies, SketchFrequencies
+from . import coarse
+from . import linalg
+from .linalg import probability_operator
 
-__all__ = [ SimilarityGraph ]
+__all__ = [ SimilarityGraph, SampleFrequencies, ExactFrequencies, SketchFrequencies ]
@@ -0,0 +1,125 @@
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+"""
+*****
+Cache
+*****
+Caches of values which are expensive to recompute.
+"""
+from __future__ import division, absolute_import, print_function
+
+__author__ = '\n'.join(['Sergiy Gogolenko <gogolenko@hlrs.de>',
+                        'Fabio Saracco <fabio@imt.it>'])
+
+__all__ = [ 'LRUCache',
+            'RowBlockCache' ]
+
+from collections import OrderedDict
+
+import numpy
+
+class LRUCache(object):
+    """
+    Bounded mapping which discards the least recently used items.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of items
+    """
+    def __init__(self, maxsize):
+        self.maxsize=maxsize
+        self.items=OrderedDict()
+        self.hits, self.misses=0, 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return 'LRUCache(maxsize={0}, size={1}, hits={2}, misses={3})'.\
+               format(self.maxsize, len(self), self.hits, self.misses)
+
+    def get(self, key, default=None):
+        """ Value of the `key` (`default` if the key is missing); the key becomes the most recently used. """
+        try:
+            value=self.items.pop(key)
+        except KeyError:
+            self.misses+=1
+            return default
+        self.items[key]=value
+        self.hits+=1
+        return value
+
+    def put(self, key, value):
+        """ Store the value of the `key` discarding the least recently used item if the cache is full. """
+        self.items.pop(key, None)
+        self.items[key]=value
+        if len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        """ Discard all items. """
+        self.items.clear()
+
+class RowBlockCache(object):
+    """
+    Dense matrix whose blocks of rows are computed on first access.
+
+    Processes which look up only few rows of the matrix never compute (and store) the others.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the matrix
+    compute_rows : callable
+        Function which returns rows ``[start, stop)`` of the matrix given `start` and `stop`
+    block_len : int
+        Number of rows in a block
+    """
+    def __init__(self, shape, compute_rows, block_len):
+        self.shape=tuple(shape)
+        self.compute_rows=compute_rows
+        self.block_len=max(1, int(block_len))
+        self.blocks=[None]*(-(-self.shape[0]//self.block_len))
+
+    def __repr__(self):
+        return 'RowBlockCache(shape={0}, block_len={1}, computed={2})'.\
+               format(self.shape, self.block_len, sum(1 for rows in self.blocks if rows is not None))
+
+    @property
+    def nbytes(self):
+        """ Number of bytes occupied by computed blocks. """
+        return sum(rows.nbytes for rows in self.blocks if rows is not None)
+
+    def block(self, k):
+        """ Rows of the block `k` (computed if the block is accessed for the first time). """
+        rows=self.blocks[k]
+        if rows is None:
+            start=k*self.block_len
+            rows=self.blocks[k]=self.compute_rows(start, min(start + self.block_len, self.shape[0]))
+        return rows
+
+    def __getitem__(self, index):
+        """ Element ``[i,j]`` of the matrix (elements ``[i[k],j[k]]`` if `i` and `j` are arrays). """
+        i, j=index
+        if numpy.ndim(i) == 0:
+            i=int(i)
+            return self.block(i//self.block_len)[i % self.block_len, j]
+        i, j=numpy.broadcast_arrays(numpy.asarray(i, dtype='i8'), numpy.asarray(j, dtype='i8'))
+        values=numpy.empty(i.shape)
+        if i.size == 0:
+            return values
+        # NOTE: group elements by blocks, so that every block is looked up once
+        block_ids=i.ravel()//self.block_len
+        order=numpy.argsort(block_ids, kind='mergesort')
+        starts=numpy.flatnonzero(numpy.diff(block_ids[order])) + 1
+        flat_values, flat_i, flat_j=values.reshape(-1), i.ravel(), j.ravel()
+        for group in numpy.split(order, starts):
+            k=block_ids[group[0]]
+            flat_values[group]=self.block(k)[flat_i[group] - k*self.block_len, flat_j[group]]
+        return values
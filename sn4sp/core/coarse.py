@@ -0,0 +1,151 @@
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+"""
+******
+Coarse
+******
+Coarse-grained (class-level) similarity networks.
+
+Vertices with identical attributes (profile and locations) form equivalence classes:
+their edge probabilities to any other vertex are identical. A class-level network holds
+edge probabilities between classes (and within classes), and it is expanded
+to the vertex-level network on demand.
+"""
+from __future__ import division, absolute_import, print_function
+
+__author__ = '\n'.join(['Sergiy Gogolenko <gogolenko@hlrs.de>',
+                        'Fabio Saracco <fabio@imt.it>'])
+
+__all__ = [ 'class_members',
+            'num_class_pairs',
+            'expand_class_edges' ]
+
+import numpy
+
+from sn4sp.parallel.triu import pos2ij_array
+
+def class_members(classes):
+    """ Vertices grouped by classes.
+
+    Parameters
+    ----------
+    classes : numpy.array
+        Class of every vertex
+
+    Returns
+    -------
+    members : numpy.array
+        Vertices sorted by classes (ascending within a class)
+    offsets : numpy.array
+        Offsets of the classes in `members`
+    """
+    members=numpy.argsort(classes, kind='mergesort')
+    sizes=numpy.bincount(classes)
+    return members, numpy.hstack(([0], numpy.cumsum(sizes))).astype('i8')
+
+def num_class_pairs(src_classes, trg_classes, sizes):
+    """ Number of vertex pairs behind edges between classes (pairs of distinct vertices within a class). """
+    src_sizes, trg_sizes=sizes[src_classes].astype('i8'), sizes[trg_classes].astype('i8')
+    return numpy.where(src_classes == trg_classes, src_sizes*(src_sizes - 1)//2, src_sizes*trg_sizes)
+
+def _pair_segments(num_pairs, chunk_len):
+    """ Iterator over blocks of at most `chunk_len` vertex pairs behind class-level edges.
+
+    Blocks are given by segments (edge index, first pair, number of pairs) of pairs of the edges.
+    """
+    ends=numpy.cumsum(num_pairs)
+    starts=ends - num_pairs
+    total=int(ends[-1]) if len(ends) else 0
+    for block_start in xrange(0, total, chunk_len):
+        block_stop=min(block_start + chunk_len, total)
+        edge_index=numpy.arange( numpy.searchsorted(ends, block_start, side='right'),
+                                 numpy.searchsorted(ends, block_stop - 1, side='right') + 1 )
+        first=numpy.maximum(starts[edge_index], block_start)
+        num_segment_pairs=numpy.minimum(ends[edge_index], block_stop) - first
+        nonempty=num_segment_pairs > 0
+        edge_index=edge_index[nonempty]
+        yield edge_index, first[nonempty] - starts[edge_index], num_segment_pairs[nonempty]
+
+def expand_class_edges(edges, members, offsets, sample=False, random_state=None, chunk_len=1<<16):
+    """ Expand edges between classes to edges between vertices.
+
+    Vertex pairs behind class-level edges are expanded in blocks of at most `chunk_len` pairs,
+    so that edges between large classes do not have to fit into memory.
+
+    Parameters
+    ----------
+    edges : numpy.array
+        Class-level edges (structured array with ``src_node``, ``trg_node`` classes and ``weight``)
+    members : numpy.array
+        Vertices sorted by classes (see `class_members`)
+    offsets : numpy.array
+        Offsets of the classes in `members`
+    sample : bool
+        If ``True``, draw edges between vertices with their probabilities (Bernoulli trials)
+        instead of listing all vertex pairs.
+    random_state : numpy.random.RandomState
+        Random generator used for sampling
+    chunk_len : int
+        Maximum number of vertex pairs expanded at once
+
+    Returns
+    -------
+    chunks : iterator
+        Iterator over arrays of vertex-level edges (of the same type as class-level edges)
+        with ``src_node < trg_node``
+
+    Raises
+    ------
+    ValueError : exception
+        Edges with several weights (settings) are sampled.
+    """
+    sizes=numpy.diff(offsets)
+    num_pairs=num_class_pairs(edges['src_node'], edges['trg_node'], sizes)
+    if sample:
+        weights=edges['weight']
+        if weights.ndim > 1:
+            raise ValueError( 'edges with several weights cannot be sampled' )
+        weights=numpy.clip(weights, 0., 1.)
+        random_state=random_state or numpy.random
+    for edge_index, first, num_segment_pairs in _pair_segments(num_pairs, chunk_len):
+        if sample:
+            # Number of edges between vertices in a segment of pairs is binomial,
+            # and drawn edges are distinct pairs of the segment chosen uniformly.
+            num_drawn=random_state.binomial(num_segment_pairs, weights[edge_index])
+            pair_index=numpy.empty(numpy.sum(num_drawn), dtype='i8')
+            position=0
+            for k in numpy.flatnonzero(num_drawn):
+                pair_index[position:position+num_drawn[k]]=first[k] + \
+                    ( numpy.arange(num_segment_pairs[k]) if num_drawn[k] == num_segment_pairs[k] else \
+                      random_state.choice(num_segment_pairs[k], num_drawn[k], replace=False) )
+                position+=num_drawn[k]
+            edge_index=numpy.repeat(edge_index, num_drawn)
+        else:
+            segment_index=numpy.repeat(numpy.arange(len(edge_index)), num_segment_pairs)
+            pair_index=first[segment_index] + numpy.arange(len(segment_index)) - \
+                       (numpy.cumsum(num_segment_pairs) - num_segment_pairs)[segment_index]
+            edge_index=edge_index[segment_index]
+        if len(edge_index) > 0:
+            yield _unrank_class_pairs(edges, edge_index, pair_index, members, offsets, sizes)
+
+def _unrank_class_pairs(edges, edge_index, pair_index, members, offsets, sizes):
+    """ Vertex-level edges given by indices of class-level edges and indices of vertex pairs behind them. """
+    # Unrank pairs of class members: (i,j) of |a|x|b| grid between classes,
+    # (i,j) with i<j of upper triangle within class
+    src_classes, trg_classes=edges['src_node'][edge_index], edges['trg_node'][edge_index]
+    trg_sizes=sizes[trg_classes]
+    i, j=pair_index//trg_sizes, pair_index % trg_sizes
+    within=src_classes == trg_classes
+    i[within], j[within]=pos2ij_array(pair_index[within], sizes[src_classes[within]])
+
+    u, v=members[offsets[src_classes] + i], members[offsets[trg_classes] + j]
+    vertex_edges=numpy.empty(len(edge_index), dtype=edges.dtype)
+    vertex_edges['src_node']=numpy.minimum(u, v)
+    vertex_edges['trg_node']=numpy.maximum(u, v)
+    vertex_edges['weight']=edges['weight'][edge_index]
+    return vertex_edges
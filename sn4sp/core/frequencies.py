@@ -0,0 +1,488 @@
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+"""
+***********
+Frequencies
+***********
+Engines computing frequencies of attribute values required by Lin similarity:
+- number of agents similar to both vertices of a pair
+  (sharing categorical attributes shared by the vertices and
+  having ordinal attributes between the values of the vertices),
+- number of agents equal to a vertex.
+"""
+from __future__ import division, absolute_import, print_function
+
+__author__ = '\n'.join(['Sergiy Gogolenko <gogolenko@hlrs.de>',
+                        'Fabio Saracco <fabio@imt.it>'])
+
+__all__ = [ 'SampleFrequencies',
+            'ExactFrequencies',
+            'SketchFrequencies' ]
+
+import logging
+from itertools import islice
+import sys
+if sys.version_info[0] >= 3:
+    izip=zip
+else:
+    from itertools import izip
+
+from mpi4py import MPI
+import numpy
+
+def _count_similar(columns, attrs_u, attrs_v, num_categorical, num_ordinal, block_len=1<<22):
+    """ Numbers of rows (given by attribute `columns`) similar to both vertices of pairs with attributes `attrs_u` and `attrs_v`.
+
+    Pairs are processed in blocks, so that masks of similar rows hold at most `block_len` elements.
+    """
+    names=attrs_u.dtype.names
+    num_rows=len(columns[0])
+    counts=numpy.empty(len(attrs_u), dtype='i8')
+    num_block_pairs=max(1, block_len//max(num_rows, 1))
+    for start in xrange(0, len(attrs_u), num_block_pairs):
+        block_u, block_v=attrs_u[start:start+num_block_pairs], attrs_v[start:start+num_block_pairs]
+        similar_rows=numpy.ones((len(block_u), num_rows), dtype=bool)  # start with all rows as similar
+
+        # Select rows as similar if categorical attributes are the same to `u` and `v`
+        # If vertices share categorical attribute, the number of agents sharing this attribute is considered.
+        # TODO: ensure that we do not have to cut of by categorical_attrs
+        for column, name in islice(izip(columns, names), num_categorical):
+            attr_u, attr_v=block_u[name][:,numpy.newaxis], block_v[name][:,numpy.newaxis]
+            similar_rows&=(attr_u != attr_v) | (column == attr_u)
+
+        # Select rows as similar if ordinal attributes are between values for `u` and `v`.
+        # If vertices do not share an attribute and the attribute is ordinal,
+        # the number of agents sharing attributes between the two values is considered.
+        for column, name in islice(izip(columns, names), num_categorical, num_categorical+num_ordinal):
+            attr_u, attr_v=block_u[name][:,numpy.newaxis], block_v[name][:,numpy.newaxis]
+            similar_rows&=(numpy.minimum(attr_u, attr_v) <= column) & (column <= numpy.maximum(attr_u, attr_v))
+
+        counts[start:start+num_block_pairs]=numpy.count_nonzero(similar_rows, axis=1)
+    return counts
+
+def _pairs(u, v):
+    """ Vertices `u` and `v` (or arrays of them) as arrays of pairs, and the shape of results of queries. """
+    u, v=numpy.asarray(u), numpy.asarray(v)
+    return numpy.atleast_1d(u), numpy.atleast_1d(v), u.shape
+
+def _encode(column, start, stop, comm):
+    """ Encode values of the `column` with their indices in the sorted unique values.
+
+    Every process finds unique values in its slice ``[start:stop]`` of the column.
+
+    Returns
+    -------
+    values : numpy.array
+        Sorted unique values of the column
+    codes : numpy.array
+        Codes of all values of the column
+    """
+    values=numpy.unique(numpy.hstack(comm.allgather(numpy.unique(column[start:stop]))))
+    return values, numpy.searchsorted(values, column).astype(numpy.min_scalar_type(len(values)))
+
+class SampleFrequencies(object):
+    """
+    Frequencies of attribute values estimated on the sample of the population.
+
+    Every query scans the sample.
+
+    Parameters
+    ----------
+    graph : sn4sp.SimilarityGraph
+        Similarity network holding the sample
+    """
+    def __init__(self, graph):
+        self.graph=graph
+        self.profiles, self.profile_counts=None, None
+
+    @property
+    def size(self):
+        """ Number of agents the frequencies are estimated on. """
+        return self.graph.sample_size
+
+    def num_similar(self, u, v):
+        """ Number of agents (in the sample) similar to both vertices `u` and `v` (or to pairs of arrays `u` and `v`). """
+        graph=self.graph
+        u, v, shape=_pairs(u, v)
+        return _count_similar( graph.sampled_nongeo_attrs, graph.nongeo_attrs[u], graph.nongeo_attrs[v],
+                               graph.num_categorical, graph.num_ordinal ).reshape(shape)[()]
+
+    def num_equal(self, u):
+        """ Number of agents (in the sample) equal to vertex `u` (or to vertices of array `u`). """
+        vertex_attrs=self.graph.vertex_attrs
+        if self.profiles is None:
+            # Count unique rows of the sample once
+            self.profiles, self.profile_counts=numpy.unique(self.graph.sampled_vertex_attrs, return_counts=True)
+            self.profiles=self.profiles.astype(vertex_attrs.dtype)
+        attrs=vertex_attrs[u]
+        position=numpy.minimum(numpy.searchsorted(self.profiles, attrs), len(self.profiles) - 1)
+        return numpy.where(self.profiles[position] == attrs, self.profile_counts[position], 0)[()]
+
+    def report(self):
+        """ Report accuracy of the frequencies (collective call). Sampled frequencies are not audited. """
+        return None
+
+class ExactFrequencies(object):
+    """
+    Exact frequencies of attribute values over the whole population.
+
+    Every process aggregates its slice of the population into
+    - a cube of counts indexed by codes of categorical and ordinal attributes,
+    - counts of unique rows (profiles) of the attribute table,
+    and processes combine their aggregates with ``Allreduce``.
+    The cube holds an extra "any value" slot along every categorical axis
+    and prefix sums along ordinal axes, so queries take constant time.
+
+    Parameters
+    ----------
+    graph : sn4sp.SimilarityGraph
+        Similarity network
+    comm : mpi4py.MPI.Comm
+        MPI communicator
+    memory_budget : sn4sp.parallel.MemoryBudget
+        Memory budget of the process (if ``None``, use the budget of `graph`)
+
+    Raises
+    ------
+    ValueError : exception
+        The cube does not fit into the memory budget.
+    """
+    def __init__(self, graph, comm=MPI.COMM_WORLD, memory_budget=None):
+        memory_budget=memory_budget or graph.memory_budget
+        attrs=graph.nongeo_attrs
+        self.num_categorical=graph.num_categorical
+        self.num_ordinal=graph.num_ordinal
+        num_vertices=len(attrs)
+        rank, size=comm.Get_rank(), comm.Get_size()
+        start, stop=num_vertices*rank//size, num_vertices*(rank + 1)//size
+
+        # Encode attribute values with their indices in the sorted unique values of the population
+        self.codes, self.num_values=[], []
+        for attr_name in attrs.dtype.names:
+            values, codes=_encode(attrs[attr_name], start, stop, comm)
+            self.codes.append(codes)
+            self.num_values.append(len(values))
+
+        # NOTE: categorical axes hold extra "any value" slot,
+        #       ordinal axes hold extra leading zero slot for prefix sums
+        shape=tuple(num_values + 1 for num_values in self.num_values)
+        cube_size=int(numpy.prod(shape, dtype='f8'))*numpy.dtype('i8').itemsize
+        if not memory_budget.fits(cube_size):
+            raise ValueError( 'frequency cube of shape {0} ({1}MB) does not fit into memory budget'.\
+                              format(shape, cube_size>>20) )
+        logging.debug( 'frequency cube of shape {0} ({1}MB)'.format(shape, cube_size>>20) )
+
+        cube_index=[ codes[start:stop] if k < self.num_categorical else codes[start:stop].astype('i8') + 1
+                     for k, codes in enumerate(self.codes) ]
+        self.cube=numpy.bincount( numpy.ravel_multi_index(cube_index, shape),
+                                  minlength=int(numpy.prod(shape)) ).astype('i8').reshape(shape)
+        comm.Allreduce(MPI.IN_PLACE, self.cube, op=MPI.SUM)
+        for axis in xrange(self.num_categorical):
+            any_value=[slice(None)]*len(shape)
+            any_value[axis]=shape[axis] - 1
+            self.cube[tuple(any_value)]=numpy.sum(self.cube.take(xrange(shape[axis] - 1), axis=axis), axis=axis)
+        for axis in xrange(self.num_categorical, len(shape)):
+            numpy.cumsum(self.cube, axis=axis, out=self.cube)
+
+        # Corners of ordinal boxes for inclusion-exclusion (1 picks the upper bound of the range)
+        self.corners=numpy.array( [[(corner >> k) & 1 for k in xrange(self.num_ordinal)] \
+                                   for corner in xrange(1 << self.num_ordinal)], dtype=bool ).reshape(-1, self.num_ordinal)
+        self.signs=(-1)**(self.num_ordinal - numpy.sum(self.corners, axis=1))
+
+        # Count unique rows of the attribute table
+        vertex_attrs=graph.vertex_attrs
+        profiles=numpy.unique(numpy.hstack(comm.allgather(numpy.unique(vertex_attrs[start:stop])))).\
+                 astype(vertex_attrs.dtype)
+        profile_counts=numpy.bincount( numpy.searchsorted(profiles, vertex_attrs[start:stop]),
+                                       minlength=len(profiles) ).astype('i8')
+        comm.Allreduce(MPI.IN_PLACE, profile_counts, op=MPI.SUM)
+        self.profile_counts=profile_counts[numpy.searchsorted(profiles, vertex_attrs)].\
+                            astype(numpy.min_scalar_type(num_vertices))
+        self.num_vertices=num_vertices
+
+    @property
+    def size(self):
+        """ Number of agents the frequencies are computed on. """
+        return self.num_vertices
+
+    def num_similar(self, u, v):
+        """ Number of agents similar to both vertices `u` and `v` (or to pairs of arrays `u` and `v`). """
+        u, v, shape=_pairs(u, v)
+        # NOTE: corners of ordinal boxes are indexed along the 1st axis, pairs along the 2nd one
+        index=numpy.empty((len(self.codes), len(self.corners), len(u)), dtype='i8')
+        for k in xrange(self.num_categorical):
+            codes_u, codes_v=self.codes[k][u], self.codes[k][v]
+            index[k]=numpy.where(codes_u == codes_v, codes_u, self.num_values[k])
+        for k in xrange(self.num_categorical, len(self.codes)):
+            codes_u, codes_v=self.codes[k][u].astype('i8'), self.codes[k][v].astype('i8')
+            lower, upper=numpy.minimum(codes_u, codes_v), numpy.maximum(codes_u, codes_v) + 1
+            index[k]=numpy.where(self.corners[:,k - self.num_categorical,numpy.newaxis], upper, lower)
+        return numpy.dot(self.signs, self.cube[tuple(index)]).reshape(shape)[()]
+
+    def num_equal(self, u):
+        """ Number of agents equal to vertex `u` (or to vertices of array `u`). """
+        return self.profile_counts[u]
+
+    def report(self):
+        """ Report accuracy of the frequencies (collective call). Exact frequencies need no audit. """
+        return None
+
+class SketchFrequencies(object):
+    """
+    Approximate frequencies of attribute values based on count-min sketches.
+
+    Combinations of categorical attributes shared by vertices are hashed
+    (with tabulation hashing) to columns of a count-min sketch, whereas ordinal
+    attributes are aggregated into histograms with prefix sums along every ordinal axis
+    (counts of partially covered bins are interpolated linearly).
+    Profiles (unique rows) are counted with a separate count-min sketch.
+    Every process sketches its slice of rows and processes combine the sketches with ``Allreduce``.
+
+    With probability ``1 - delta``, hash collisions overestimate a count by at most ``error*size``.
+    If ordinal attributes have more values than bins fitting into the memory footprint,
+    interpolation within bins adds error, which is reported by `report`.
+    Sketching takes ``2**num_categorical`` passes over the rows.
+
+    Parameters
+    ----------
+    graph : sn4sp.SimilarityGraph
+        Similarity network
+    comm : mpi4py.MPI.Comm
+        MPI communicator
+    memory_budget : sn4sp.parallel.MemoryBudget
+        Memory budget of the process (if ``None``, use the budget of `graph`)
+    error : float
+        Error bound of count-min sketches relative to the number of sketched rows
+    delta : float
+        Probability to exceed the error bound
+    memory : int
+        Memory footprint of the sketches in bytes (if ``None``, a quarter of the available budget)
+    source : str
+        Rows to sketch: ``population`` or ``sample``
+    audit_size : int
+        Number of queries per process audited against exact counts by `report`
+    seed : int
+        Seed of hash functions (must be the same in all processes)
+
+    Raises
+    ------
+    ValueError : exception
+        Sketches with the requested error bound do not fit into the memory footprint.
+    """
+    def __init__(self, graph, comm=MPI.COMM_WORLD, memory_budget=None, error=1e-3, delta=1e-2, memory=None,
+                 source='population', audit_size=100, seed=0):
+        memory_budget=memory_budget or graph.memory_budget
+        self.comm=comm
+        self.graph=graph
+        self.num_categorical=graph.num_categorical
+        self.num_ordinal=graph.num_ordinal
+        self.error=error
+        nongeo_attr_names=list(graph.nongeo_attrs.dtype.names)
+        if source == 'population':
+            self.rows=graph.vertex_attrs
+        elif source == 'sample':
+            self.rows=graph.sampled_vertex_attrs
+        else:
+            raise ValueError( "Unknown source of frequencies '{0}'".format(source) )
+        num_vertices, num_rows=len(graph.vertex_attrs), len(self.rows)
+        rank, size=comm.Get_rank(), comm.Get_size()
+        start, stop=num_vertices*rank//size, num_vertices*(rank + 1)//size
+        self.row_start, self.row_stop=num_rows*rank//size, num_rows*(rank + 1)//size
+
+        # Encode attribute values of vertices and rows with the same codes
+        self.codes, self.num_values, row_codes=[], [], []
+        for attr_name in nongeo_attr_names:
+            values, codes=_encode(graph.nongeo_attrs[attr_name], start, stop, comm)
+            if source != 'population':
+                values=numpy.union1d(values, self.rows[attr_name])
+                codes=numpy.searchsorted(values, graph.nongeo_attrs[attr_name]).\
+                      astype(numpy.min_scalar_type(len(values)))
+            self.codes.append(codes)
+            self.num_values.append(len(values))
+            row_codes.append(numpy.searchsorted(values, self.rows[attr_name][self.row_start:self.row_stop]))
+
+        # Size sketches: width and depth are defined by error bounds, bins of ordinal axes -- by memory
+        self.width=1 << int(numpy.ceil(numpy.log2(numpy.e/error)))
+        self.depth=int(numpy.ceil(numpy.log(1./delta)))
+        max_cells=memory//8 if memory is not None else memory_budget.fit_length(8, 1 << 40)
+        max_cells-=self.depth*self.width  # profile sketch
+        self.num_bins=list(self.num_values[self.num_categorical:])
+        while self.depth*self.width*numpy.prod([num_bins + 1 for num_bins in self.num_bins], dtype='f8') > max_cells:
+            if max(self.num_bins or [1]) == 1:
+                raise ValueError( 'count-min sketch ({0}x{1}) with error {2} does not fit into {3} bytes'.\
+                                  format(self.depth, self.width, error, 8*max_cells) )
+            k=int(numpy.argmax(self.num_bins))
+            self.num_bins[k]=(self.num_bins[k] + 1)//2
+        ordinal_shape=tuple(num_bins + 1 for num_bins in self.num_bins)
+        logging.debug( 'count-min sketch {0}x{1}, ordinal bins {2}'.format(self.depth, self.width, self.num_bins) )
+
+        # Tabulation hashing: random words for every (depth, attribute, value) and (depth, mask of shared attributes)
+        random_state=numpy.random.RandomState(seed)
+        self.value_words=[ [ random_state.randint(0, 1 << 62, size=self.num_values[k], dtype='i8') \
+                             for k in xrange(self.num_categorical) ] for d in xrange(self.depth) ]
+        self.mask_words=[ random_state.randint(0, 1 << 62, size=1 << self.num_categorical, dtype='i8') \
+                          for d in xrange(self.depth) ]
+        itemsize=self.rows.dtype.itemsize
+        byte_words=random_state.randint(0, 1 << 62, size=(self.depth, itemsize, 256), dtype='i8')
+
+        # Sketch categorical combinations of the rows with histograms of their ordinal attributes
+        num_ordinal_cells=int(numpy.prod(ordinal_shape))
+        ordinal_index=numpy.ravel_multi_index( [ codes.astype('i8')*num_bins//num_values + 1 for codes, num_bins, num_values \
+                                                 in izip(row_codes[self.num_categorical:], self.num_bins,
+                                                         self.num_values[self.num_categorical:]) ],
+                                               ordinal_shape ) if self.num_ordinal else 0
+        self.sketch=numpy.zeros((self.depth, self.width*num_ordinal_cells), dtype='i8')
+        for mask in xrange(1 << self.num_categorical):
+            for d in xrange(self.depth):
+                words=numpy.full(self.row_stop - self.row_start, self.mask_words[d][mask], dtype='i8')
+                for k in xrange(self.num_categorical):
+                    if (mask >> k) & 1:
+                        words^=self.value_words[d][k][row_codes[k]]
+                self.sketch[d]+=numpy.bincount( (words & (self.width - 1))*num_ordinal_cells + ordinal_index,
+                                                minlength=self.width*num_ordinal_cells )
+        comm.Allreduce(MPI.IN_PLACE, self.sketch, op=MPI.SUM)
+        self.sketch=self.sketch.reshape((self.depth, self.width) + ordinal_shape)
+        for axis in xrange(2, self.sketch.ndim):
+            numpy.cumsum(self.sketch, axis=axis, out=self.sketch)
+
+        # Sketch profiles of the rows and estimate profile counts of all vertices
+        def profile_buckets(table):
+            """ Buckets of rows of the `table` in profile sketches (hashed by bytes of rows). """
+            buckets=numpy.empty((self.depth, len(table)), dtype='i8')
+            for chunk_start in xrange(0, len(table), 1 << 16):
+                data=numpy.ascontiguousarray(table[chunk_start:chunk_start + (1 << 16)]).view(numpy.uint8).\
+                     reshape(-1, itemsize)
+                for d in xrange(self.depth):
+                    words=numpy.zeros(len(data), dtype='i8')
+                    for position in xrange(itemsize):
+                        words^=byte_words[d, position][data[:,position]]
+                    buckets[d, chunk_start:chunk_start + len(data)]=words & (self.width - 1)
+            return buckets
+        profile_sketch=numpy.zeros((self.depth, self.width), dtype='i8')
+        for d, buckets in enumerate(profile_buckets(self.rows[self.row_start:self.row_stop])):
+            profile_sketch[d]=numpy.bincount(buckets, minlength=self.width)
+        comm.Allreduce(MPI.IN_PLACE, profile_sketch, op=MPI.SUM)
+        buckets=profile_buckets(graph.vertex_attrs)
+        self.profile_counts=numpy.min(profile_sketch[numpy.arange(self.depth)[:,numpy.newaxis], buckets], axis=0).\
+                            astype(numpy.min_scalar_type(num_rows))
+        self.num_rows=num_rows
+
+        # Corners of ordinal boxes interpolated within bins: lower bound (floor, ceil), upper bound (floor, ceil)
+        self.corners=numpy.array( [[(corner >> 2*k) & 3 for k in xrange(self.num_ordinal)] \
+                                   for corner in xrange(1 << 2*self.num_ordinal)], dtype='i8' ).\
+                     reshape(-1, self.num_ordinal)
+
+        # Reservoir of queries audited by `report`
+        self.audit_size=audit_size
+        self.audited=numpy.empty((0, 2), dtype='i8')
+        self.num_queries=0
+        self.random_state=numpy.random.RandomState(seed + rank + 1)
+
+    @property
+    def size(self):
+        """ Number of agents the frequencies are estimated on. """
+        return self.num_rows
+
+    def _estimate_similar(self, u, v, block_len=1<<20):
+        """ Estimate numbers of agents similar to both vertices of pairs of arrays `u` and `v` with sketches.
+
+        Pairs are processed in blocks, so that sketch cells gathered for a block hold at most `block_len` elements.
+        """
+        counts=numpy.empty(len(u), dtype='i8')
+        num_block_pairs=max(1, block_len//(self.depth*len(self.corners)))
+        for start in xrange(0, len(u), num_block_pairs):
+            block_u, block_v=u[start:start+num_block_pairs], v[start:start+num_block_pairs]
+
+            # Hash combinations of categorical attributes shared by vertices of pairs
+            shared=[]
+            mask=numpy.zeros(len(block_u), dtype='i8')
+            for k in xrange(self.num_categorical):
+                codes_u=self.codes[k][block_u]
+                shared.append((codes_u == self.codes[k][block_v], codes_u))
+                mask|=shared[k][0].astype('i8') << k
+            buckets=numpy.empty((self.depth, len(block_u)), dtype='i8')
+            for d in xrange(self.depth):
+                words=self.mask_words[d][mask]
+                for k, (is_shared, codes_u) in enumerate(shared):
+                    words^=numpy.where(is_shared, self.value_words[d][k][codes_u], 0)
+                buckets[d]=words & (self.width - 1)
+            # NOTE: depths are indexed along the 1st axis, pairs along the 2nd one, corners along the 3rd one
+            index=[numpy.arange(self.depth)[:,numpy.newaxis,numpy.newaxis], buckets[:,:,numpy.newaxis]]
+
+            # Interpolate prefix sums at continuous bin coordinates of the range bounds
+            weights=numpy.ones((len(block_u), len(self.corners)))
+            for k in xrange(self.num_ordinal):
+                num_bins, num_values=self.num_bins[k], self.num_values[self.num_categorical + k]
+                codes_u=self.codes[self.num_categorical + k][block_u].astype('i8')
+                codes_v=self.codes[self.num_categorical + k][block_v].astype('i8')
+                options_index=numpy.empty((len(block_u), 4), dtype='i8')
+                options_weights=numpy.empty((len(block_u), 4))
+                for option, (bound, sign) in enumerate(( (numpy.minimum(codes_u, codes_v), -1.),
+                                                         (numpy.maximum(codes_u, codes_v) + 1, 1.) )):
+                    position=bound*num_bins/num_values
+                    bin_index=numpy.minimum(position.astype('i8'), num_bins - 1)
+                    fraction=position - bin_index
+                    options_index[:,2*option], options_index[:,2*option+1]=bin_index, bin_index + 1
+                    options_weights[:,2*option], options_weights[:,2*option+1]=sign*(1. - fraction), sign*fraction
+                corners=self.corners[:,k]
+                index.append(options_index[:,corners][numpy.newaxis])
+                weights*=options_weights[:,corners]
+            estimates=numpy.min(numpy.sum(self.sketch[tuple(index)]*weights, axis=2), axis=0)
+            counts[start:start+num_block_pairs]=numpy.maximum(0, numpy.floor(estimates + 0.5))
+        return counts
+
+    def num_similar(self, u, v):
+        """ Estimate number of agents similar to both vertices `u` and `v` (or to pairs of arrays `u` and `v`). """
+        u, v, shape=_pairs(u, v)
+        # Keep a uniform sample of queries (reservoir sampling)
+        num_filled=min(len(u), self.audit_size - len(self.audited))
+        self.audited=numpy.vstack((self.audited, numpy.column_stack((u[:num_filled], v[:num_filled]))))
+        positions=( self.random_state.random_sample(len(u) - num_filled)*\
+                    numpy.arange(self.num_queries + num_filled + 1, self.num_queries + len(u) + 1) ).astype('i8')
+        replaced=positions < self.audit_size
+        # NOTE: later queries replace earlier ones at the same position as in sequential reservoir sampling
+        self.audited[positions[replaced]]=numpy.column_stack((u[num_filled:][replaced], v[num_filled:][replaced]))
+        self.num_queries+=len(u)
+        return self._estimate_similar(u, v).reshape(shape)[()]
+
+    def num_equal(self, u):
+        """ Estimate number of agents equal to vertex `u` (or to vertices of array `u`). """
+        return self.profile_counts[u]
+
+    def report(self):
+        """ Audit estimates of the audited queries against exact counts and log the errors (collective call).
+
+        Returns
+        -------
+        errors : dict
+            Maximum and mean absolute errors relative to the number of sketched rows
+            for numbers of similar (``similar_max``, ``similar_mean``) and equal (``equal_max``, ``equal_mean``) agents.
+        """
+        graph=self.graph
+        pairs=numpy.vstack(self.comm.allgather(self.audited))
+        vertices=numpy.unique(pairs)
+        rows=self.rows[self.row_start:self.row_stop]
+        columns=[rows[attr_name] for attr_name in graph.nongeo_attrs.dtype.names]
+        exact_similar=_count_similar( columns, graph.nongeo_attrs[pairs[:,0]], graph.nongeo_attrs[pairs[:,1]],
+                                      self.num_categorical, self.num_ordinal )
+        exact_equal=numpy.array([numpy.sum(rows==graph.vertex_attrs[u]) for u in vertices], dtype='i8')
+        self.comm.Allreduce(MPI.IN_PLACE, exact_similar, op=MPI.SUM)
+        self.comm.Allreduce(MPI.IN_PLACE, exact_equal, op=MPI.SUM)
+
+        similar_errors=numpy.abs(self._estimate_similar(pairs[:,0], pairs[:,1]) - exact_similar)/self.size
+        equal_errors=numpy.abs(self.profile_counts[vertices].astype('i8') - exact_equal)/self.size
+        errors={ 'similar_max' : numpy.max(similar_errors) if len(pairs) else 0.,
+                 'similar_mean' : numpy.mean(similar_errors) if len(pairs) else 0.,
+                 'equal_max' : numpy.max(equal_errors) if len(vertices) else 0.,
+                 'equal_mean' : numpy.mean(equal_errors) if len(vertices) else 0. }
+        if self.comm.Get_rank() == 0:
+            logging.info( 'sketched frequencies audit on {0} pairs: errors of similar counts {1:.2e} (max) {2:.2e} (mean), '\
+                          'errors of equal counts {3:.2e} (max) {4:.2e} (mean) of {5} rows (bound {6:.2e})'.\
+                          format( len(pairs), errors['similar_max'], errors['similar_mean'],
+                                  errors['equal_max'], errors['equal_mean'], self.size, self.error ) )
+        return errors
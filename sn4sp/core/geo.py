@@ -0,0 +1,197 @@
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+"""
+***
+Geo
+***
+Vectorized geo-spatial routines shared by the similarity network and the preprocessors.
+"""
+from __future__ import division, absolute_import, print_function
+
+__author__ = '\n'.join(['Sergiy Gogolenko <gogolenko@hlrs.de>',
+                        'Fabio Saracco <fabio@imt.it>'])
+
+__all__ = [ 'R_EARTH',
+            'central_angle',
+            'geo_scaling',
+            'geo_damping',
+            'geo_cutoff',
+            'min_box_angle',
+            'space_filling_keys' ]
+
+import numpy
+
+R_EARTH=6.3781*10**6    # Earth radius in meters
+
+def central_angle(lon1, lat1, lon2, lat2):
+    """ Central angle between points on a sphere (Vincenty formula).
+
+    Parameters
+    ----------
+    lon1, lat1, lon2, lat2 : float or numpy.array
+        Longitudes and latitudes of the points in radians
+
+    Returns
+    -------
+    angle : float or numpy.array
+        Central angle in radians (multiply by `R_EARTH` to get the distance in meters).
+    """
+    dlon=lon1 - lon2
+    cos_lat1, cos_lat2, cos_dlon=numpy.cos(lat1), numpy.cos(lat2), numpy.cos(dlon)
+    sin_lat1, sin_lat2, sin_dlon=numpy.sin(lat1), numpy.sin(lat2), numpy.sin(dlon)
+    y=numpy.sqrt((cos_lat2*sin_dlon)**2 + (cos_lat1*sin_lat2 - sin_lat1*cos_lat2*cos_dlon)**2)
+    x=sin_lat1*sin_lat2 + cos_lat1*cos_lat2*cos_dlon
+    return numpy.arctan2(y, x)
+
+def geo_scaling(hss, damping):
+    """ Factor converting central angles to adimensional distances damped by geo-damping.
+
+    Parameters
+    ----------
+    hss : float
+        Half-similarity scale in meters
+    damping : float
+        Damping coefficient (if 0 use exponential damping)
+    """
+    # Normalization constant (half-similarity scale)
+    hss_0=float(hss)/(numpy.power(2, damping)-1) if 0 < damping and damping < 1 else hss
+    return R_EARTH/hss_0
+
+def geo_damping(angle, scaling, damping):
+    """ Geo-induced probability of edge between vertices separated by the central angle.
+
+    Parameters
+    ----------
+    angle : float
+        Central angle between the vertices in radians
+    scaling : float or numpy.array
+        Scaling factor(s) produced by `geo_scaling`
+    damping : float or numpy.array
+        Damping coefficient(s) (if 0 use exponential damping)
+
+    Returns
+    -------
+    probability : float or numpy.array
+        Probability for every (scaling, damping) setting
+    """
+    if numpy.ndim(damping) == 0:
+        if damping > 0.:
+            # Scale distance by half-similarity scale to make it adimensional and damp by a factor 2.
+            return (1. + scaling*angle)**(-damping)
+        # Compute geo-similarity with exponential damping.
+        return 2**(-scaling*angle)
+    distance=scaling*angle
+    return numpy.where(damping > 0., (1. + distance)**(-damping), numpy.exp2(-distance))
+
+def geo_cutoff(scaling, damping, threshold):
+    """ Central angle from which geo-induced probability does not exceed the threshold.
+
+    Parameters
+    ----------
+    scaling : float or numpy.array
+        Scaling factor(s) produced by `geo_scaling`
+    damping : float or numpy.array
+        Damping coefficient(s) (if 0 use exponential damping)
+    threshold : float
+        Threshold of geo-induced probability
+
+    Returns
+    -------
+    angle : float or numpy.array
+        Cutoff angle in radians for every (scaling, damping) setting
+    """
+    damping=numpy.asarray(damping, dtype='f8')
+    # Invert `geo_damping`: (1 + s*angle)**(-d) <= threshold and 2**(-s*angle) <= threshold
+    distance=numpy.where( damping > 0., threshold**(-1./numpy.where(damping > 0., damping, 1.)) - 1.,
+                          -numpy.log2(threshold) )
+    return distance/scaling
+
+def min_box_angle(boxes1, boxes2):
+    """ Lower bound of central angles between points of 2 bounding boxes.
+
+    Parameters
+    ----------
+    boxes1, boxes2 : numpy.array
+        Bounding boxes given by (min longitude, max longitude, min latitude, max latitude)
+        in radians along the last axis
+
+    Returns
+    -------
+    angle : numpy.array
+        Lower bound of central angle in radians for every pair of boxes
+    """
+    lon_min1, lon_max1, lat_min1, lat_max1=numpy.moveaxis(boxes1, -1, 0)
+    lon_min2, lon_max2, lat_min2, lat_max2=numpy.moveaxis(boxes2, -1, 0)
+    dlat=numpy.maximum(0., numpy.maximum(lat_min2 - lat_max1, lat_min1 - lat_max2))
+    dlon=numpy.maximum(0., numpy.maximum(lon_min2 - lon_max1, lon_min1 - lon_max2))
+    # NOTE: boxes may be closer across the antimeridian
+    dlon=numpy.minimum( dlon, numpy.maximum(0., 2*numpy.pi - (numpy.maximum(lon_max1, lon_max2) - \
+                                                             numpy.minimum(lon_min1, lon_min2))) )
+    max_abs_lat=numpy.max(numpy.abs([lat_min1, lat_max1, lat_min2, lat_max2]), axis=0)
+    # Haversine of the angle is bounded by the latitude gap and
+    # the longitude gap at the latitude farthest from the equator
+    haversine=numpy.sin(dlat/2)**2 + (numpy.cos(max_abs_lat)*numpy.sin(numpy.minimum(dlon, numpy.pi)/2))**2
+    return 2*numpy.arcsin(numpy.sqrt(numpy.minimum(haversine, 1.)))
+
+def _hilbert_keys(x, y, bits):
+    """ Positions of integer points on the Hilbert curve filling ``2**bits`` by ``2**bits`` grid. """
+    side=1 << bits
+    keys=numpy.zeros(len(x), dtype='i8')
+    s=side >> 1
+    while s > 0:
+        rx, ry=(x & s) > 0, (y & s) > 0
+        keys+=s*s*((3*rx.astype('i8')) ^ ry)
+        # Rotate the quadrant
+        flip=~ry & rx
+        x, y=numpy.where(flip, side - 1 - x, x), numpy.where(flip, side - 1 - y, y)
+        x, y=numpy.where(ry, x, y), numpy.where(ry, y, x)
+        s>>=1
+    return keys
+
+def _morton_keys(x, y, bits):
+    """ Positions of integer points on the Morton (Z-order) curve (interleaved bits of coordinates). """
+    keys=numpy.zeros(len(x), dtype='i8')
+    for bit in xrange(bits):
+        keys|=((x >> bit) & 1) << (2*bit) | ((y >> bit) & 1) << (2*bit + 1)
+    return keys
+
+def space_filling_keys(lon, lat, curve='hilbert', bits=16):
+    """ Positions of points on a space-filling curve (close points get close positions).
+
+    Coordinates are quantized on ``2**bits`` by ``2**bits`` grid spanning the bounding box of the points.
+
+    Parameters
+    ----------
+    lon, lat : numpy.array
+        Longitudes and latitudes of the points
+    curve : str
+        Space-filling curve: ``hilbert`` or ``morton``
+    bits : int
+        Number of bits per coordinate (at most 31)
+
+    Returns
+    -------
+    keys : numpy.array
+        Positions of the points on the curve
+
+    Raises
+    ------
+    ValueError : exception
+        Unknown space-filling curve.
+    """
+    if curve not in ('hilbert', 'morton'):
+        raise ValueError( "Unknown space-filling curve '{0}'".format(curve) )
+    lon, lat=numpy.asarray(lon, dtype='f8'), numpy.asarray(lat, dtype='f8')
+    if len(lon) == 0:
+        return numpy.zeros(0, dtype='i8')
+    def quantize(values):
+        span=values.max() - values.min()
+        scale=((1 << bits) - 1)/span if span > 0 else 0.
+        return ((values - values.min())*scale).astype('i8')
+    x, y=quantize(lon), quantize(lat)
+    return _hilbert_keys(x, y, bits) if curve == 'hilbert' else _morton_keys(x, y, bits)
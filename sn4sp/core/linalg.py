@@ -0,0 +1,65 @@
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+"""
+******
+Linalg
+******
+Matrix-free linear operators of similarity networks (e.g., for spectral analysis with ``scipy.sparse.linalg``).
+
+Products are collective calls: all processes must apply the operator to the same vectors,
+e.g., run the same solver with the same deterministic starting vector.
+"""
+from __future__ import division, absolute_import, print_function
+
+__author__ = '\n'.join(['Sergiy Gogolenko <gogolenko@hlrs.de>',
+                        'Fabio Saracco <fabio@imt.it>'])
+
+__all__ = [ 'probability_operator' ]
+
+try:
+    from scipy.sparse.linalg import LinearOperator
+except ImportError:
+    LinearOperator=None
+
+def probability_operator(G, setting=0, block_len=1<<16, *args, **kwargs):
+    """ Matrix of edge probabilities of the similarity network as a matrix-free linear operator.
+
+    Requires ``scipy``.
+
+    Parameters
+    ----------
+    G : sn4sp.SimilarityGraph
+        Similarity network
+    setting : int
+        Index of the (hss, damping) setting
+    block_len : int
+        Number of pairs of vertices evaluated at once
+
+    Other arguments (e.g., ``scheduning``) are passed to ``G.matmat``.
+
+    Returns
+    -------
+    operator : scipy.sparse.linalg.LinearOperator
+        Symmetric operator whose products are computed with ``G.matmat``
+
+    Raises
+    ------
+    ImportError : exception
+        ``scipy`` is not available.
+
+    Examples
+    --------
+    >>> from scipy.sparse.linalg import eigsh
+    >>> A=probability_operator(G)
+    >>> spectral_radius=eigsh(A, k=1, v0=numpy.ones(len(G)), return_eigenvectors=False)[0]
+    """
+    if LinearOperator is None:
+        raise ImportError( 'scipy is required for linear operators of similarity networks' )
+    def matmat(X):
+        return G.matmat(X, setting, block_len, *args, **kwargs)
+    return LinearOperator( (len(G), len(G)), matvec=matmat, rmatvec=matmat, matmat=matmat, dtype='f8' )
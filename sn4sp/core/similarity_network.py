@@ -10,6 +10,9 @@
 from __future__ import division, absolute_import, print_function
 
 from sn4sp import parallel
+from sn4sp.core import geo
+from sn4sp.core.frequencies import SampleFrequencies, ExactFrequencies, SketchFrequencies
+from sn4sp.core.cache import LRUCache, RowBlockCache
 
 # TODO: switch from logging to warnings in library core
 import warnings
@@ -23,15 +26,28 @@ import numpy
 #       so log and log2 are interchangeable.
 from math import log as log2
 from math import sqrt
+from math import cos, sin
 from math import atan2 as arctan2
 from itertools import islice
 from itertools import islice
+from functools import partial
 import sys
 if sys.version_info[0] >= 3:
     izip=zip
 else:
     from itertools import izip
 
+def _accumulate(totals, indices, values):
+    """ Add values to totals at (repeated) indices. """
+    if len(indices) == 0:
+        return
+    first, last=indices.min(), indices.max() + 1
+    if last - first <= 4*len(indices):
+        totals[first:last]+=numpy.bincount(indices - first, weights=values, minlength=last - first)
+    else:
+        unique_indices, inverse=numpy.unique(indices, return_inverse=True)
+        totals[unique_indices]+=numpy.bincount(inverse, weights=values)
+
 class SimilarityGraph:
     """
     Class for probabilistic (undirected) graph model based on Lin similarity
@@ -53,9 +69,39 @@ class SimilarityGraph:
         Damping coefficient (if 0 use exponential damping)
     sample_fraction : float
         Percentage of the population
+    memory_budget : sn4sp.parallel.MemoryBudget
+        Memory budget of the process for precomputed caches
+    sample : numpy.array
+        Attribute values of the sample used to estimate Lin similarity
+    settings : list
+        (hss, damping) pairs evaluated in a single pass
+    frequencies : str
+        Frequencies for Lin similarity: ``sample`` (estimated on the sample), ``exact`` or ``sketch``
+    frequencies_options : dict
+        Options of the frequency engine
+    distance_cache_size : int
+        Maximum number of distances between unique locations memoized per location table
+    ordering : str
+        Space-filling curve (``hilbert`` or ``morton``) which orders vertices by locations
+    ordering_locations : int
+        Index of the (longitude, latitude) pair of geo-attributes used to order vertices
+    tile_size : int
+        Number of consecutive (ordered) vertices in a tile with a bounding box
+    row_cache_size : int
+        Maximum number of rows of edge probabilities memoized by `row` and `neighbors`
+
+    Notes
+    -----
+    Edge probabilities do not depend on the order of vertices (see `lin_similarity`).
+    This changes output compared with networks computed by former versions: edges whose first vertex
+    (``src_node``) has no equal agents in the sample, while the second one (``trg_node``) has,
+    get a half of their former probabilities. Probabilities of all other edges are unchanged.
     """
     R_EARTH=6.3781*10**6    # Earth radius in meters
-    def __init__(self, attr_table, attr_types, attr_names=None, comm=MPI.COMM_WORLD, hss=5000, damping=0, sample_fraction=1e-1):
+    def __init__(self, attr_table, attr_types, attr_names=None, comm=MPI.COMM_WORLD, hss=5000, damping=0, sample_fraction=1e-1,
+                 memory_budget=None, sample=None, settings=None,
+                 frequencies='sample', frequencies_options=None, distance_cache_size=1<<18,
+                 ordering=None, ordering_locations=-1, tile_size=256, row_cache_size=16):
         """
         Initialize a probabilistic (undirected) graph model based on Lin similarity
         with geo-spatial damping.
@@ -76,21 +122,61 @@ class SimilarityGraph:
             Damping coefficient (if 0 use exponential damping)
         sample_fraction : float
             Percentage of the population
+        memory_budget : sn4sp.parallel.MemoryBudget
+            Memory budget of the process for precomputed caches
+            (if ``None``, the caches are limited by the available system memory)
+        sample : numpy.array
+            Attribute values of the sample used to estimate Lin similarity
+            (e.g., sample of the network which is updated incrementally).
+            If ``None``, sample a `sample_fraction` of the population at random.
+        settings : list
+            (hss, damping) pairs evaluated in a single pass (overrides `hss` and `damping`).
+            If several settings are given, edge probabilities become arrays with
+            a probability per setting.
+        frequencies : str
+            Frequencies of attribute values for Lin similarity:
+            ``sample`` -- estimate frequencies by scanning the sample for every pair,
+            ``exact`` -- aggregate frequencies over the whole population in parallel
+            (see `sn4sp.core.frequencies.ExactFrequencies`),
+            ``sketch`` -- approximate frequencies with count-min sketches
+            (see `sn4sp.core.frequencies.SketchFrequencies`).
+        frequencies_options : dict
+            Keyword arguments of the frequency engine (e.g., ``{'error' : 1e-4}`` for sketches)
+        distance_cache_size : int
+            Maximum number of distances between unique locations memoized per location table
+            (if the dense matrix of distances does not fit into the memory budget)
+        ordering : str
+            If given, iterate over pairs of vertices ordered along the space-filling curve
+            (``hilbert`` or ``morton``) by tiles of `tile_size` vertices, and skip tiles
+            whose bounding boxes are too far apart for any pair to pass the geo-damping cutoff.
+            Edges are still reported with the original indices of vertices.
+        ordering_locations : int
+            Index of the (longitude, latitude) pair of geo-attributes used to order vertices
+            (the last pair, which holds households in preprocessed populations, by default)
+        tile_size : int
+            Number of consecutive (ordered) vertices in a tile
+        row_cache_size : int
+            Maximum number of rows of edge probabilities memoized by `row` and `neighbors`
+            (rows are stored sparse, by vertices with non-zero probabilities)
         """
         self.comm=comm
+        self.memory_budget=memory_budget or parallel.MemoryBudget(comm=comm)
         comm_rank=self.comm.Get_rank()
 
         num_vertices=len(attr_table)
 
-        self.damping=damping
-        self.hss=hss
+        # NOTE: Only geo-damping depends on (hss, damping), so distances and Lin similarities
+        #       are shared by all settings
+        self.settings=[(hss, damping)] if settings is None else [tuple(setting) for setting in settings]
+        if len(self.settings) == 0:
+            raise ValueError( "at least one (hss, damping) setting is required" )
+        self.hss, self.damping=self.settings[0]
 
         self.similarity_threshold=1e-6
 
-        # Normalization constant (half-similarity scale)
-        hss_0=float(hss)/(numpy.power(2, self.damping)-1) \
-               if 0 < self.damping and self.damping < 1 else hss
-        self.geo_scaling=self.R_EARTH/hss_0
+        self.geo_scaling=geo.geo_scaling(self.hss, self.damping)
+        self.geo_scalings=numpy.array([geo.geo_scaling(h, d) for h, d in self.settings])
+        self.dampings=numpy.array([d for _, d in self.settings], dtype='f8')
 
         # Group attribute names by types
         attr_names=numpy.array(attr_names or attr_table.dtype.names)
@@ -115,17 +201,48 @@ class SimilarityGraph:
         # logging.debug( 'geo-attributes: [{0}] [shape={1}]'.\
         #                format(",".join(attr_name_groups['g']), self.geo_attrs.shape) )
 
+        # Deduplicate locations (e.g., members of a household share its coordinates):
+        # every (lon,lat) pair of geo-attributes gets a table of unique locations
+        # with longitudes, cosines and sines of latitudes, and vertices refer to locations by ids.
+        self.locations, location_ids=[], []
+        for k in xrange(0, self.geo_attrs.shape[1], 2):
+            coords, ids=numpy.unique(self.geo_attrs[:,k:k+2].astype('f8'), axis=0, return_inverse=True)
+            self.locations.append((coords[:,0], numpy.cos(coords[:,1]), numpy.sin(coords[:,1])))
+            location_ids.append(ids)
+        self.location_ids=numpy.array(location_ids).reshape(len(location_ids), num_vertices).T.\
+                          astype(numpy.min_scalar_type(max([len(coords) for coords, _, _ in self.locations] or [0])))
+        logging.debug( 'unique locations: {0}'.format([len(coords) for coords, _, _ in self.locations]) )
+        self.distance_cache_size=distance_cache_size
+        self.row_cache=LRUCache(row_cache_size)
+
+        # Order vertices along the space-filling curve, so that tiles of consecutive vertices are compact
+        self.ordering, self.tile_size=ordering, tile_size
+        if ordering is None:
+            self.order=None
+        else:
+            longitudes, cos_latitudes, sin_latitudes=self.locations[ordering_locations]
+            keys=geo.space_filling_keys(longitudes, numpy.arctan2(sin_latitudes, cos_latitudes), ordering)
+            self.order=numpy.argsort(keys[self.location_ids[:,ordering_locations]], kind='mergesort')
+            self.tile_boxes=self._tile_boxes()
+
         # Prepare representative sample of the original synthetic population
         # in order to reduce time to compute Lin similarity.
         # Take the sample to be a `sample_fraction` fraction of the original dataset.
         sample_size=max(100, int(num_vertices*sample_fraction))
-        if sample_size < num_vertices:
+        if sample is not None:  # Use the given (e.g., frozen) sample
+            sample=numpy.asarray(sample).astype(attr_table.dtype)
+            self.sampled_nongeo_attrs=sample[nongeo_attr_names]
+            self.sampled_geo_attrs=numpy.array( [numpy.radians(sample[attr_name]) \
+                                                 for attr_name in attr_name_groups['g']] ).T
+            self.sample_mask=None
+        elif sample_size < num_vertices:
             if comm_rank==0:
-                sampled_indices=numpy.random.choice(num_vertices, sample_size, replace=False)
+                sampled_indices=numpy.random.choice(num_vertices, sample_size, replace=False).astype('i8')
             else:
-                sampled_indices=numpy.empty(sample_size, dtype='i') #numpy.int
+                sampled_indices=numpy.empty(sample_size, dtype='i8')
             # Broadcast the list of the sampled agents between all processes.
-            self.comm.Bcast([sampled_indices, sample_size, MPI.INT], root=0)
+            # NOTE: MPI type must match the type of indices, otherwise processes get different samples
+            self.comm.Bcast([sampled_indices, sample_size, MPI.INT64_T], root=0)
             # Select sampled attributes
             self.sampled_nongeo_attrs=self.nongeo_attrs[sampled_indices]
             self.sampled_geo_attrs=self.geo_attrs[sampled_indices]
@@ -142,67 +259,189 @@ class SimilarityGraph:
                                    for attr_name in nongeo_attr_names]
 
         # TODO: remove when not needed
-        self.sampled_vertex_attrs=attr_table[self.sample_mask]
+        self.sampled_vertex_attrs=attr_table[self.sample_mask] if sample is None else sample
         self.vertex_attrs=attr_table
 
+        frequencies_options=frequencies_options or {}
+        if frequencies == 'sample':
+            self.frequencies=SampleFrequencies(self, **frequencies_options)
+        elif frequencies == 'exact':
+            self.frequencies=ExactFrequencies(self, comm, **frequencies_options)
+        elif frequencies == 'sketch':
+            self.frequencies=SketchFrequencies(self, comm, **frequencies_options)
+        else:
+            raise ValueError( "Unknown frequencies '{0}'".format(frequencies) )
+
+        self.build_caches()
+
+    def _tile_boxes(self):
+        """ Bounding boxes (min longitude, max longitude, min latitude, max latitude) of every location table
+        in every tile of ordered vertices (array of shape ``(num_tiles, num_location_tables, 4)``). """
+        starts=numpy.arange(0, len(self.order), self.tile_size)
+        boxes=numpy.empty((len(starts), len(self.locations), 4))
+        for k, (longitudes, cos_latitudes, sin_latitudes) in enumerate(self.locations):
+            ids=self.location_ids[self.order,k]
+            latitudes=numpy.arctan2(sin_latitudes, cos_latitudes)[ids]
+            boxes[:,k,0]=numpy.minimum.reduceat(longitudes[ids], starts)
+            boxes[:,k,1]=numpy.maximum.reduceat(longitudes[ids], starts)
+            boxes[:,k,2]=numpy.minimum.reduceat(latitudes, starts)
+            boxes[:,k,3]=numpy.maximum.reduceat(latitudes, starts)
+        return boxes
+
+    def build_caches(self):
+        """ Precompute data structures which speed up evaluation of edge probabilities.
+
+        For every location table, distances between unique locations are stored in a dense matrix
+        if it fits into the memory budget of the process (which is not the case if the budget is unknown).
+        Blocks of rows of the matrix are computed on first access, so every process computes
+        only distances from locations of vertices in its rows.
+        Otherwise, distances are memoized in a bounded LRU cache.
+        """
+        self.distance_matrices, self.distance_caches=[], []
+        for k, (longitudes, cos_latitudes, sin_latitudes) in enumerate(self.locations):
+            matrix_size=len(longitudes)**2*numpy.dtype('f8').itemsize
+            if self.memory_budget.fits(matrix_size, fraction=0.25, unknown=False):
+                # NOTE: compute distances by blocks of rows to limit size of temporary arrays
+                block_len=max(1, (1<<20)//max(1, len(longitudes)))
+                self.distance_matrices.append( RowBlockCache( (len(longitudes), len(longitudes)),
+                                                              partial(self._location_distance_rows, k), block_len ) )
+                self.distance_caches.append(None)
+            else:
+                logging.debug( 'distance matrix ({0} bytes) does not fit into memory budget, use LRU cache'.\
+                               format(matrix_size) )
+                self.distance_matrices.append(None)
+                self.distance_caches.append(LRUCache(self.distance_cache_size))
+
+    def _location_distance_rows(self, k, start, stop):
+        """ Central angles between locations ``[start, stop)`` and all locations of the location table `k`. """
+        longitudes, cos_latitudes, sin_latitudes=self.locations[k]
+        latitudes=numpy.arctan2(sin_latitudes, cos_latitudes)
+        return geo.central_angle( longitudes[start:stop,numpy.newaxis], latitudes[start:stop,numpy.newaxis],
+                                  longitudes[numpy.newaxis,:], latitudes[numpy.newaxis,:] )
+
+    def drop_caches(self):
+        """ Release precomputed data structures (e.g., if the process runs out of its memory budget).
+
+        Edge probabilities remain valid, but their evaluation becomes slower.
+        """
+        self.distance_matrices=[None]*len(self.locations)
+        self.distance_caches=[None]*len(self.locations)
+        self.row_cache.clear()
+
     @property
     def sample_size(self):
         return len(self.sampled_geo_attrs)
 
-    def edge_probability(self, u, v):
-        """ Probability of edge in the similarity graph based on geo-damped Lin similarity.
+    @property
+    def num_settings(self):
+        return len(self.settings)
 
-        Edge probability consists of two independent contributions:
-        - probability induced by graphical distance between agents
-        - probability induced by similarity between agents
+    def min_distance(self, u, v):
+        """ Minimum central angle between matching locations of 2 vertices.
+
+        Distances are evaluated between unique locations and looked up in the distance cache
+        (dense matrix or LRU cache) of the corresponding location table.
 
         Parameters
         ----------
         u, v : int
             Indices of vertices
-        """
-
-        # Compute contribution of geo-attributes to the edge probability.
 
-        # Get vectors with (lon,lat)-pairs of all locations for 2 nodes.
-        geo_attrs_u=self.geo_attrs[u]
-        geo_attrs_v=self.geo_attrs[v]
+        Returns
+        -------
+        angle : float
+            Central angle in radians (multiply by `R_EARTH` to get the distance in meters).
+        """
         # Compute minimum geo-distance between locations of a and b
         # NOTE: For the moment, it selects the closest distance for 
         #       matching types of locations (e.g., between 2 households,
         #       but not between household of `a` and workplace of `b`)
+        location_ids_u, location_ids_v=self.location_ids[u], self.location_ids[v]
         min_dist=numpy.PINF
-        for i in xrange(0, len(geo_attrs_u), 2):
-            dlon=geo_attrs_u[i] - geo_attrs_v[i]
-            # TODO: precompute sines and cosines before computing individual edge probabilities
-            lat1, lat2=geo_attrs_u[i+1], geo_attrs_v[i+1]
-            cos_lat1, cos_lat2, cos_dlon=numpy.cos(lat1), numpy.cos(lat2), numpy.cos(dlon)
-            sin_lat1, sin_lat2, sin_dlon=numpy.sin(lat1), numpy.sin(lat2), numpy.sin(dlon)
-            y=sqrt((cos_lat2*sin_dlon)**2 + (cos_lat1*sin_lat2 - sin_lat1*cos_lat2*cos_dlon)**2)
+        for k in xrange(len(self.locations)):
+            a, b=location_ids_u[k], location_ids_v[k]
+            if a == b:  # e.g., members of the same household
+                return 0.
+            distances=self.distance_matrices[k]
+            if distances is not None:
+                min_dist=min(min_dist, distances[a,b])
+                continue
+            cache=self.distance_caches[k]
+            if cache is None:
+                min_dist=min(min_dist, self._location_distance(k, a, b))
+                continue
+            num_locations=len(self.locations[k][0])
+            key=int(a)*num_locations + int(b) if a < b else int(b)*num_locations + int(a)
+            dist=cache.get(key)
+            if dist is None:
+                dist=self._location_distance(k, a, b)
+                cache.put(key, dist)
+            min_dist=min(min_dist, dist)
+        return min_dist
+
+    def _location_distance(self, k, a, b):
+        """ Central angle between locations `a` and `b` of the location table `k`. """
+        longitudes, cos_latitudes, sin_latitudes=self.locations[k]
+        dlon=longitudes[a] - longitudes[b]
+        cos_dlon, sin_dlon=cos(dlon), sin(dlon)
+        cos_lat1, sin_lat1=cos_latitudes[a], sin_latitudes[a]
+        cos_lat2, sin_lat2=cos_latitudes[b], sin_latitudes[b]
+        y=sqrt((cos_lat2*sin_dlon)**2 + (cos_lat1*sin_lat2 - sin_lat1*cos_lat2*cos_dlon)**2)
+        x=sin_lat1*sin_lat2 + cos_lat1*cos_lat2*cos_dlon
+        # TODO: clarify about negative distances
+        return arctan2(y, x)
+
+    def min_distances(self, u, v):
+        """ Minimum central angles between matching locations of pairs of vertices (vectorized `min_distance`).
+
+        Parameters
+        ----------
+        u, v : numpy.array
+            Indices of vertices
+
+        Returns
+        -------
+        angles : numpy.array
+            Central angles in radians
+        """
+        angles=numpy.full(len(u), numpy.inf)
+        for k, (longitudes, cos_latitudes, sin_latitudes) in enumerate(self.locations):
+            a, b=self.location_ids[u,k], self.location_ids[v,k]
+            distances=self.distance_matrices[k]
+            if distances is not None:
+                angles=numpy.minimum(angles, distances[a,b])
+                continue
+            dlon=longitudes[a] - longitudes[b]
+            cos_dlon, sin_dlon=numpy.cos(dlon), numpy.sin(dlon)
+            cos_lat1, sin_lat1=cos_latitudes[a], sin_latitudes[a]
+            cos_lat2, sin_lat2=cos_latitudes[b], sin_latitudes[b]
+            y=numpy.sqrt((cos_lat2*sin_dlon)**2 + (cos_lat1*sin_lat2 - sin_lat1*cos_lat2*cos_dlon)**2)
             x=sin_lat1*sin_lat2 + cos_lat1*cos_lat2*cos_dlon
-            # TODO: clarify about negative distances
-            min_dist=min(min_dist, arctan2(y, x))
+            angles=numpy.minimum(angles, numpy.arctan2(y, x))
+        return angles
 
-        if self.damping > 0.:
-            # Scale distance by half-similarity scale to make it adimensional and damp by a factor 2.
-            prob_geo=(1. + self.geo_scaling*min_dist)**(-self.damping)
-        else:
-            # Compute geo-similarity with exponential damping.
-            prob_geo=2**(-self.geo_scaling*min_dist)
-        # logging.debug( "minimum distance rho({0},{1})={2}; geo-induced probability Pr({0},{1})={3}".\
-        #                format(a, b, min_dist, prob_geo) )
-
-        # If probability induced by the geo-attributes is smaller than a certain lower bound threshold,
-        # the Lin similarity contribution is disregarded.
-        if prob_geo <= self.similarity_threshold:
-            return 0.
+    def lin_similarity(self, u, v):
+        """ Lin similarity between non-geographic attributes of 2 vertices estimated on the sample.
+
+        Parameters
+        ----------
+        u, v : int
+            Indices of vertices
 
+        Notes
+        -----
+        Lin similarity is symmetric. Former versions normalized similarities of pairs whose first vertex
+        has no equal agents in the sample (unlike the second one) by a half of the logarithm, so that
+        ``lin_similarity(u, v) == 2*lin_similarity(v, u)`` for such pairs. Similarities (and edge probabilities)
+        of such pairs are now a half of their former values.
+        """
         # Compute contribution of non-geographic attributes to the edge probability.
         # This contribution is based on Lin similarity metric.
         # Lin similarity handles categorical ('c') and ordinal ('o') attributes
         # (while geographic ('g') attributes are subject of geo-damping).
         # In order to reduce calculation time, code below evaluates
-        # the similarity between node `a` and node `b` on the sampled attributes.
+        # the similarity between node `a` and node `b` on the sampled attributes
+        # (unless exact frequencies over the whole population are precomputed).
 
         # First, find the frequency of agents sharing all attributes shared by the two analysed nodes.
         # The idea is that the lower the number of agents sharing the same attribute,
@@ -212,46 +451,25 @@ class SimilarityGraph:
         # one might handle attributes independently by computing their contributions separately
         # and summing up.
 
-        attrs_u, attrs_v = self.nongeo_attrs[u], self.nongeo_attrs[v]
-        # Select nodes as similar if categorical attributes are the same to `a` and `b`
-        # If vertices share categorical attribute, the number of agents sharing this attribute is considered.
-        # TODO: ensure that we do not have to cut of by categorical_attrs
-        similar_nodes=True  # start with all sampled items as similar
-        for sample, attr_u, attr_v in islice(izip(self.sampled_nongeo_attrs, attrs_u, attrs_v), self.num_categorical):
-            if attr_u == attr_v:
-                # filter out indices of samples with the same attribute
-                similar_nodes &= sample == attr_u
-        # logging.debug( "similar categorical attributes in the sample: {0} out of {1}".\
-        #                format(numpy.sum(similar_nodes) if not isinstance(similar_nodes, bool) else "all",
-        #                       self.sample_size) )
-
-        # Select nodes as similar if ordinal attributes are between values for `a` and `b`.
-        # If vertices do not share an attribute and the attribute is ordinal,
-        # the number of agents sharing attributes between the two values is considered.
-        for sample, attr_u, attr_v in islice(izip(self.sampled_nongeo_attrs, attrs_u, attrs_v), self.num_categorical, self.num_categorical+self.num_ordinal):
-            attr_min, attr_max=min(attr_u, attr_v), max(attr_u, attr_v)
-            # filter out indices of samples with the attribute in the range of values between `a` and `b`
-            similar_nodes &= (attr_min <= sample) & (sample <= attr_max)
-
-        num_similar=numpy.sum(similar_nodes) if not isinstance(similar_nodes, bool) else self.sample_size
-        # logging.debug( "similar attributes in the sample after ordinal attributes filtering: {0} out of {1}".\
-        #                format(num_similar, self.sample_size) )
+        # Frequencies are estimated on the sample or computed exactly (see `sn4sp.core.frequencies`).
+        num_similar=self.frequencies.num_similar(u, v)
+        # logging.debug( "similar attributes in the sample: {0} out of {1}".\
+        #                format(num_similar, self.frequencies.size) )
 
         # If the superposition is zero on the sample, then there is no agents with the same characteristics.
         # The probability of finding something with the same feature of both `a` and `b` is really small.
         if num_similar == 0:
-            return prob_geo # TODO: consult why not zero
+            return 1. # TODO: consult why not zero
 
         # Second, find the frequency of agents sharing all attributes with each analysed node separately.
         # TODO: clarify whether we need to take geo-filtering into account as in original script
-        # NOTE: `numpy.sum` performs better than `sum` on numpy-arrays
-        num_equal_u=numpy.sum(self.sampled_vertex_attrs==self.vertex_attrs[u])
-        num_equal_v=numpy.sum(self.sampled_vertex_attrs==self.vertex_attrs[v])
+        num_equal_u=self.frequencies.num_equal(u)
+        num_equal_v=self.frequencies.num_equal(v)
         # logging.debug( "similar attributes (in the sample) to the 1st vertex: {0}, to the 2nd vertex: {1}".\
         #                format(num_equal_u, num_equal_v) )
 
         # Compute Lin similarity (use inverses of frequencies estimated above)
-        num_sample=float(self.sample_size)
+        num_sample=float(self.frequencies.size)
         num_total=len(self)
         prob_lin=log2(num_sample/num_similar)
         if num_equal_u == 0:  # there is no agents as `a`
@@ -259,13 +477,276 @@ class SimilarityGraph:
             if num_equal_v == 0:  # the same thing for `b`
                 prob_lin /= log2(num_total)
             else:  # `a` is unique, but `b` has similar vertices (agents) in the dataset (population)
-                prob_lin /= 0.5*log2(num_sample*num_total/num_equal_v)
+                # NOTE: symmetric to the case of unique `b` (edge probabilities must not depend on the order of vertices)
+                prob_lin /= log2(num_sample*num_total/num_equal_v)
         elif num_equal_v == 0: # `b` is unique, but `a` has similar vertices (agents) in the dataset (population)
             prob_lin /= (log2(num_sample*num_total/num_equal_u))
         else:  # both `a` and `b` have similar vertices (agents) in the dataset (population)
             prob_lin /= log2(num_sample*num_sample/(num_equal_u*num_equal_v))
 
-        return prob_geo*prob_lin
+        return prob_lin
+
+    def lin_similarities(self, u, v):
+        """ Lin similarities between pairs of vertices (vectorized `lin_similarity`).
+
+        Parameters
+        ----------
+        u, v : numpy.array
+            Indices of vertices
+
+        Returns
+        -------
+        similarities : numpy.array
+            Lin similarities
+        """
+        num_similar=self.frequencies.num_similar(u, v).astype('f8')
+        # Count vertices equal to every vertex once
+        vertices, inverse=numpy.unique(numpy.hstack((u, v)), return_inverse=True)
+        num_equal=self.frequencies.num_equal(vertices).astype('f8')[inverse]
+        num_equal_u, num_equal_v=num_equal[:len(u)], num_equal[len(u):]
+
+        # See `lin_similarity` for the cases of vertices without equal agents in the sample
+        num_sample=float(self.frequencies.size)
+        num_total=len(self)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            norm=numpy.where( num_equal_u == 0,
+                              numpy.where(num_equal_v == 0, num_total, num_sample*num_total/num_equal_v),
+                              numpy.where( num_equal_v == 0, num_sample*num_total/num_equal_u,
+                                           num_sample*num_sample/(num_equal_u*num_equal_v) ) )
+            return numpy.where(num_similar == 0, 1., numpy.log(num_sample/num_similar)/numpy.log(norm))
+
+    def edge_probability(self, u, v):
+        """ Probability of edge in the similarity graph based on geo-damped Lin similarity.
+
+        Edge probability consists of two independent contributions:
+        - probability induced by graphical distance between agents
+        - probability induced by similarity between agents
+
+        Parameters
+        ----------
+        u, v : int
+            Indices of vertices
+
+        Returns
+        -------
+        probability : float or numpy.array
+            Edge probability (array with a probability per setting if several settings are given)
+
+        Notes
+        -----
+        ``edge_probability(u, v) == edge_probability(v, u)``; see `lin_similarity` for the change of probabilities
+        of edges with vertices which have no equal agents in the sample.
+        """
+
+        # Compute contribution of geo-attributes to the edge probability.
+        min_dist=self.min_distance(u, v)
+        if self.num_settings == 1:
+            prob_geo=geo.geo_damping(min_dist, self.geo_scaling, self.damping)
+            # If probability induced by the geo-attributes is smaller than a certain lower bound threshold,
+            # the Lin similarity contribution is disregarded.
+            if prob_geo <= self.similarity_threshold:
+                return 0.
+            return prob_geo*self.lin_similarity(u, v)
+
+        # Evaluate all settings on the same distance and Lin similarity.
+        # Lin similarity is disregarded only if it is disregarded by the most permissive setting.
+        prob_geo=geo.geo_damping(min_dist, self.geo_scalings, self.dampings)
+        below_threshold=prob_geo <= self.similarity_threshold
+        if numpy.all(below_threshold):
+            return numpy.zeros(self.num_settings)
+        prob_geo[below_threshold]=0.
+        return prob_geo*self.lin_similarity(u, v)
+
+    def edge_factors(self, u, v):
+        """ Factors of edge probability independent of (hss, damping) settings.
+
+        Parameters
+        ----------
+        u, v : int
+            Indices of vertices
+
+        Returns
+        -------
+        distance : float
+            Minimum distance between the vertices in meters
+        similarity : float
+            Lin similarity of the vertices (0 if the edge is cut off by all settings)
+        """
+        min_dist=self.min_distance(u, v)
+        # Apply the cutoff of the most permissive setting
+        prob_geo=geo.geo_damping(min_dist, self.geo_scalings, self.dampings)
+        if numpy.all(prob_geo <= self.similarity_threshold):
+            return min_dist*geo.R_EARTH, 0.
+        return min_dist*geo.R_EARTH, self.lin_similarity(u, v)
+
+    @property
+    def cutoff_angle(self):
+        """ Central angle from which edges are cut off by all (hss, damping) settings. """
+        return numpy.max(geo.geo_cutoff(self.geo_scalings, self.dampings, self.similarity_threshold))
+
+    def _tile_pruned(self, tile, tiles):
+        """ Mask of `tiles` which are farther apart from the `tile` than the cutoff angle (for all location tables). """
+        angles=geo.min_box_angle(self.tile_boxes[tile], self.tile_boxes[tiles])
+        return numpy.all(angles > self.cutoff_angle, axis=-1) & (tiles != tile)
+
+    def estimate_row_costs(self, num_samples=16, num_timed=256, seed=0):
+        """ Estimate costs of rows of the upper triangle traversed by edge iterators (collective call).
+
+        Without ordering, every row (vertex) samples `num_samples` couples at random and
+        the cost of the row is its length weighted by the fraction of the sampled couples
+        which pass the geo-damping cutoff (Lin similarity is evaluated only for them).
+        The relative cost of Lin similarity is measured on `num_timed` sampled couples.
+        With ordering, rows are tiles, and the cost of the row is the number of couples
+        in the tiles which are not skipped.
+
+        Returns
+        -------
+        costs : numpy.array
+            Estimated costs of rows (the same in all processes)
+
+        Examples
+        --------
+        >>> edges=G.edges_probabilities(scheduning='cost', costs=G.estimate_row_costs())
+        """
+        comm_rank, comm_size=self.comm.Get_rank(), self.comm.Get_size()
+        if self.order is not None:
+            num_tiles=len(self.tile_boxes)
+            tile_sizes=numpy.diff(numpy.hstack(( numpy.arange(0, len(self), self.tile_size), [len(self)] )))
+            costs=numpy.zeros(num_tiles + 1)
+            for tile in xrange(comm_rank, num_tiles, comm_size):
+                tiles=numpy.arange(tile, num_tiles)
+                kept=tiles[~self._tile_pruned(tile, tiles)]
+                costs[tile]=tile_sizes[tile]*numpy.sum(tile_sizes[kept[kept > tile]]) + \
+                            tile_sizes[tile]*(tile_sizes[tile] - 1)//2
+            self.comm.Allreduce(MPI.IN_PLACE, costs, op=MPI.SUM)
+            return costs
+
+        num_vertices=len(self)
+        random_state=numpy.random.RandomState(seed + comm_rank)
+        rows=numpy.arange(comm_rank, num_vertices - 1, comm_size)
+        row_lengths=num_vertices - 1 - rows
+        partners=rows[:,numpy.newaxis] + 1 + \
+                 (random_state.rand(len(rows), num_samples)*row_lengths[:,numpy.newaxis]).astype('i8')
+        # Minimum distances between sampled couples
+        angles=numpy.full(partners.shape, numpy.inf)
+        for k, (longitudes, cos_latitudes, sin_latitudes) in enumerate(self.locations):
+            latitudes=numpy.arctan2(sin_latitudes, cos_latitudes)
+            ids_u, ids_v=self.location_ids[rows,k][:,numpy.newaxis], self.location_ids[partners,k]
+            angles=numpy.minimum(angles, geo.central_angle( longitudes[ids_u], latitudes[ids_u],
+                                                             longitudes[ids_v], latitudes[ids_v] ))
+        passed=angles < self.cutoff_angle
+
+        # Relative cost of Lin similarity with respect to evaluation of distances
+        couples=list(islice(izip(numpy.repeat(rows, num_samples)[passed.ravel()], partners[passed]), num_timed))
+        start_time=MPI.Wtime()
+        for u, v in couples:
+            self.min_distance(u, v)
+        distance_time=MPI.Wtime() - start_time
+        start_time=MPI.Wtime()
+        for u, v in couples:
+            self.lin_similarity(u, v)
+        lin_time=MPI.Wtime() - start_time
+        distance_time, lin_time=self.comm.allreduce(numpy.array([distance_time, lin_time]), op=MPI.SUM)
+        lin_cost=lin_time/distance_time if distance_time > 0. else 1.
+        logging.debug( 'relative cost of Lin similarity: {0:.3g}'.format(lin_cost) )
+
+        costs=numpy.zeros(num_vertices)
+        costs[rows]=row_lengths*(1. + lin_cost*numpy.mean(passed, axis=1))
+        self.comm.Allreduce(MPI.IN_PLACE, costs, op=MPI.SUM)
+        return costs
+
+    def estimate_edge_density(self, num_samples=4096, seed=0):
+        """ Estimate the fraction of vertex pairs joined by edges with non-zero probabilities (collective call).
+
+        Every process evaluates `num_samples` random pairs of vertices. The estimate is used
+        to preallocate storage for edges (e.g., by ``sn4sp.readwrite.write_edges_probabilities_h5``).
+
+        Parameters
+        ----------
+        num_samples : int
+            Number of pairs sampled by every process
+        seed : int
+            Seed of the random generator (shifted by ranks of processes)
+
+        Returns
+        -------
+        density : float
+            Estimated fraction of pairs (the same in all processes)
+        """
+        num_vertices=len(self)
+        if num_vertices < 2:
+            return 0.
+        random_state=numpy.random.RandomState(seed + self.comm.Get_rank())
+        u=random_state.randint(0, num_vertices, num_samples)
+        v=(u + random_state.randint(1, num_vertices, num_samples)) % num_vertices
+        _, probabilities=self._geo_probabilities(u, v)
+        stored=numpy.any(probabilities > 0., axis=1)
+        stored[stored]=self.lin_similarities(u[stored], v[stored]) > 0.
+        return self.comm.allreduce(numpy.count_nonzero(stored), op=MPI.SUM)/(num_samples*self.comm.Get_size())
+
+    def _schedule(self, args, kwargs):
+        """ Complete options of scheduling: costs of rows for ``cost`` scheduling are estimated unless given. """
+        scheduling=args[0] if args else kwargs.get('scheduning', 'even')
+        if scheduling == 'cost' and kwargs.get('costs') is None:
+            kwargs=dict(kwargs, costs=self.estimate_row_costs())
+        return kwargs
+
+    def _tiles(self, *args, **kwargs):
+        """ Iterator over pairs of tiles (as arrays of vertices with a flag of diagonal pair) handled by the current process.
+
+        Tiles are distributed with `sn4sp.parallel.triu_index`, and pairs of tiles which are farther apart
+        than the geo-damping cutoff of the most permissive setting are skipped.
+        """
+        # NOTE: Pairs of distinct vertices are farther than any cutoff if all pairs of their locations are
+        num_tiles, num_pruned=len(self.tile_boxes), 0
+        # Tiles (I,J) with I <= J correspond to elements (I,J+1) of upper triangle of a larger matrix
+        for tile_i, tile_j in parallel.triu_index(num_tiles + 1, self.comm, *args, **kwargs):
+            tile_j-=1
+            if self._tile_pruned(tile_i, tile_j):
+                num_pruned+=1
+                continue
+            yield self.order[tile_i*self.tile_size:(tile_i + 1)*self.tile_size], \
+                  self.order[tile_j*self.tile_size:(tile_j + 1)*self.tile_size], tile_i == tile_j
+        logging.info( 'process {0} skipped {1} tiles of {2} vertices'.\
+                      format(self.comm.Get_rank(), num_pruned, self.tile_size) )
+
+    def _pairs(self, *args, **kwargs):
+        """ Iterator over pairs (u, v) of vertices with u < v handled by the current process.
+
+        Without ordering, pairs are distributed with `sn4sp.parallel.triu_index`.
+        Otherwise, pairs of vertices are taken from pairs of tiles which are not skipped (see `_tiles`).
+        """
+        kwargs=self._schedule(args, kwargs)
+        if self.order is None:
+            for i, j in parallel.triu_index(len(self), self.comm, *args, **kwargs):
+                yield i, j
+            return
+
+        for vertices_i, vertices_j, diagonal in self._tiles(*args, **kwargs):
+            for k, u in enumerate(vertices_i):
+                for v in (vertices_j[k+1:] if diagonal else vertices_j):
+                    yield (u, v) if u < v else (v, u)
+
+    def _pair_blocks(self, block_len, *args, **kwargs):
+        """ Iterator over blocks (u, v) of arrays with at most `block_len` pairs of vertices with u < v.
+
+        Blocks hold the same pairs as `_pairs`.
+        """
+        kwargs=self._schedule(args, kwargs)
+        if self.order is None:
+            for block in parallel.triu_blocks(len(self), self.comm, *args, block_len=block_len, **kwargs):
+                yield block
+            return
+
+        for vertices_i, vertices_j, diagonal in self._tiles(*args, **kwargs):
+            if diagonal:
+                rows, columns=numpy.triu_indices(len(vertices_i), 1)
+                u, v=vertices_i[rows], vertices_i[columns]
+            else:
+                u, v=numpy.repeat(vertices_i, len(vertices_j)), numpy.tile(vertices_j, len(vertices_i))
+            u, v=numpy.minimum(u, v), numpy.maximum(u, v)
+            for start in xrange(0, len(u), block_len):
+                yield u[start:start+block_len], v[start:start+block_len]
 
     def edges_probabilities(self, *args, **kwargs):
         """Iterator over upper triangular part of the edge "probability" matrix.
@@ -273,8 +754,9 @@ class SimilarityGraph:
         Returns
         -------
         edges : iterator
-            Edge iterator, which iterates over (u, v, p) tuples of edges,
-            where p is a probability of edge.
+            Edge iterator, which iterates over (u, v, p) tuples of edges with u < v,
+            where p is a probability of edge. If vertices are ordered (see `ordering`),
+            the iterator skips pairs of tiles which cannot pass the geo-damping cutoff.
 
         Notes
         -----
@@ -289,10 +771,425 @@ class SimilarityGraph:
         """
         # TODO: replace `edges_probabilities` with edge view
 
-        # Estimate number of potential edges (couples)
-        for i, j in parallel.triu_index(len(self), self.comm, *args, **kwargs):
+        for i, j in self._pairs(*args, **kwargs):
             yield i, j, self.edge_probability(i,j)
 
+    def edges_factors(self, *args, **kwargs):
+        """Iterator over factors of the upper triangular part of the edge "probability" matrix.
+
+        Returns
+        -------
+        edges : iterator
+            Edge iterator, which iterates over (u, v, distance, similarity) tuples of edges
+            (see `edge_factors`).
+
+        Examples
+        --------
+        >>> [(i,j,d,s) for i,j,d,s in G.edges_factors()]
+        """
+        for i, j in self._pairs(*args, **kwargs):
+            distance, similarity=self.edge_factors(i,j)
+            yield i, j, distance, similarity
+
+    @property
+    def edge_dtype(self):
+        """ Type of edges produced by `edges_probabilities_chunks` (``weight`` is an array if several settings are given). """
+        return numpy.dtype([ ('src_node', 'i8'), ('trg_node', 'i8'),
+                             ('weight', 'f8') if self.num_settings == 1 else ('weight', 'f8', (self.num_settings,)) ])
+
+    def _geo_probabilities(self, u, v):
+        """ Distances (central angles) and geo-induced probabilities (cut off by threshold) of pairs of vertices. """
+        angles=self.min_distances(u, v)
+        prob_geo=geo.geo_damping(angles[:,numpy.newaxis], self.geo_scalings, self.dampings)
+        prob_geo[prob_geo <= self.similarity_threshold]=0.
+        return angles, prob_geo
+
+    def _probability_blocks(self, pair_blocks, threshold=0.):
+        """ Iterator over blocks of edges with probabilities (see `_chunks`) for blocks (u, v) of pairs of vertices. """
+        for u, v in pair_blocks:
+            _, probabilities=self._geo_probabilities(u, v)
+            retained=numpy.flatnonzero(numpy.any(probabilities > 0., axis=1))
+            probabilities=probabilities[retained]*self.lin_similarities(u[retained], v[retained])[:,numpy.newaxis]
+            if self.num_settings == 1:
+                probabilities=probabilities[:,0]
+            yield (u[retained], v[retained], probabilities), \
+                  numpy.any(probabilities.reshape(len(retained), -1) > threshold, axis=1)
+
+    def _chunks(self, blocks, dtype, chunk_len):
+        """ Iterator over chunks of edges given by blocks of (fields, mask of retained edges).
+
+        Chunks are views of the same buffer of length `chunk_len`.
+        A smaller length sent to the iterator (``chunks.send(chunk_len)``) shrinks the buffer.
+        """
+        buffer=numpy.empty(chunk_len, dtype=dtype)
+        k=0
+        for fields, retained in blocks:
+            retained=numpy.flatnonzero(retained)
+            while len(retained) > 0:
+                n=min(len(retained), chunk_len - k)
+                for name, values in zip(dtype.names, fields):
+                    buffer[name][k:k+n]=values[retained[:n]]
+                k+=n
+                retained=retained[n:]
+                if k == chunk_len:
+                    requested_len=yield buffer
+                    k=0
+                    if requested_len is not None and requested_len < chunk_len:
+                        chunk_len=requested_len
+                        buffer=numpy.empty(chunk_len, dtype=dtype)
+        if k > 0:
+            yield buffer[:k]
+
+    def edges_probabilities_chunks(self, chunk_len=1<<16, threshold=0., dtype=None, *args, **kwargs):
+        """Iterator over chunks of edges of upper triangular part of the edge "probability" matrix.
+
+        Pairs of vertices are evaluated in blocks by vectorized kernels.
+        Chunks hold edges with probabilities above the `threshold` (for any setting)
+        in the same order as `edges_probabilities`.
+
+        Parameters
+        ----------
+        chunk_len : int
+            Maximum number of edges in a chunk (and number of pairs evaluated at once)
+        threshold : float
+            Edges with probabilities which do not exceed the threshold are skipped
+        dtype : numpy.dtype
+            Type of chunks with ``src_node``, ``trg_node`` and ``weight`` fields (`edge_dtype` if ``None``)
+
+        Returns
+        -------
+        chunks : iterator
+            Iterator over structured arrays of edges. Chunks are views of the same buffer,
+            which is overwritten by the next chunk (copy the chunk to keep it).
+
+        Examples
+        --------
+        >>> num_edges=sum(len(chunk) for chunk in G.edges_probabilities_chunks(4096))
+        """
+        blocks=self._probability_blocks(self._pair_blocks(chunk_len, *args, **kwargs), threshold)
+        return self._chunks(blocks, numpy.dtype(dtype or self.edge_dtype), chunk_len)
+
+    def edges_factors_chunks(self, chunk_len=1<<16, threshold=0., dtype=None, *args, **kwargs):
+        """Iterator over chunks of factors of the upper triangular part of the edge "probability" matrix.
+
+        Chunks hold edges with Lin similarities above the `threshold` (see `edge_factors`)
+        in the same order as `edges_factors`.
+
+        Parameters
+        ----------
+        chunk_len : int
+            Maximum number of edges in a chunk (and number of pairs evaluated at once)
+        threshold : float
+            Edges with Lin similarities which do not exceed the threshold are skipped
+        dtype : numpy.dtype
+            Type of chunks with ``src_node``, ``trg_node``, ``distance`` and ``similarity`` fields
+
+        Returns
+        -------
+        chunks : iterator
+            Iterator over structured arrays of edges (views of the same buffer).
+        """
+        def blocks():
+            for u, v in self._pair_blocks(chunk_len, *args, **kwargs):
+                angles, probabilities=self._geo_probabilities(u, v)
+                retained=numpy.flatnonzero(numpy.any(probabilities > 0., axis=1))
+                similarities=self.lin_similarities(u[retained], v[retained])
+                yield (u[retained], v[retained], angles[retained]*geo.R_EARTH, similarities), similarities > threshold
+        dtype=dtype or [('src_node', 'i8'), ('trg_node', 'i8'), ('distance', 'f8'), ('similarity', 'f8')]
+        return self._chunks(blocks(), numpy.dtype(dtype), chunk_len)
+
+    def matmat(self, X, setting=0, block_len=1<<16, *args, **kwargs):
+        """ Product of the matrix of edge probabilities with the vector (or matrix) `X` (collective call).
+
+        The matrix is never stored: probabilities of pairs of vertices of the current process
+        are recomputed block by block with vectorized kernels, and products of processes are summed up.
+        The matrix is symmetric with zero diagonal.
+
+        Parameters
+        ----------
+        X : numpy.array
+            Vector of length ``len(G)`` or matrix with ``len(G)`` rows (the same in all processes)
+        setting : int
+            Index of the (hss, damping) setting
+        block_len : int
+            Number of pairs of vertices evaluated at once
+
+        Other arguments (e.g., ``scheduning``) are passed to the iterator over pairs of vertices.
+
+        Returns
+        -------
+        Y : numpy.array
+            Product of the shape of `X` (the same in all processes)
+
+        Examples
+        --------
+        >>> expected_degrees=G.matmat(numpy.ones(len(G)))
+        """
+        X=numpy.asarray(X, dtype='f8')
+        columns=X.reshape(len(self), -1)
+        Y=numpy.zeros(columns.shape)
+        for u, v in self._pair_blocks(block_len, *args, **kwargs):
+            _, probabilities=self._geo_probabilities(u, v)
+            retained=numpy.flatnonzero(probabilities[:,setting] > 0.)
+            u, v=u[retained], v[retained]
+            probabilities=probabilities[retained,setting]*self.lin_similarities(u, v)
+            for k in xrange(columns.shape[1]):
+                _accumulate(Y[:,k], u, probabilities*columns[v,k])
+                _accumulate(Y[:,k], v, probabilities*columns[u,k])
+        self.comm.Allreduce(MPI.IN_PLACE, Y, op=MPI.SUM)
+        return Y.reshape(X.shape)
+
+    def matvec(self, x, setting=0, block_len=1<<16, *args, **kwargs):
+        """ Product of the matrix of edge probabilities with the vector `x` (see `matmat`). """
+        return self.matmat(x, setting, block_len, *args, **kwargs)
+
+    def _row_candidates(self, u):
+        """ Vertices which may be adjacent to the vertex `u` (ascending).
+
+        If vertices are ordered, tiles whose bounding boxes are farther from the locations of `u`
+        than the cutoff angle (for all location tables) are skipped.
+        """
+        if self.order is None:
+            return numpy.arange(len(self))
+        point=numpy.empty((len(self.locations), 4))
+        for k, (longitudes, cos_latitudes, sin_latitudes) in enumerate(self.locations):
+            i=self.location_ids[u,k]
+            point[k,0:2]=longitudes[i]
+            point[k,2:4]=numpy.arctan2(sin_latitudes[i], cos_latitudes[i])
+        angles=geo.min_box_angle(numpy.broadcast_to(point, self.tile_boxes.shape), self.tile_boxes)
+        kept=~numpy.all(angles > self.cutoff_angle, axis=-1)
+        positions=numpy.flatnonzero(kept[numpy.arange(len(self.order))//self.tile_size])
+        return numpy.sort(self.order[positions])
+
+    def _row_edges(self, u, block_len=1<<16):
+        """ Sparse row of the edge "probability" matrix: vertices adjacent to `u` and their probabilities (memoized). """
+        u=int(u)
+        if not 0 <= u < len(self):
+            raise ValueError( "vertex {0} is out of range [0,{1})".format(u, len(self)) )
+        row=self.row_cache.get(u)
+        if row is not None:
+            return row
+        candidates=self._row_candidates(u)
+        candidates=candidates[candidates != u]
+        vertices, probabilities=[], []
+        for start in xrange(0, len(candidates), block_len):
+            v=candidates[start:start+block_len]
+            # NOTE: evaluate pairs as (smaller, larger) vertex to reproduce edges of `edges_probabilities`
+            src, trg=numpy.minimum(u, v), numpy.maximum(u, v)
+            _, block_probabilities=self._geo_probabilities(src, trg)
+            retained=numpy.flatnonzero(numpy.any(block_probabilities > 0., axis=1))
+            block_probabilities=block_probabilities[retained]*\
+                                self.lin_similarities(src[retained], trg[retained])[:,numpy.newaxis]
+            nonzero=numpy.any(block_probabilities > 0., axis=1)
+            vertices.append(v[retained[nonzero]])
+            probabilities.append(block_probabilities[nonzero])
+        vertices=numpy.concatenate(vertices or [numpy.empty(0, 'i8')]).astype('i8')
+        probabilities=numpy.concatenate(probabilities or [numpy.empty((0, self.num_settings))])
+        if self.num_settings == 1:
+            probabilities=probabilities[:,0]
+        self.row_cache.put(u, (vertices, probabilities))
+        return vertices, probabilities
+
+    def row(self, u, block_len=1<<16):
+        """ Row of the edge "probability" matrix (edge probabilities between the vertex `u` and all vertices).
+
+        The row is computed by vectorized kernels (if vertices are ordered, only for vertices of tiles
+        within the cutoff angle), and recent rows are memoized in the LRU cache of `row_cache_size` rows.
+        Unlike edge iterators, this is a local (not collective) call.
+
+        Parameters
+        ----------
+        u : int
+            Index of the vertex
+        block_len : int
+            Number of pairs of vertices evaluated at once
+
+        Returns
+        -------
+        probabilities : numpy.array
+            Edge probabilities of length ``len(G)`` (zero for `u` itself),
+            or of shape ``(len(G), num_settings)`` if several settings are given
+
+        Raises
+        ------
+        ValueError : exception
+            Vertex is out of range.
+
+        Examples
+        --------
+        >>> expected_degree=G.row(42).sum()
+        """
+        vertices, probabilities=self._row_edges(u, block_len)
+        row=numpy.zeros((len(self),) + probabilities.shape[1:])
+        row[vertices]=probabilities
+        return row
+
+    def neighbors(self, u, k=None, min_p=None, setting=0, block_len=1<<16):
+        """ Most likely neighbors of the vertex `u` (see `row`).
+
+        Parameters
+        ----------
+        u : int
+            Index of the vertex
+        k : int
+            Maximum number of neighbors (all neighbors if ``None``)
+        min_p : float
+            Neighbors with edge probabilities below `min_p` are skipped
+        setting : int
+            Index of the (hss, damping) setting which ranks neighbors
+        block_len : int
+            Number of pairs of vertices evaluated at once
+
+        Returns
+        -------
+        vertices : numpy.array
+            Neighbors sorted by decreasing edge probabilities (ties by indices)
+        probabilities : numpy.array
+            Edge probabilities of the neighbors (for the given setting)
+
+        Raises
+        ------
+        ValueError : exception
+            Vertex is out of range.
+
+        Examples
+        --------
+        >>> contacts, probabilities=G.neighbors(42, k=50)
+        """
+        vertices, probabilities=self._row_edges(u, block_len)
+        if probabilities.ndim > 1:
+            probabilities=probabilities[:,setting]
+        retained=probabilities > 0. if min_p is None else probabilities >= min_p
+        vertices, probabilities=vertices[retained], probabilities[retained]
+        # NOTE: vertices of rows are ascending, so the stable sort breaks ties by indices
+        ranks=numpy.argsort(-probabilities, kind='mergesort')[:k]
+        return vertices[ranks], probabilities[ranks]
+
+    def vertex_classes(self):
+        """Equivalence classes of vertices with identical attributes.
+
+        Vertices of a class share profile and locations, so their edge probabilities
+        to any other vertex are identical.
+
+        Returns
+        -------
+        classes : numpy.array
+            Class of every vertex
+        representatives : numpy.array
+            Representative vertex of every class
+        sizes : numpy.array
+            Number of vertices in every class
+        """
+        _, representatives, classes, sizes=numpy.unique( self.vertex_attrs, return_index=True,
+                                                         return_inverse=True, return_counts=True )
+        logging.info( 'number of vertex classes: {0} ({1} vertices)'.format(len(sizes), len(self)) )
+        return classes, representatives, sizes
+
+    def class_edges_probabilities(self, classes=None, *args, **kwargs):
+        """Iterator over edge "probabilities" between classes of vertices.
+
+        Parameters
+        ----------
+        classes : tuple
+            Classes of vertices as returned by `vertex_classes` (computed if ``None``)
+
+        Returns
+        -------
+        edges : iterator
+            Edge iterator, which iterates over (a, b, p) tuples with classes a <= b,
+            where p is a probability of edge between any vertex of class a and any
+            other vertex of class b.
+
+        Examples
+        --------
+        >>> [(a,b,p) for a,b,p in G.class_edges_probabilities()]
+        """
+        _, representatives, sizes=classes or self.vertex_classes()
+        for a, b in parallel.triu_index(len(representatives), self.comm, *args, **kwargs):
+            yield a, b, self.edge_probability(representatives[a], representatives[b])
+        # Edges between vertices of the same class
+        for a in numpy.flatnonzero(sizes > 1)[self.comm.Get_rank()::self.comm.Get_size()]:
+            yield a, a, self.edge_probability(representatives[a], representatives[a])
+
+    def _incident_pair_blocks(self, vertices, excluded=(), block_len=1<<16):
+        """ Iterator over blocks (u, v) of arrays with at most `block_len` pairs of vertices with u < v
+        incident to the given vertices (see `incident_edges_probabilities`).
+        """
+        num_vertices=len(self)
+        retained=numpy.ones(num_vertices, bool)
+        retained[numpy.asarray(excluded, dtype='i8')]=False
+        vertices=numpy.unique(numpy.asarray(vertices, dtype='i8'))
+        vertices=vertices[retained[vertices]]
+        selected=numpy.zeros(num_vertices, bool)
+        selected[vertices]=True
+        candidates=numpy.flatnonzero(retained)
+        for u in vertices[self.comm.Get_rank()::self.comm.Get_size()]:
+            # NOTE: edge between 2 selected vertices is processed with its smaller end
+            v=candidates[(candidates != u) & ~(selected[candidates] & (candidates < u))]
+            for start in xrange(0, len(v), block_len):
+                block=v[start:start+block_len]
+                yield numpy.minimum(u, block), numpy.maximum(u, block)
+
+    def incident_edges_probabilities(self, vertices, excluded=()):
+        """Iterator over edge "probabilities" of the edges incident to the given vertices.
+
+        Vertices are distributed between processes in a Round-Robin fashion.
+        Every edge is visited once, even if both its ends belong to `vertices`.
+        Pairs of vertices are evaluated in blocks by vectorized kernels.
+
+        Parameters
+        ----------
+        vertices : list
+            Indices of vertices (e.g., added or modified agents)
+        excluded : list
+            Indices of vertices whose edges are skipped (e.g., removed agents)
+
+        Returns
+        -------
+        edges : iterator
+            Edge iterator, which iterates over (u, v, p) tuples of edges with u < v,
+            where p is a probability of edge.
+
+        Examples
+        --------
+        >>> [(i,j,p) for i,j,p in G.incident_edges_probabilities([0, 42])]
+        """
+        for u, v in self._incident_pair_blocks(vertices, excluded):
+            _, probabilities=self._geo_probabilities(u, v)
+            retained=numpy.flatnonzero(numpy.any(probabilities > 0., axis=1))
+            probabilities[retained]*=self.lin_similarities(u[retained], v[retained])[:,numpy.newaxis]
+            if self.num_settings == 1:
+                probabilities=probabilities[:,0]
+            for i, j, p in izip(u.tolist(), v.tolist(), probabilities):
+                yield i, j, p
+
+    def incident_edges_probabilities_chunks(self, vertices, excluded=(), chunk_len=1<<16, threshold=0., dtype=None):
+        """Iterator over chunks of edges incident to the given vertices (see `incident_edges_probabilities`).
+
+        Chunks hold edges with probabilities above the `threshold` (for any setting)
+        in the same order as `incident_edges_probabilities`.
+
+        Parameters
+        ----------
+        vertices : list
+            Indices of vertices (e.g., added or modified agents)
+        excluded : list
+            Indices of vertices whose edges are skipped (e.g., removed agents)
+        chunk_len : int
+            Maximum number of edges in a chunk (and number of pairs evaluated at once)
+        threshold : float
+            Edges with probabilities which do not exceed the threshold are skipped
+        dtype : numpy.dtype
+            Type of chunks with ``src_node``, ``trg_node`` and ``weight`` fields (`edge_dtype` if ``None``)
+
+        Returns
+        -------
+        chunks : iterator
+            Iterator over structured arrays of edges (views of the same buffer).
+        """
+        blocks=self._probability_blocks(self._incident_pair_blocks(vertices, excluded, chunk_len), threshold)
+        return self._chunks(blocks, numpy.dtype(dtype or self.edge_dtype), chunk_len)
+
     def __len__(self):
         """ Return the number of nodes. Use: `len(G)`.
 
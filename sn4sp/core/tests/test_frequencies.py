@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+""" Unit tests for frequencies of attribute values
+"""
+
+from __future__ import division, absolute_import, print_function
+import unittest
+import numpy
+
+# TODO: remove in alpha release
+import os
+import sys
+sys.path.insert( 0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))) )
+from sn4sp.core import SimilarityGraph
+
+class TestFrequencies(unittest.TestCase):
+    """ Tests for frequency engines of SimilarityGraph."""
+
+    def setUp(self):
+        dt = numpy.dtype({
+            'names'   : ["sex", "age", "role", "income", "hh_lon", "hh_lat"],
+            'formats' : [numpy.bool, numpy.int8, numpy.int8, numpy.int16, numpy.float32, numpy.float32]
+        })
+        random_state=numpy.random.RandomState(0)
+        num_vertices=200
+        self.vertex_attrs=numpy.zeros(num_vertices, dtype=dt)
+        self.vertex_attrs['sex']=random_state.randint(0, 2, num_vertices)
+        self.vertex_attrs['age']=random_state.randint(0, 90, num_vertices)
+        self.vertex_attrs['role']=random_state.randint(0, 3, num_vertices)
+        self.vertex_attrs['income']=random_state.randint(0, 10, num_vertices)*100
+        self.vertex_attrs['hh_lon']=7.6 + random_state.randint(0, 20, num_vertices)*0.01
+        self.vertex_attrs['hh_lat']=45.0 + random_state.randint(0, 20, num_vertices)*0.01
+        self.attr_types=list("cocogg")
+
+    def test_exact_frequencies(self):
+        # NOTE: small populations are sampled completely
+        sampled=SimilarityGraph(self.vertex_attrs, self.attr_types, sample_fraction=1.0)
+        exact=SimilarityGraph(self.vertex_attrs, self.attr_types, frequencies='exact')
+        for u in xrange(0, len(self.vertex_attrs), 3):
+            self.assertEqual(exact.frequencies.num_equal(u), sampled.frequencies.num_equal(u))
+            for v in xrange(u + 1, len(self.vertex_attrs), 5):
+                self.assertEqual(exact.frequencies.num_similar(u, v), sampled.frequencies.num_similar(u, v))
+
+    def test_sketch_frequencies(self):
+        exact=SimilarityGraph(self.vertex_attrs, self.attr_types, frequencies='exact')
+        sketch=SimilarityGraph( self.vertex_attrs, self.attr_types, frequencies='sketch',
+                                frequencies_options={ 'error' : 1e-2, 'memory' : 1<<25 } )
+        # NOTE: sketch is large enough to hold ordinal attributes without binning
+        self.assertEqual( sketch.frequencies.num_bins,
+                          [len(numpy.unique(self.vertex_attrs[attr_name])) for attr_name in ('age', 'income')] )
+        for u in xrange(0, len(self.vertex_attrs), 3):
+            self.assertGreaterEqual(sketch.frequencies.num_equal(u), exact.frequencies.num_equal(u))
+            for v in xrange(u + 1, len(self.vertex_attrs), 5):
+                self.assertGreaterEqual(sketch.frequencies.num_similar(u, v), exact.frequencies.num_similar(u, v))
+        errors=sketch.frequencies.report()
+        self.assertLessEqual(errors['similar_mean'], 1e-2)
+
+    def test_pair_queries(self):
+        random_state=numpy.random.RandomState(1)
+        u, v=random_state.randint(0, len(self.vertex_attrs), (2, 300))
+        for frequencies, options in (('sample', {}), ('exact', {}), ('sketch', { 'memory' : 1<<25, 'audit_size' : 50 })):
+            sim_net=SimilarityGraph( self.vertex_attrs, self.attr_types, sample_fraction=0.5, frequencies=frequencies,
+                                     frequencies_options=options )
+            num_similar=sim_net.frequencies.num_similar(u, v)
+            self.assertEqual(num_similar.shape, u.shape)
+            for k in xrange(0, len(u), 7):
+                self.assertEqual(num_similar[k], sim_net.frequencies.num_similar(u[k], v[k]))
+            num_equal=sim_net.frequencies.num_equal(u)
+            for k in xrange(0, len(u), 7):
+                self.assertEqual(num_equal[k], sim_net.frequencies.num_equal(u[k]))
+        # Queried pairs are audited by sketches
+        self.assertEqual(sim_net.frequencies.audited.shape, (50, 2))
+        self.assertEqual(sim_net.frequencies.num_queries, len(u) + len(xrange(0, len(u), 7)))
+
+    def test_unknown_frequencies(self):
+        with self.assertRaises(ValueError):
+            SimilarityGraph(self.vertex_attrs, self.attr_types, frequencies='unknown')
+
+if __name__ == '__main__':
+    unittest.main()
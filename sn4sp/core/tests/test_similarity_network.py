@@ -20,6 +20,7 @@ import os
 import sys
 sys.path.insert( 0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))) )
 from sn4sp.core import SimilarityGraph
+from sn4sp.core.coarse import class_members, expand_class_edges
 
 class TestStringMethods(unittest.TestCase):
     """ Tests for data-structure SimilarityGraph."""
@@ -67,5 +68,165 @@ class TestStringMethods(unittest.TestCase):
         for i, j, p in self.sim_net.edges_probabilities():
             self.assertTrue(p <= 1.)
 
+    def test_incident_edges(self):
+        edges={(i,j) : p for i, j, p in self.sim_net.edges_probabilities()}
+        incident={(i,j) : p for i, j, p in self.sim_net.incident_edges_probabilities([2, 5], excluded=[7])}
+        self.assertEqual( sorted(incident), sorted(e for e in edges if set(e) & {2, 5} and 7 not in e) )
+        for e, p in incident.items():
+            self.assertAlmostEqual(p, edges[e])
+        chunks=numpy.concatenate([ chunk.copy() for chunk in \
+                                   self.sim_net.incident_edges_probabilities_chunks([2, 5], excluded=[7], chunk_len=3) ])
+        self.assertEqual( zip(chunks['src_node'], chunks['trg_node']),
+                          [(i, j) for i, j, p in self.sim_net.incident_edges_probabilities([2, 5], [7]) if p > 0] )
+
+    def test_sampled_indices(self):
+        vertex_attrs=numpy.tile(self.sim_net.vertex_attrs, 30)
+        sim_net=SimilarityGraph(vertex_attrs, list("cocccoggggo"), hss=5000, damping=0., sample_fraction=0.5)
+        # Sampled vertices are distinct, and their attributes are taken from the sampled indices
+        self.assertEqual(numpy.sum(sim_net.sample_mask), len(vertex_attrs)//2)
+        self.assertEqual( sorted(sim_net.sampled_vertex_attrs.tolist()),
+                          sorted(sim_net.vertex_attrs[sim_net.sample_mask].tolist()) )
+
+    def test_frozen_sample(self):
+        sim_net=SimilarityGraph( self.sim_net.vertex_attrs, list("cocccoggggo"),
+                                 hss=5000, damping=0., sample=self.sim_net.sampled_vertex_attrs )
+        for (i, j, p), (_, _, q) in zip(sim_net.edges_probabilities(), self.sim_net.edges_probabilities()):
+            self.assertEqual(p, q)
+
+    def test_settings_sweep(self):
+        settings=[(5000, 0.), (2000, 0.5), (20000, 2.)]
+        sweep=SimilarityGraph( self.sim_net.vertex_attrs, list("cocccoggggo"),
+                               settings=settings, sample=self.sim_net.sampled_vertex_attrs )
+        for k, (hss, damping) in enumerate(settings):
+            sim_net=SimilarityGraph( self.sim_net.vertex_attrs, list("cocccoggggo"),
+                                     hss=hss, damping=damping, sample=self.sim_net.sampled_vertex_attrs )
+            for (i, j, p), (_, _, q) in zip(sweep.edges_probabilities(), sim_net.edges_probabilities()):
+                self.assertAlmostEqual(p[k], q)
+
+    def test_location_cache(self):
+        # NOTE: vertices 3 and 4 share a household
+        self.assertEqual(self.sim_net.min_distance(3, 4), 0.)
+        distances=[self.sim_net.min_distance(i, j) for i in xrange(10) for j in xrange(i+1, 10)]
+        self.sim_net.drop_caches()
+        for distance, (i, j) in zip(distances, [(i, j) for i in xrange(10) for j in xrange(i+1, 10)]):
+            self.assertAlmostEqual(self.sim_net.min_distance(i, j), distance)
+
+    def test_distance_rows(self):
+        u, v=numpy.triu_indices(len(self.sim_net.vertex_attrs), 1)
+        self.sim_net.drop_caches()
+        expected=self.sim_net.min_distances(u, v)
+        # NOTE: blocks of rows of distance matrices are computed on first access only
+        self.sim_net.build_caches()
+        for distances in self.sim_net.distance_matrices:
+            if distances is not None:
+                distances.block_len=2
+                distances.blocks=[None]*(-(-distances.shape[0]//2))
+        self.assertTrue(all(distances is None or distances.nbytes == 0 for distances in self.sim_net.distance_matrices))
+        numpy.testing.assert_allclose(self.sim_net.min_distances(u[:3], v[:3]), expected[:3])
+        numpy.testing.assert_allclose(self.sim_net.min_distances(u, v), expected)
+        for (i, j), distance in zip(zip(u, v)[::7], expected[::7]):
+            self.assertAlmostEqual(self.sim_net.min_distance(i, j), distance)
+
+    def test_chunks(self):
+        sim_net=SimilarityGraph( self.sim_net.vertex_attrs, list("cocccoggggo"), settings=[(500, 0.), (5000, 2.)],
+                                 sample=self.sim_net.sampled_vertex_attrs )
+        edges=[(i, j, p) for i, j, p in sim_net.edges_probabilities() if numpy.any(p > 0.)]
+        chunks=[chunk.copy() for chunk in sim_net.edges_probabilities_chunks(4)]
+        self.assertTrue(all(len(chunk) <= 4 for chunk in chunks))
+        chunked_edges=numpy.concatenate(chunks)
+        self.assertEqual([(i, j) for i, j, p in edges], zip(chunked_edges['src_node'], chunked_edges['trg_node']))
+        for (i, j, p), q in zip(edges, chunked_edges['weight']):
+            numpy.testing.assert_allclose(p, q)
+
+    def test_ordering(self):
+        sample=self.sim_net.sampled_vertex_attrs
+        sim_net=SimilarityGraph( self.sim_net.vertex_attrs, list("cocccoggggo"), hss=500, damping=0., sample=sample )
+        expected={(i,j) : p for i, j, p in sim_net.edges_probabilities() if p > 0}
+        for ordering in ('hilbert', 'morton'):
+            sim_net=SimilarityGraph( self.sim_net.vertex_attrs, list("cocccoggggo"), hss=500, damping=0., sample=sample,
+                                     ordering=ordering, tile_size=3 )
+            edges={(i,j) : p for i, j, p in sim_net.edges_probabilities() if p > 0}
+            self.assertEqual(sorted(edges), sorted(expected))
+            for e, p in edges.items():
+                self.assertEqual(p, expected[e])
+
+    def test_edge_density(self):
+        sample=self.sim_net.sampled_vertex_attrs
+        sim_net=SimilarityGraph( self.sim_net.vertex_attrs, list("cocccoggggo"), hss=5, damping=0., sample=sample )
+        num_edges=sum(1 for _, _, p in sim_net.edges_probabilities() if p > 0)
+        density=sim_net.estimate_edge_density(num_samples=1<<14)
+        self.assertAlmostEqual(density, num_edges/(len(sim_net)*(len(sim_net) - 1)//2), delta=0.05)
+
+    def test_matmat(self):
+        num_vertices=len(self.sim_net)
+        matrix=numpy.zeros((num_vertices, num_vertices))
+        for i, j, p in self.sim_net.edges_probabilities():
+            matrix[i,j]=matrix[j,i]=p
+        X=numpy.random.RandomState(0).rand(num_vertices, 2)
+        self.assertTrue(numpy.allclose(self.sim_net.matmat(X, block_len=7), matrix.dot(X)))
+        self.assertTrue(numpy.allclose(self.sim_net.matvec(X[:,0]), matrix.dot(X[:,0])))
+
+    def test_neighbors(self):
+        sample=self.sim_net.sampled_vertex_attrs
+        for ordering in (None, 'hilbert'):
+            sim_net=SimilarityGraph( self.sim_net.vertex_attrs, list("cocccoggggo"), hss=500, damping=0., sample=sample,
+                                     ordering=ordering, tile_size=3, row_cache_size=2 )
+            for u in xrange(len(sim_net)):
+                expected=[sim_net.edge_probability(u, v) if v != u else 0. for v in xrange(len(sim_net))]
+                self.assertTrue(numpy.allclose(sim_net.row(u, block_len=4), expected))
+            vertices, probabilities=sim_net.neighbors(3, k=2)
+            self.assertTrue(len(vertices) <= 2)
+            self.assertTrue(numpy.all(numpy.diff(probabilities) <= 0.))
+            row=sim_net.row(3)
+            self.assertTrue(numpy.allclose(row[vertices], probabilities))
+            self.assertEqual(len(sim_net.neighbors(3, min_p=1.1)[0]), 0)
+            self.assertTrue(sim_net.row_cache.hits >= 2)
+            self.assertTrue(len(sim_net.row_cache) <= 2)
+
+    def test_lin_symmetry(self):
+        # NOTE: vertex 0 has no equal agents in the sample, whereas vertex 1 has
+        sim_net=SimilarityGraph( self.sim_net.vertex_attrs, list("cocccoggggo"),
+                                 hss=5000, damping=0., sample=self.sim_net.vertex_attrs[1:] )
+        frequencies=sim_net.frequencies
+        self.assertEqual(frequencies.num_equal(0), 0)
+        self.assertTrue(frequencies.num_equal(1) > 0)
+        for v in xrange(1, len(sim_net)):
+            self.assertAlmostEqual(sim_net.lin_similarity(0, v), sim_net.lin_similarity(v, 0))
+            self.assertAlmostEqual(sim_net.edge_probability(0, v), sim_net.edge_probability(v, 0))
+        # Former normalization by a half of the logarithm (if only the first vertex is unique)
+        # made the probability of the edge depend on the order of its vertices
+        num_sample, num_total=float(frequencies.size), len(sim_net)
+        former=numpy.log2(num_sample/frequencies.num_similar(0, 1))/\
+               (0.5*numpy.log2(num_sample*num_total/frequencies.num_equal(1)))
+        self.assertNotAlmostEqual(former, sim_net.lin_similarity(1, 0))
+        self.assertAlmostEqual(former, 2*sim_net.lin_similarity(1, 0))
+
+    def test_class_network(self):
+        # NOTE: every agent has 2 twins
+        sim_net=SimilarityGraph( numpy.tile(self.sim_net.vertex_attrs, 3), list("cocccoggggo"),
+                                 hss=5000, damping=0., sample=self.sim_net.sampled_vertex_attrs )
+        classes=sim_net.vertex_classes()
+        self.assertEqual(len(classes[1]), 10)
+        class_edges=numpy.array( list(sim_net.class_edges_probabilities(classes)),
+                                 dtype=[('src_node', 'i8'), ('trg_node', 'i8'), ('weight', 'f8')] )
+        chunks=list(expand_class_edges(class_edges, *class_members(classes[0]), chunk_len=7))
+        self.assertTrue(all(len(chunk) <= 7 for chunk in chunks))
+        edges=numpy.concatenate(chunks)
+        expected={(i,j) : p for i, j, p in sim_net.edges_probabilities()}
+        self.assertEqual(sorted(expected), sorted(zip(edges['src_node'], edges['trg_node'])))
+        for i, j, p in edges:
+            self.assertAlmostEqual(p, expected[(i,j)])
+            self.assertAlmostEqual(p, sim_net.edge_probability(j, i))
+        # Edges with unit probabilities are always drawn, and edges with zero probabilities never
+        for weight in (0., 1.):
+            class_edges['weight']=weight
+            sampled=list(expand_class_edges( class_edges, *class_members(classes[0]), sample=True,
+                                             random_state=numpy.random.RandomState(0), chunk_len=7 ))
+            self.assertEqual(sum(len(chunk) for chunk in sampled), len(edges) if weight else 0)
+            if weight:
+                sampled=numpy.concatenate(sampled)
+                self.assertEqual( sorted(zip(sampled['src_node'], sampled['trg_node'])),
+                                  sorted(zip(edges['src_node'], edges['trg_node'])) )
+
 if __name__ == '__main__':
     unittest.main()
@@ -3,7 +3,11 @@ A package for making work in parallel environments easier.
 
 It provides:
 - parallel iterators (``triu`` contains iterators for upper triangular matrix)
+- per-process profiling with merged reports (``profiler``)
+- memory budget of processes (``memory``)
 """
 
 import sn4sp.parallel.triu
-from sn4sp.parallel.triu import triu_index
+from sn4sp.parallel.triu import triu_index, triu_ranges, triu_blocks
+from sn4sp.parallel.profiler import profiling
+from sn4sp.parallel.memory import MemoryBudget
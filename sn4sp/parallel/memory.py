@@ -0,0 +1,170 @@
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+"""
+******
+Memory
+******
+Memory budget of MPI processes: sizes buffers and caches to fit the budget
+and tracks (peak) resident memory of the process.
+"""
+from __future__ import division, absolute_import, print_function
+
+__author__ = '\n'.join(['Sergiy Gogolenko <gogolenko@hlrs.de>',
+                        'Fabio Saracco <fabio@imt.it>'])
+
+__all__ = [ 'MemoryBudget',
+            'parse_memory_size',
+            'current_rss',
+            'peak_rss' ]
+
+import sys
+import numbers
+import logging
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource=None
+try:
+    import psutil
+except ImportError:
+    psutil=None
+
+from mpi4py import MPI
+
+_memory_units={ '' : 1, 'B' : 1, 'K' : 1<<10, 'M' : 1<<20, 'G' : 1<<30, 'T' : 1<<40 }
+
+def parse_memory_size(size):
+    """ Convert human-readable memory size (e.g., ``512M`` or ``2G``) to the number of bytes.
+
+    Parameters
+    ----------
+    size : str or int
+        Memory size. Suffixes ``K``, ``M``, ``G``, ``T`` (optionally followed by ``B``)
+        denote binary multiples.
+
+    Raises
+    ------
+    ValueError : exception
+        The size is not recognized.
+    """
+    if size is None or isinstance(size, numbers.Number):
+        return size
+    value=str(size).strip().upper()
+    if value.endswith('B') and len(value) > 1 and not value[-2].isdigit():
+        value=value[:-1]
+    unit=value[-1] if value and not value[-1].isdigit() else ''
+    if unit not in _memory_units:
+        raise ValueError( 'Unknown memory size "{0}"'.format(size) )
+    try:
+        return int(float(value[:len(value)-len(unit)])*_memory_units[unit])
+    except ValueError:
+        raise ValueError( 'Unknown memory size "{0}"'.format(size) )
+
+def current_rss():
+    """ Resident set size of the current process in bytes (``None`` if unknown). """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1])*resource.getpagesize()
+    except (IOError, OSError, AttributeError):
+        return None
+
+def peak_rss():
+    """ Peak resident set size of the current process in bytes (``None`` if unknown). """
+    if resource is None:
+        return current_rss()
+    max_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # NOTE: Linux reports `ru_maxrss` in kilobytes, while macOS does in bytes
+    return max_rss if sys.platform == 'darwin' else max_rss*1024
+
+class MemoryBudget(object):
+    """
+    Memory budget of an MPI process.
+
+    The budget is set either per process or per node. In the latter case,
+    it is shared evenly between processes running on the same node.
+    Without explicit limits, processes share evenly the memory available on their node.
+
+    Parameters
+    ----------
+    per_process : int or str
+        Memory budget of every process (bytes or human-readable size like ``2G``)
+    per_node : int or str
+        Memory budget of every node (bytes or human-readable size like ``64G``)
+    comm : mpi4py.MPI.Comm
+        MPI communicator (used only to find processes sharing a node)
+    """
+    def __init__(self, per_process=None, per_node=None, comm=MPI.COMM_WORLD):
+        per_process=parse_memory_size(per_process)
+        per_node=parse_memory_size(per_node)
+        node_comm=comm.Split_type(MPI.COMM_TYPE_SHARED)
+        self.node_size=node_comm.Get_size()
+        node_comm.Free()
+        if per_node is not None:
+            per_node_process=per_node // self.node_size
+            per_process=per_node_process if per_process is None else min(per_process, per_node_process)
+        self.limit=per_process
+
+    def __repr__(self):
+        return 'MemoryBudget(limit={0})'.format(self.limit)
+
+    def available(self):
+        """ Number of bytes which are still available within the budget
+        (``None`` if the budget is unlimited and the system memory is unknown).
+        """
+        available=None
+        if self.limit is not None:
+            rss=current_rss()
+            available=max(0, self.limit - (rss or 0))
+        if psutil is not None:
+            # NOTE: memory of the node is shared by all processes running on it
+            system_available=psutil.virtual_memory().available // self.node_size
+            available=system_available if available is None else min(available, system_available)
+        return available
+
+    def fits(self, nbytes, fraction=0.5, unknown=True):
+        """ Check if `nbytes` more bytes fit into the `fraction` of the available budget
+        (`unknown` is returned if the available memory is unknown).
+        """
+        available=self.available()
+        return unknown if available is None else nbytes <= fraction*available
+
+    def fit_length(self, itemsize, length, fraction=0.25, min_length=1):
+        """ Reduce number of items (e.g., buffer length) to fit into the `fraction` of the available budget.
+
+        Parameters
+        ----------
+        itemsize : int
+            Size of a single item in bytes
+        length : int
+            Requested number of items
+        fraction : float
+            Fraction of the available memory allowed to be occupied
+        min_length : int
+            Minimal number of items returned regardless of the budget
+
+        Returns
+        -------
+        length : int
+            Number of items fitting into the budget
+        """
+        available=self.available()
+        if available is None:
+            return int(length)
+        return int(max(min_length, min(length, fraction*available // itemsize)))
+
+    def exceeded(self):
+        """ Check if the process has exceeded its budget (or if the node starts swapping). """
+        if self.limit is not None and (current_rss() or 0) > self.limit:
+            return True
+        if psutil is not None and psutil.virtual_memory().available <= 100*(1<<20):  # 100MB
+            logging.warning( 'we are running out of memory! Remains {0}KB'.format(psutil.virtual_memory().available//1024) )
+            return True
+        return False
@@ -0,0 +1,191 @@
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+"""
+*********
+Profiling
+*********
+Collects ``cProfile`` statistics (and, optionally, sampled call stacks)
+in every MPI process and merges them into a single report.
+"""
+from __future__ import division, absolute_import, print_function
+
+__author__ = '\n'.join(['Sergiy Gogolenko <gogolenko@hlrs.de>',
+                        'Fabio Saracco <fabio@imt.it>'])
+
+__all__ = [ 'profiling',
+            'merge_profiles',
+            'hottest_functions' ]
+
+import os
+import signal
+import logging
+import contextlib
+import cProfile
+import pstats
+
+from mpi4py import MPI
+
+class _RawStats(object):
+    """ Adapter which lets ``pstats.Stats`` load raw profile dictionaries
+    (e.g., received from other MPI processes).
+    """
+    def __init__(self, stats):
+        self.stats=stats
+    def create_stats(self):
+        pass
+
+class _StackSampler(object):
+    """ Statistical profiler which records collapsed call stacks on ``SIGPROF``.
+
+    Collapsed stacks (``frame;frame;frame count`` lines) are the input format
+    of the common flame graph tools (e.g., ``flamegraph.pl`` or ``speedscope``).
+
+    Notes
+    -----
+    Signal handlers can be installed only from the main thread on Unix platforms.
+    """
+    def __init__(self, interval=1e-3):
+        self.interval=interval
+        self.stacks={}
+        self._handler=None
+
+    def start(self):
+        self._handler=signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        if self._handler is not None:
+            signal.signal(signal.SIGPROF, self._handler)
+            self._handler=None
+
+    def _sample(self, signum, frame):
+        stack=[]
+        while frame is not None:
+            code=frame.f_code
+            stack.append( '{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno) )
+            frame=frame.f_back
+        key=';'.join(reversed(stack))
+        self.stacks[key]=self.stacks.get(key, 0) + 1
+
+def merge_profiles(profiles):
+    """ Merge raw profile dictionaries into a single ``pstats.Stats`` object.
+
+    Parameters
+    ----------
+    profiles : list
+        Sequence of raw profiles (``stats`` attributes of ``cProfile.Profile``
+        objects after ``create_stats`` call).
+
+    Returns
+    -------
+    stats : pstats.Stats
+        Merged statistics.
+    """
+    stats=pstats.Stats(_RawStats(dict(profiles[0])))
+    for profile in profiles[1:]:
+        stats.add(_RawStats(dict(profile)))
+    return stats
+
+def hottest_functions(stats, top=20, sort='tottime'):
+    """ List the hottest functions of the profile.
+
+    Parameters
+    ----------
+    stats : pstats.Stats
+        Profile statistics
+    top : int
+        Number of functions to report
+    sort : str
+        Sort key accepted by ``pstats.Stats.sort_stats``
+
+    Returns
+    -------
+    functions : list
+        List of (function, number of calls, total time, cumulative time) tuples.
+    """
+    stats.sort_stats(sort)
+    functions=[]
+    for func in stats.fcn_list[:top]:
+        _, num_calls, total_time, cumulative_time, _=stats.stats[func]
+        functions.append( (pstats.func_std_string(func), num_calls, total_time, cumulative_time) )
+    return functions
+
+def _log_hottest_functions(title, functions):
+    logging.info( '{0}:\n{1}'.format(title, '\n'.join( '{0:10d} {1:12.4f} {2:12.4f}  {3}'.\
+                                                        format(num_calls, total_time, cumulative_time, func) \
+                                                        for func, num_calls, total_time, cumulative_time in functions )) )
+
+@contextlib.contextmanager
+def profiling(path=None, comm=MPI.COMM_WORLD, top=20, sort='tottime', collapsed=False, interval=1e-3):
+    """ Profile the enclosed code in every MPI process and merge the results.
+
+    On exit, the per-process profiles are gathered on the root process,
+    merged and stored as a single ``pstats`` file. The hottest functions are logged
+    for every process and for the merged profile.
+    Since merging is collective, all processes of `comm` must leave the context.
+
+    Parameters
+    ----------
+    path : str
+        Name of the merged ``pstats`` file. If ``None``, only the reports are logged.
+    comm : mpi4py.MPI.Comm
+        MPI communicator
+    top : int
+        Number of the hottest functions to report
+    sort : str
+        Sort key accepted by ``pstats.Stats.sort_stats``
+    collapsed : bool
+        If ``True``, additionally sample call stacks and write them in the collapsed format
+        to ``<path>.collapsed`` (input for flame graphs).
+    interval : float
+        Sampling interval (in seconds of CPU time) for collapsed stacks.
+
+    Examples
+    --------
+    >>> with profiling('simnet.prof', comm, collapsed=True):
+    ...     write_edges_probabilities_h5(G, 'simnet.h5')
+    """
+    if collapsed and path is None:
+        raise ValueError( 'collapsed stacks require the output path' )
+
+    profiler=cProfile.Profile()
+    sampler=_StackSampler(interval) if collapsed else None
+    if sampler is not None:
+        sampler.start()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if sampler is not None:
+            sampler.stop()
+
+    profiler.create_stats()
+    comm_rank=comm.Get_rank()
+    _log_hottest_functions( 'hottest functions in process {0}'.format(comm_rank),
+                            hottest_functions(merge_profiles([profiler.stats]), top, sort) )
+
+    profiles=comm.gather(profiler.stats, root=0)
+    stacks=comm.gather(sampler.stacks, root=0) if sampler is not None else None
+    if comm_rank == 0:
+        stats=merge_profiles(profiles)
+        _log_hottest_functions( 'hottest functions in {0} processes'.format(len(profiles)),
+                                hottest_functions(stats, top, sort) )
+        if path is not None:
+            stats.dump_stats(path)
+            logging.info( 'merged profile is stored in "{0}"'.format(path) )
+        if stacks is not None:
+            merged_stacks={}
+            for process_stacks in stacks:
+                for stack, count in process_stacks.items():
+                    merged_stacks[stack]=merged_stacks.get(stack, 0) + count
+            with open('{0}.collapsed'.format(path), 'w') as output_file:
+                for stack in sorted(merged_stacks):
+                    output_file.write( '{0} {1}\n'.format(stack, merged_stacks[stack]) )
+            logging.info( 'collapsed stacks are stored in "{0}.collapsed"'.format(path) )
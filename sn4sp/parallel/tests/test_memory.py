@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+""" Unit tests for memory budgets of processes
+"""
+
+from __future__ import division, absolute_import, print_function
+import unittest
+
+from mpi4py import MPI
+
+# TODO: remove in alpha release
+import os
+import sys
+sys.path.insert( 0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))) )
+from sn4sp.parallel import memory
+from sn4sp.parallel.memory import MemoryBudget, parse_memory_size
+
+class TestMemoryBudget(unittest.TestCase):
+    """ Tests for memory budgets of processes."""
+
+    def _budget(self, available):
+        budget=MemoryBudget(comm=MPI.COMM_SELF)
+        budget.available=lambda: available
+        return budget
+
+    def test_parse_memory_size(self):
+        self.assertEqual(parse_memory_size('512M'), 512<<20)
+        self.assertEqual(parse_memory_size('2gb'), 2<<30)
+        self.assertEqual(parse_memory_size('1.5K'), 1536)
+        self.assertEqual(parse_memory_size(4096), 4096)
+        self.assertEqual(parse_memory_size('100'), 100)
+        self.assertIsNone(parse_memory_size(None))
+        self.assertRaises(ValueError, parse_memory_size, '2X')
+        self.assertRaises(ValueError, parse_memory_size, 'MB')
+
+    def test_per_node(self):
+        budget=MemoryBudget('1G', '64M', comm=MPI.COMM_SELF)
+        self.assertEqual(budget.limit, 64<<20)
+        budget=MemoryBudget('1M', '64M', comm=MPI.COMM_SELF)
+        self.assertEqual(budget.limit, 1<<20)
+
+    def test_fit_length(self):
+        budget=self._budget(1000)
+        self.assertEqual(budget.fit_length(10, 1000), 25)
+        self.assertEqual(budget.fit_length(10, 10), 10)
+        self.assertEqual(budget.fit_length(10, 1000, fraction=1.), 100)
+        self.assertEqual(budget.fit_length(10**6, 1000, min_length=3), 3)
+        self.assertEqual(self._budget(None).fit_length(10, 1000), 1000)
+
+    def test_fits(self):
+        budget=self._budget(1000)
+        self.assertTrue(budget.fits(500))
+        self.assertFalse(budget.fits(501))
+        self.assertTrue(self._budget(None).fits(1<<40))
+        self.assertFalse(self._budget(None).fits(1, unknown=False))
+        self.assertTrue(budget.fits(500, unknown=False))
+
+    def test_node_share(self):
+        if memory.psutil is None:
+            self.skipTest( 'available memory of the node is unknown' )
+        budget=MemoryBudget(comm=MPI.COMM_SELF)
+        budget.node_size=4
+        self.assertLessEqual(budget.available(), memory.psutil.virtual_memory().available//4 + (1<<24))
+
+    def test_exceeded(self):
+        if memory.current_rss() is None:
+            self.skipTest( 'resident memory of the process is unknown' )
+        self.assertTrue(MemoryBudget(1, comm=MPI.COMM_SELF).exceeded())
+        self.assertEqual(MemoryBudget(1, comm=MPI.COMM_SELF).available(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+""" Unit tests for merging per-process profiles
+"""
+
+from __future__ import division, absolute_import, print_function
+import unittest
+import cProfile
+
+# TODO: remove in alpha release
+import os
+import sys
+sys.path.insert( 0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))) )
+from sn4sp.parallel import profiler
+
+def _work(n):
+    return sum(i*i for i in range(n))
+
+class TestProfiler(unittest.TestCase):
+    """ Tests for merging profiles of several processes."""
+
+    def _profile(self, num_calls):
+        prof=cProfile.Profile()
+        prof.enable()
+        for _ in range(num_calls):
+            _work(100)
+        prof.disable()
+        prof.create_stats()
+        return prof.stats
+
+    def test_merge_profiles(self):
+        stats=profiler.merge_profiles([self._profile(2), self._profile(3)])
+        num_calls={ func[2] : stats.stats[func][1] for func in stats.stats }
+        self.assertEqual(num_calls['_work'], 5)
+
+    def test_hottest_functions(self):
+        stats=profiler.merge_profiles([self._profile(2)])
+        functions=profiler.hottest_functions(stats, top=2)
+        self.assertEqual(len(functions), 2)
+        self.assertTrue(functions[0][2] >= functions[1][2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+""" Unit tests for iterators over upper triangular matrices
+"""
+
+from __future__ import division, absolute_import, print_function
+import unittest
+import numpy
+
+# TODO: remove in alpha release
+import os
+import sys
+sys.path.insert( 0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))) )
+from sn4sp.parallel import triu
+
+class _Comm(object):
+    """ Stand-in for a process of MPI communicator (iterators only query rank and size). """
+    def __init__(self, rank, size):
+        self.rank, self.size=rank, size
+
+    def Get_rank(self):
+        return self.rank
+
+    def Get_size(self):
+        return self.size
+
+class TestTriu(unittest.TestCase):
+    """ Tests for iterators over upper triangular matrices."""
+
+    def test_positions(self):
+        for dims in xrange(1, 20):
+            positions=[triu.ij2pos(i, j, dims) for i in xrange(dims) for j in xrange(i+1, dims)]
+            self.assertEqual(positions, range(dims*(dims - 1)//2))
+            for pos in positions:
+                self.assertEqual(triu.ij2pos(*(triu.pos2ij(pos, dims) + (dims,))), pos)
+        # NOTE: floating point conversion is inexact for such large matrices
+        dims=3*10**9
+        for pos in (0, 10**17 + 7, dims*(dims - 1)//2 - 1):
+            i, j=triu.pos2ij(pos, dims)
+            self.assertTrue(0 <= i < j < dims)
+            self.assertEqual(triu.ij2pos(i, j, dims), pos)
+
+    def test_positions_array(self):
+        dims=numpy.repeat(numpy.arange(2, 40), numpy.arange(2, 40)*numpy.arange(1, 39)//2)
+        pos=numpy.hstack([numpy.arange(n*(n - 1)//2) for n in xrange(2, 40)])
+        i, j=triu.pos2ij_array(pos, dims)
+        self.assertEqual(zip(i, j), [triu.pos2ij(p, n) for p, n in zip(pos, dims)])
+        # NOTE: floating point conversion is inexact for such large matrices
+        dims=10**9
+        pos=numpy.array([0, 10**17 + 7, dims*(dims - 1)//2 - dims, dims*(dims - 1)//2 - 1])
+        i, j=triu.pos2ij_array(pos, dims)
+        self.assertEqual(zip(i, j), [triu.pos2ij(p, dims) for p in pos])
+
+    def test_partition(self):
+        dims=23
+        expected=[(i, j) for i in xrange(dims) for j in xrange(i+1, dims)]
+        costs=numpy.arange(dims - 1, -1, -1)*numpy.linspace(1., 10., dims)
+        for scheduling, kwargs in (('even', {}), ('round_robin', {}), ('cost', {'costs' : costs})):
+            for size in (1, 4, 7):
+                pairs=[pair for rank in xrange(size)
+                       for pair in triu.triu_index(dims, _Comm(rank, size), scheduling, **kwargs)]
+                self.assertEqual(sorted(pairs), expected)
+
+    def test_blocks(self):
+        dims=31
+        for scheduling in ('even', 'round_robin', 'cost'):
+            for size in (1, 3):
+                for rank in xrange(size):
+                    expected=list(triu.triu_index(dims, _Comm(rank, size), scheduling))
+                    ranges=list(triu.triu_ranges(dims, _Comm(rank, size), scheduling))
+                    self.assertEqual([(i, j) for i, j_start, j_end in ranges for j in xrange(j_start, j_end)], expected)
+                    blocks=list(triu.triu_blocks(dims, _Comm(rank, size), scheduling, block_len=7))
+                    self.assertTrue(all(len(i) <= 7 for i, j in blocks))
+                    self.assertEqual([(i, j) for block in blocks for i, j in zip(*block)], expected)
+
+    def test_cost_balance(self):
+        dims, size=200, 4
+        costs=numpy.arange(dims - 1, -1, -1)*numpy.where(numpy.arange(dims) < dims//4, 10., 1.)
+        # Cost of a couple is the cost of its row per couple
+        couple_costs=costs[:-1]/numpy.arange(dims - 1, 0, -1)
+        shares=[sum(couple_costs[i] for i, j in triu.triu_cost_index(dims, _Comm(rank, size), costs=costs))
+                for rank in xrange(size)]
+        self.assertTrue(max(shares) - min(shares) < 2*max(couple_costs))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,18 +19,144 @@ __author__ = '\n'.join(['Sergiy Gogolenko <gogolenko@hlrs.de>',
 
 __all__ = [ 'triu_index',
             'triu_round_robin_index',
-            'triu_even_index' ]
+            'triu_even_index',
+            'triu_cost_index',
+            'triu_ranges',
+            'triu_even_ranges',
+            'triu_round_robin_ranges',
+            'triu_cost_ranges',
+            'triu_blocks',
+            'pos2ij',
+            'pos2ij_array',
+            'ij2pos' ]
 
 import logging
+import time
 
-from math import sqrt
+import numpy
 
-_scheduling_types = ('even', 'round_robin')
+_scheduling_types = ('even', 'round_robin', 'cost')
 
-def triu_even_index(dims, comm):
-    """ An iterator for upper triangular part of 2D matrix.
+def _isqrt(n):
+    """ Integer square root (floor) of non-negative integer `n` computed exactly. """
+    if n < 0:
+        raise ValueError( 'square root of negative number {0}'.format(n) )
+    if n == 0:
+        return 0
+    x=1 << ((n.bit_length() + 1) >> 1)
+    while True:
+        y=(x + n//x) >> 1
+        if y >= x:
+            return x
+        x=y
+
+def ij2pos(i, j, dims):
+    """ Convert pair of indices (i,j) with i < j to a position in an upper triangular matrix (row major way). """
+    i, j, dims=int(i), int(j), int(dims)
+    return i*dims - i*(i + 3)//2 + j - 1
+
+def pos2ij(pos, dims):
+    """ Convert position in an upper triangular matrix (row major way) to a pair of indices (i,j) with i < j.
+
+    Position `num_couples` (next after the last valid position) is converted to ``(dims - 1, dims)``.
+    """
+    pos, dims=int(pos), int(dims)
+    num_couples=dims*(dims - 1)//2
+    if pos >= num_couples:
+        return dims - 1, dims
+    # Row `i` is the largest one with ij2pos(i,i+1) <= pos, i.e., (2*dims - 1 - i)*i <= 2*pos
+    # NOTE: integer arithmetic keeps the conversion exact for any number of couples
+    i=(2*dims - 1 - _isqrt((2*dims - 1)**2 - 8*pos)) // 2
+    while i > 0 and ij2pos(i, i + 1, dims) > pos:
+        i-=1
+    while i + 1 < dims - 1 and ij2pos(i + 1, i + 2, dims) <= pos:
+        i+=1
+    return i, pos - ij2pos(i, i + 1, dims) + i + 1
+
+def pos2ij_array(pos, dims):
+    """ Convert arrays of positions in upper triangular matrices to arrays of pairs of indices (vectorized `pos2ij`).
+
+    Positions must be below the numbers of couples and dimensions below ``1.5e9`` (integers are 64-bit).
+
+    Parameters
+    ----------
+    pos : numpy.array
+        Positions in upper triangular matrices (row major way)
+    dims : int or numpy.array
+        Dimensions of the matrices
+
+    Returns
+    -------
+    i, j : numpy.array
+        Pairs of indices with ``i < j``
+    """
+    pos, dims=numpy.broadcast_arrays(numpy.asarray(pos, dtype='i8'), numpy.asarray(dims, dtype='i8'))
+    row_start=lambda i: i*(2*dims - i - 1)//2
+    # NOTE: the row is estimated with the square root of the exact discriminant (as in `pos2ij`)
+    #       and corrected with integer arithmetic
+    i=(2*dims - 1 - numpy.floor(numpy.sqrt(((2*dims - 1)**2 - 8*pos).astype('f8'))).astype('i8'))//2
+    i=numpy.clip(i, 0, numpy.maximum(dims - 2, 0))
+    while True:
+        beyond=(i > 0) & (row_start(i) > pos)
+        if not numpy.any(beyond):
+            break
+        i[beyond]-=1
+    while True:
+        before=(i + 1 < dims - 1) & (row_start(i + 1) <= pos)
+        if not numpy.any(before):
+            break
+        i[before]+=1
+    return i, pos - row_start(i) + i + 1
+
+def _position_ranges(dims, start, stop):
+    """ Iterator over ranges (i, j_start, j_end) of rows covering positions ``[start, stop)`` of upper triangular matrix. """
+    if start >= stop:
+        return
+    i, j=pos2ij(start, dims)
+    ie, je=pos2ij(stop, dims)
+    while i < ie:
+        yield i, j, dims
+        i+=1
+        j=i+1
+    if j < je:
+        yield i, j, je
+
+def _range_index(ranges):
+    """ Iterator over pairs (i,j) in ranges (i, j_start, j_end) of rows. """
+    for i, j_start, j_end in ranges:
+        for j in xrange(j_start, j_end):
+            yield i, j
+
+def _range_blocks(ranges, block_len):
+    """ Iterator over blocks ``(i, j)`` of arrays with at most `block_len` pairs in ranges (i, j_start, j_end) of rows. """
+    rows, starts, ends, size=[], [], [], 0
+    for i, j_start, j_end in ranges:
+        while j_start < j_end:
+            j_stop=min(j_end, j_start + block_len - size)
+            rows.append(i)
+            starts.append(j_start)
+            ends.append(j_stop)
+            size+=j_stop - j_start
+            j_start=j_stop
+            if size == block_len:
+                yield _expand_ranges(rows, starts, ends)
+                rows, starts, ends, size=[], [], [], 0
+    if size > 0:
+        yield _expand_ranges(rows, starts, ends)
+
+def _expand_ranges(rows, starts, ends):
+    """ Arrays of indices (i, j) of pairs in ranges of rows. """
+    starts=numpy.asarray(starts, dtype='i8')
+    lengths=numpy.asarray(ends, dtype='i8') - starts
+    offsets=numpy.cumsum(lengths) - lengths
+    i=numpy.repeat(numpy.asarray(rows, dtype='i8'), lengths)
+    j=numpy.arange(offsets[-1] + lengths[-1], dtype='i8') + numpy.repeat(starts - offsets, lengths)
+    return i, j
+
+def triu_even_ranges(dims, comm):
+    """ An iterator over ranges of rows in upper triangular part of 2D matrix.
     Distributes upper triangular matrix elements evenly between processes
-    as if it were stored densely in a flat 1D array row-by-row (row major way). 
+    (see ``triu_even_index``) and yields (i, j_start, j_end) ranges of rows.
     Parameters
     ----------
     dims : int
@@ -39,54 +165,121 @@ def triu_even_index(dims, comm):
         MPI communicator
     See Also
     --------
-    triu_round_robin_index
-    Examples
-    --------
-    >>> for index in triu.triu_even_index():
-    ...     print(index)
+    triu_even_index, triu_ranges
     """
-
     comm_rank=comm.Get_rank()
     comm_size=comm.Get_size()
 
     # Estimate number of potential edges (couples)
-    num_couples=int((dims - 1)*dims/2)  # total number of couples (potential edges) in the graph.
-    def pos2ij(pos):
-        """ Convert position in an upper triangular matrix to a pair of indices (i,j). """
-        i=int(dims - sqrt((dims-.5)**2 - 2.*pos) - 0.5) # take floor with `int`
-        j=int(pos + i*(i + 1)/2 - i*(dims - 1) + 1)
-        return i,j
-    def ij2pos(i,j):
-        """ Convert pair of indices (i,j) to a position in an upper triangular matrix. """
-        return int(i*dims - i*(i + 3)/2 + j)
+    num_couples=dims*(dims - 1)//2  # total number of couples (potential edges) in the graph.
 
     # Distribute computational work (couples) between MPI process.
     couples_per_process=num_couples // comm_size  # ceil(num_couples/num_processes)
     couples_remainder=num_couples % comm_size
-        
-    # (i0,j0) - indices of the first couple to handle in the current process.
-    # (ie,je) - indices of the last couple to handle in the current process
-    #           (if the process is last use the next after the last valid couple of indices).
-    if comm_rank < couples_remainder:
-        i0,j0=pos2ij((couples_per_process+1)*comm_rank)
-        ie,je=pos2ij((couples_per_process+1)*(comm_rank + 1))
-    else:
-        i0,j0=pos2ij(couples_per_process*comm_rank + couples_remainder)
-        ie,je = (dims - 1, dims) if comm_rank + 1 == comm_size else \
-                pos2ij(couples_per_process*(comm_rank + 1) + couples_remainder)
+
+    # [start, stop) - positions of the couples to handle in the current process.
+    # NOTE: positions are integers, so shares of processes are disjoint and complete at any size
+    start=couples_per_process*comm_rank + min(comm_rank, couples_remainder)
+    stop=start + couples_per_process + (1 if comm_rank < couples_remainder else 0)
 
     logging.info( 'Iterate over couples between {0} and {1}, number of couples {2}'.\
-                  format((i0,j0), (ie,je), ij2pos(ie,je)-ij2pos(i0,j0)) )
+                  format(pos2ij(start, dims), pos2ij(stop, dims), stop - start) )
+
+    return _position_ranges(dims, start, stop)
+
+def triu_round_robin_ranges(dims, comm):
+    """ An iterator over ranges of rows in upper triangular part of 2D matrix.
+    Yields whole rows (i, i+1, dims) in a Round-Robin fasion (see ``triu_round_robin_index``).
+    Parameters
+    ----------
+    dims : int
+        dimensionality of the matrix
+    comm : MPI_Communicator
+        MPI communicator
+    See Also
+    --------
+    triu_round_robin_index, triu_ranges
+    """
+    for i in xrange(comm.Get_rank(), dims - 1, comm.Get_size()):
+        yield i, i + 1, dims
 
-    # Iterate over couples
-    i, j = i0, j0
-    while i!=ie or j!=je:
-        yield i, j
+def triu_cost_ranges(dims, comm, costs=None):
+    """ An iterator over ranges of rows in upper triangular part of 2D matrix.
+    Distributes contiguous ranges of elements with balanced estimated costs
+    between processes (see ``triu_cost_index``) and yields (i, j_start, j_end) ranges of rows.
+    Parameters
+    ----------
+    dims : int
+        dimensionality of the matrix
+    comm : mpi4py.MPI.Comm
+        MPI communicator
+    costs : numpy.array
+        estimated costs of rows (the same in all processes);
+        if ``None``, costs are proportional to lengths of rows (as in ``triu_even_index``)
+    See Also
+    --------
+    triu_cost_index, triu_ranges
+    """
+    comm_rank=comm.Get_rank()
+    comm_size=comm.Get_size()
+
+    row_lengths=numpy.arange(dims - 1, -1, -1, dtype='i8')
+    costs=row_lengths.astype('f8') if costs is None else numpy.asarray(costs, dtype='f8')
+    if len(costs) != dims:
+        raise ValueError( 'number of row costs {0} does not match dimensionality {1}'.format(len(costs), dims) )
+    cumulative_costs=numpy.hstack(([0.], numpy.cumsum(costs)))
+    row_offsets=numpy.hstack(([0], numpy.cumsum(row_lengths)))
+
+    def split(rank):
+        """ Position at which the share of the process `rank` starts. """
+        if rank == 0:
+            return 0
+        if rank == comm_size or cumulative_costs[-1] <= 0.:
+            return int(row_offsets[-1])*rank//comm_size
+        target=cumulative_costs[-1]*rank/comm_size
+        # Find the row where the cumulative cost reaches the target and interpolate within the row
+        i=min(int(numpy.searchsorted(cumulative_costs, target, side='right')) - 1, dims - 1)
+        fraction=(target - cumulative_costs[i])/costs[i] if costs[i] > 0. else 0.
+        return int(row_offsets[i]) + min(int(fraction*int(row_lengths[i])), int(row_lengths[i]))
+
+    start, stop=split(comm_rank), split(comm_rank + 1)
+    # Estimated cost of the range (assuming uniform costs within rows)
+    i0, j0=pos2ij(start, dims)
+    ie, je=pos2ij(stop, dims)
+    def cost_until(i, j):
+        return cumulative_costs[i] + (costs[i]*(j - i - 1)/row_lengths[i] if i < dims - 1 and row_lengths[i] else 0.)
+    estimated_cost=cost_until(ie, je) - cost_until(i0, j0)
+    logging.info( 'Iterate over couples between {0} and {1}, number of couples {2}, estimated cost {3:.3g} ({4:.1%})'.\
+                  format((i0,j0), (ie,je), stop - start, estimated_cost,
+                         estimated_cost/cumulative_costs[-1] if cumulative_costs[-1] > 0. else 0.) )
+
+    start_time=time.time()
+    for row_range in _position_ranges(dims, start, stop):
+        yield row_range
+    # NOTE: realized cost includes processing of the couples by the consumer of the iterator
+    logging.info( 'process {0} realized cost {1:.3f}s for estimated cost {2:.3g}'.\
+                  format(comm_rank, time.time() - start_time, estimated_cost) )
+
+def triu_even_index(dims, comm):
+    """ An iterator for upper triangular part of 2D matrix.
+    Distributes upper triangular matrix elements evenly between processes
+    as if it were stored densely in a flat 1D array row-by-row (row major way). 
+    Parameters
+    ----------
+    dims : int
+        dimensionality of the matrix
+    comm : mpi4py.MPI.Comm
+        MPI communicator
+    See Also
+    --------
+    triu_round_robin_index
+    Examples
+    --------
+    >>> for index in triu.triu_even_index():
+    ...     print(index)
+    """
 
-        j+=1
-        if j == dims:  # move to the next row
-            i+=1
-            j=i+1
+    return _range_index(triu_even_ranges(dims, comm))
 
 def triu_round_robin_index(dims, comm):
     """ An iterator for upper triangular part of 2D matrix.
@@ -121,11 +314,34 @@ def triu_round_robin_index(dims, comm):
     >>> str(sympy.solve(S(i) - K, i)[0]), str(pos)
     """
 
-    for i in xrange(comm.Get_rank(), dims, comm.Get_size()):
-        for j in xrange(i+1, dims):
-            yield i, j
+    return _range_index(triu_round_robin_ranges(dims, comm))
+
+def triu_cost_index(dims, comm, costs=None):
+    """ An iterator for upper triangular part of 2D matrix.
+    Distributes contiguous ranges of upper triangular matrix elements (row major way)
+    between processes, so that estimated costs of the ranges are balanced.
+    Costs of elements are assumed uniform within every row.
+    Parameters
+    ----------
+    dims : int
+        dimensionality of the matrix
+    comm : mpi4py.MPI.Comm
+        MPI communicator
+    costs : numpy.array
+        estimated costs of rows (the same in all processes);
+        if ``None``, costs are proportional to lengths of rows (as in ``triu_even_index``)
+    See Also
+    --------
+    triu_even_index
+    Examples
+    --------
+    >>> row_lengths=numpy.arange(dims-1, -1, -1)
+    >>> for index in triu.triu_cost_index(dims, comm, costs=row_lengths*(1. + numpy.arange(dims))):
+    ...     print(index)
+    """
+    return _range_index(triu_cost_ranges(dims, comm, costs))
 
-def triu_index(dims, comm, scheduning='even'):
+def triu_index(dims, comm, scheduning='even', **kwargs):
     """ An iterator for upper triangular part of 2D matrix.
     Parameters
     ----------
@@ -138,6 +354,9 @@ def triu_index(dims, comm, scheduning='even'):
         - ``even`` Distributes upper triangular matrix elements evenly between processes
           as if it were stored densely in a flat 1D array row-by-row (row major way). 
         - ``round_robin`` Iterates by rows in a Round-Robin fasion.
+        - ``cost`` Distributes contiguous ranges of elements with balanced estimated costs.
+    kwargs : dict
+        options of the iterator (e.g., ``costs`` of rows for ``cost`` scheduling)
     See Also
     --------
     triu_even_index
@@ -148,4 +367,55 @@ def triu_index(dims, comm, scheduning='even'):
     """
     if scheduning not in _scheduling_types:
         raise ValueError('Unknown scheduling type "{0}"'.format(scheduning))
-    return eval('triu_{0}_index(dims, comm)'.format(scheduning))
+    return globals()['triu_{0}_index'.format(scheduning)](dims, comm, **kwargs)
+
+def triu_ranges(dims, comm, scheduning='even', **kwargs):
+    """ An iterator over ranges (i, j_start, j_end) of rows in upper triangular part of 2D matrix.
+    Pairs (i, j) with ``j_start <= j < j_end`` of the ranges are the same as pairs yielded by ``triu_index``.
+    Parameters
+    ----------
+    dims : int
+        dimensionality of the matrix
+    comm : MPI_Communicator
+        MPI communicator
+    scheduning : str
+        type of iteration (see ``triu_index``)
+    kwargs : dict
+        options of the iterator (e.g., ``costs`` of rows for ``cost`` scheduling)
+    See Also
+    --------
+    triu_index, triu_blocks
+    Examples
+    --------
+    >>> for i, j_start, j_end in triu.triu_ranges(dims, comm):
+    ...     print(i, j_end - j_start)
+    """
+    if scheduning not in _scheduling_types:
+        raise ValueError('Unknown scheduling type "{0}"'.format(scheduning))
+    return globals()['triu_{0}_ranges'.format(scheduning)](dims, comm, **kwargs)
+
+def triu_blocks(dims, comm, scheduning='even', block_len=1<<16, **kwargs):
+    """ An iterator over blocks of indices in upper triangular part of 2D matrix.
+    Yields ``(i, j)`` pairs of arrays with at most `block_len` pairs
+    (the same pairs in the same order as ``triu_index``).
+    Parameters
+    ----------
+    dims : int
+        dimensionality of the matrix
+    comm : MPI_Communicator
+        MPI communicator
+    scheduning : str
+        type of iteration (see ``triu_index``)
+    block_len : int
+        maximum number of pairs in a block
+    kwargs : dict
+        options of the iterator (e.g., ``costs`` of rows for ``cost`` scheduling)
+    See Also
+    --------
+    triu_index, triu_ranges
+    Examples
+    --------
+    >>> for i, j in triu.triu_blocks(dims, comm, block_len=4096):
+    ...     print(numpy.column_stack((i, j)))
+    """
+    return _range_blocks(triu_ranges(dims, comm, scheduning, **kwargs), block_len)
@@ -3,3 +3,8 @@ A package for reading and writing similarity networks in various formats.
 """
 
 from sn4sp.readwrite.hdf5 import *
+from sn4sp.readwrite.preprocess import *
+from sn4sp.readwrite.region import *
+from sn4sp.readwrite.geodata import *
+from sn4sp.readwrite.sinks import *
+from sn4sp.readwrite.consolidate import *
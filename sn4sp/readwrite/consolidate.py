@@ -0,0 +1,274 @@
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+"""
+***********
+Consolidate
+***********
+Consolidation of edge lists of processes into a single edge list sorted by (source, target) vertices.
+
+Edges are sorted out of core with a parallel sample sort:
+- processes sample source vertices and split vertices into ranges of balanced numbers of edges,
+- edges are exchanged between processes in rounds of bounded size, and every process
+  stores received edges as sorted runs in a temporary file,
+- every process merges its runs and writes them to its (contiguous) part of the output.
+
+The consolidated network has the layout produced by ``write_edges_probabilities_h5``
+with a single edge list and the index of edges by source vertices (``vertex_offsets``).
+"""
+from __future__ import division, absolute_import, print_function
+
+__author__ = '\n'.join(['Sergiy Gogolenko <gogolenko@hlrs.de>',
+                        'Fabio Saracco <fabio@imt.it>'])
+__all__ = [ 'consolidate_edges_h5', ]
+
+import logging
+import datetime
+import tempfile
+
+from mpi4py import MPI
+import numpy
+
+from sn4sp import parallel
+from sn4sp.readwrite.hdf5 import _edge_list_datasets, _iter_edge_chunks, _open_input_file, _open_output_file, \
+                                 _write_array, _write_run_summary
+
+# Minimal number of edges read (or merged) at once
+_min_block_len=1024
+
+def _mirror(edges):
+    """ Edges in both directions (self-loops are not mirrored). """
+    mirrored=edges[edges['src_node'] != edges['trg_node']]
+    mirrored['src_node'], mirrored['trg_node']=mirrored['trg_node'], mirrored['src_node'].copy()
+    return numpy.concatenate((edges, mirrored))
+
+def _edge_keys(edges, num_vertices):
+    """ Keys ordering edges by (source, target) vertices. """
+    return edges['src_node']*num_vertices + edges['trg_node']
+
+def _sample_source_vertices(datasets, comm, symmetric):
+    """ Source vertices of edges sampled regularly from the share of edges of the current process
+    (see ``_iter_edge_chunks``).
+    """
+    rank, size=comm.Get_rank(), comm.Get_size()
+    offsets=numpy.hstack(([0], numpy.cumsum([len(dataset) for dataset in datasets])))
+    start, stop=offsets[-1]*rank//size, offsets[-1]*(rank + 1)//size
+    positions=numpy.unique(numpy.linspace(start, stop, max(16, 4096//size), endpoint=False).astype('i8'))
+    positions=positions[positions < stop]
+    samples=[]
+    for dataset, offset, end in zip(datasets, offsets[:-1], offsets[1:]):
+        selected=positions[(offset <= positions) & (positions < end)] - offset
+        if len(selected) > 0:
+            edges=dataset[list(selected)]
+            samples.append(edges['src_node'])
+            if symmetric:
+                samples.append(edges['trg_node'])
+    return numpy.hstack(samples) if samples else numpy.empty(0, dtype='i8')
+
+def _vertex_splitters(samples, num_vertices, comm):
+    """ Bounds of ranges of source vertices owned by processes from samples of source vertices (collective call). """
+    samples=numpy.sort(numpy.concatenate(comm.allgather(samples)))
+    size=comm.Get_size()
+    if len(samples) == 0:
+        return numpy.linspace(0, num_vertices, size + 1).astype('i8')
+    quantiles=samples[(numpy.arange(1, size)*len(samples))//size]
+    return numpy.hstack(([0], quantiles, [num_vertices])).astype('i8')
+
+class _RunFile(object):
+    """ Temporary file of sorted runs of edges. """
+    def __init__(self, dtype, dir=None):
+        self.dtype=dtype
+        self.file=tempfile.TemporaryFile(dir=dir)
+        self.runs=[]  # (offset, length) of runs in edges
+
+    def __len__(self):
+        return sum(length for _, length in self.runs)
+
+    def write(self, edges, num_vertices):
+        """ Sort edges and store them as a new run. """
+        if len(edges) == 0:
+            return
+        edges=edges[numpy.argsort(_edge_keys(edges, num_vertices), kind='mergesort')]
+        self.file.seek(0, 2)
+        self.runs.append((len(self), len(edges)))
+        self.file.write(edges.tobytes())
+
+    def read(self, offset, length):
+        self.file.seek(offset*self.dtype.itemsize)
+        return numpy.frombuffer(self.file.read(length*self.dtype.itemsize), dtype=self.dtype)
+
+    def merged(self, block_len, num_vertices):
+        """ Iterator over chunks of edges of all runs in sorted order.
+
+        Blocks of `block_len` edges of every run are merged at once: edges up to the smallest
+        last key of blocks of unfinished runs are in their final order.
+        """
+        if not self.runs:
+            return
+        positions=[offset for offset, _ in self.runs]
+        ends=[offset + length for offset, length in self.runs]
+        blocks=[self.read(0, 0) for _ in self.runs]
+        while True:
+            for k in xrange(len(self.runs)):
+                if len(blocks[k]) == 0 and positions[k] < ends[k]:
+                    length=min(block_len, ends[k] - positions[k])
+                    blocks[k]=self.read(positions[k], length)
+                    positions[k]+=length
+            keys=[_edge_keys(block, num_vertices) for block in blocks]
+            bounds=[key[-1] for key, position, end in zip(keys, positions, ends) if position < end]
+            bound=min(bounds) if bounds else None
+            parts=[]
+            for k, key in enumerate(keys):
+                stop=len(key) if bound is None else numpy.searchsorted(key, bound, side='right')
+                parts.append(blocks[k][:stop])
+                blocks[k]=blocks[k][stop:]
+            edges=numpy.concatenate(parts)
+            if len(edges) == 0 and bound is None:
+                return
+            yield edges[numpy.argsort(_edge_keys(edges, num_vertices), kind='mergesort')]
+
+    def close(self):
+        self.file.close()
+
+def consolidate_edges_h5(path, out_path, network_group="SimNet", edges_dataset="edge_list", symmetric=False,
+                         comm=MPI.COMM_WORLD, chunk_len=int(1e6), memory_budget=None, temp_dir=None):
+    """ Consolidate edge lists of the network into a single edge list sorted by (source, target) vertices.
+
+    Every process keeps in memory about 5 buffers of `chunk_len` edges and stores the rest
+    of its edges in a temporary file, so networks larger than the aggregate memory are consolidated.
+
+    Parameters
+    ----------
+    path : str
+        Path to HDF5 file with the network (see ``write_edges_probabilities_h5``)
+    out_path : str
+        Path to output HDF5 file with the consolidated network
+    symmetric : bool
+        If ``True``, store every edge in both directions, so that ``vertex_offsets``
+        index all edges incident to vertices.
+    comm : mpi4py.MPI.Comm
+        MPI communicator
+    chunk_len : int
+        Number of edges held in a buffer (shrunk to fit into the memory budget)
+    memory_budget : sn4sp.parallel.MemoryBudget
+        Memory budget of processes
+    temp_dir : str
+        Directory of temporary files (e.g., node-local storage)
+
+    Raises
+    ------
+    ValueError : exception
+        Keys of edges do not fit into 64-bit integers (too many vertices).
+
+    Notes
+    -----
+    The output network group holds a single edge list (``0/<edges_dataset>``) and
+    ``vertex_offsets``: edges with the source vertex ``v`` are at positions
+    ``vertex_offsets[v]:vertex_offsets[v+1]``. Attributes ``sorted`` and ``symmetric``
+    mark the consolidated network.
+
+    Examples
+    --------
+    >>> consolidate_edges_h5('simnet.h5', 'simnet_sorted.h5', symmetric=True)
+
+    See Also
+    --------
+    write_edges_probabilities_h5, read_edges_probabilities_h5
+    """
+    rank, size=comm.Get_rank(), comm.Get_size()
+    memory_budget=memory_budget or parallel.MemoryBudget(comm=comm)
+    start_time=datetime.datetime.now()
+    with _open_input_file(path, comm) as input_file:
+        input_group=input_file[network_group]
+        datasets=_edge_list_datasets(input_group, edges_dataset)
+        edge_type=datasets[0].dtype
+        num_vertices=input_group.attrs.get('num_vertices')
+        if 'class_sizes' in input_group:
+            num_vertices=len(input_group['class_sizes'])
+        chunk_len=comm.allreduce( memory_budget.fit_length(5*edge_type.itemsize, chunk_len, min_length=_min_block_len),
+                                  op=MPI.MIN )
+        # NOTE: every process receives at most `chunk_len` edges per round
+        read_len=max(_min_block_len, chunk_len//(size*(2 if symmetric else 1)))
+
+        if num_vertices is None:
+            max_vertex=max([ max(edges['src_node'].max(), edges['trg_node'].max()) \
+                             for edges in _iter_edge_chunks(input_group, edges_dataset, comm, chunk_len) ] + [-1])
+            num_vertices=comm.allreduce(max_vertex, op=MPI.MAX) + 1
+        num_vertices=int(num_vertices)
+        if num_vertices > 3037000499:
+            raise ValueError( 'too many vertices ({0}) to sort edges by 64-bit keys'.format(num_vertices) )
+
+        # Split source vertices between processes by samples of edges
+        splitters=_vertex_splitters(_sample_source_vertices(datasets, comm, symmetric), num_vertices, comm)
+        first_vertex, last_vertex=splitters[rank], splitters[rank+1]
+        logging.info( 'process {0} sorts edges of vertices {1}-{2}'.format(rank, first_vertex, last_vertex) )
+
+        # Exchange edges in rounds and store received edges as sorted runs
+        runs=_RunFile(edge_type, temp_dir)
+        run=numpy.empty(chunk_len, dtype=edge_type)
+        k=0
+        chunks=_iter_edge_chunks(input_group, edges_dataset, comm, read_len)
+        while True:
+            edges=next(chunks, None)
+            if not comm.allreduce(edges is not None, op=MPI.LOR):
+                break
+            if edges is None:
+                edges=numpy.empty(0, dtype=edge_type)
+            elif symmetric:
+                edges=_mirror(edges)
+            targets=numpy.searchsorted(splitters[1:-1], edges['src_node'], side='right')
+            order=numpy.argsort(targets, kind='mergesort')
+            send_counts=numpy.bincount(targets, minlength=size).astype('i8')*edge_type.itemsize
+            recv_counts=numpy.empty(size, dtype='i8')
+            comm.Alltoall(send_counts, recv_counts)
+            received=numpy.empty(recv_counts.sum()//edge_type.itemsize, dtype=edge_type)
+            send_displs=numpy.hstack(([0], numpy.cumsum(send_counts)[:-1]))
+            recv_displs=numpy.hstack(([0], numpy.cumsum(recv_counts)[:-1]))
+            comm.Alltoallv( [numpy.ascontiguousarray(edges[order]).view('B'), (send_counts, send_displs), MPI.BYTE],
+                            [received.view('B'), (recv_counts, recv_displs), MPI.BYTE] )
+            while len(received) > 0:
+                n=min(len(received), chunk_len - k)
+                run[k:k+n]=received[:n]
+                k+=n
+                received=received[n:]
+                if k == chunk_len:
+                    runs.write(run, num_vertices)
+                    k=0
+        runs.write(run[:k], num_vertices)
+        del run
+
+        # Write sorted edges and the index of source vertices
+        num_edges=len(runs)
+        offset=comm.exscan(num_edges) or 0
+        total=comm.allreduce(num_edges, op=MPI.SUM)
+        with _open_output_file(out_path, comm) as output_file:
+            output_group=output_file.create_group(network_group)
+            for name, value in input_group.attrs.items():
+                if name not in ('peak_rss', 'num_edges', 'hdf5_preallocated'):
+                    output_group.attrs[name]=value
+            output_group.attrs['sorted']=True
+            output_group.attrs['symmetric']=symmetric
+            for name in input_group:
+                # NOTE: the index of consolidated input networks is rebuilt
+                if not name.isdigit() and name != 'vertex_offsets':
+                    _write_array(output_group, name, input_group[name][...], comm)
+            edge_list=output_group.create_group('0').create_dataset(edges_dataset, shape=(total,), dtype=edge_type)
+            vertex_offsets=output_group.create_dataset('vertex_offsets', shape=(num_vertices + 1,), dtype='i8')
+
+            degrees=numpy.zeros(last_vertex - first_vertex, dtype='i8')
+            position=offset
+            for edges in runs.merged(max(_min_block_len, chunk_len//max(1, len(runs.runs))), num_vertices):
+                edge_list[position:position+len(edges)]=edges
+                position+=len(edges)
+                degrees+=numpy.bincount(edges['src_node'] - first_vertex, minlength=len(degrees))
+            runs.close()
+            if len(degrees) > 0:
+                vertex_offsets[first_vertex:last_vertex]=offset + numpy.cumsum(degrees) - degrees
+            if rank == size - 1:
+                vertex_offsets[num_vertices]=total
+            _write_run_summary(output_group, comm, num_edges, start_time)
+    logging.info( 'network "{0}" is consolidated to "{1}"'.format(path, out_path) )
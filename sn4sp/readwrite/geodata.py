@@ -0,0 +1,156 @@
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+"""
+*******
+Geodata
+*******
+Columnar HDF5 cache of administrative boundaries (e.g., municipality codes and polygons)
+converted from gzipped pickles of ``geopandas.GeoDataFrame`` objects.
+
+The cache holds a group ``level_<k>`` for every administrative level with
+- one dataset per (non-geometry) column,
+- ``boundary_coords`` -- (longitude,latitude) of vertices of all boundary rings,
+- ``ring_offsets`` -- offsets of the rings in ``boundary_coords``,
+- ``geometry_offsets`` -- offsets of the first ring of every geometry in ``ring_offsets``.
+"""
+from __future__ import division, absolute_import, print_function
+
+__author__ = '\n'.join(['Sergiy Gogolenko <gogolenko@hlrs.de>',
+                        'Fabio Saracco <fabio@imt.it>'])
+__all__ = [ 'convert_geodata_h5',
+            'read_geodata_h5', ]
+
+import gzip
+import pickle
+import logging
+
+from mpi4py import MPI
+import numpy
+import h5py
+
+def _geometry_rings(geometry):
+    """ Sequence of rings (exteriors and interiors) of a (multi)polygon as arrays of coordinates. """
+    if geometry is None or geometry.is_empty:
+        return []
+    if hasattr(geometry, 'geoms'):
+        return [ring for part in geometry.geoms for ring in _geometry_rings(part)]
+    return [numpy.asarray(ring.coords)[:,:2] for ring in [geometry.exterior] + list(geometry.interiors)]
+
+def _column_array(column):
+    """ Convert table column to array storable in HDF5 (objects are stored as fixed-length strings). """
+    values=numpy.asarray(column)
+    if values.dtype.kind in ('O', 'U'):
+        values=numpy.array([str(value) for value in values], dtype='S')
+    return values
+
+def convert_geodata_h5(pickle_path, path, levels=None):
+    """ Convert gzipped pickle with administrative boundaries to columnar HDF5 cache.
+
+    Requires ``geopandas`` (to unpickle the data).
+
+    Parameters
+    ----------
+    pickle_path : str
+        Path to gzipped pickle with a sequence (or dictionary) of ``geopandas.GeoDataFrame``
+        objects indexed by administrative levels.
+    path : str
+        Path to output HDF5 file.
+    levels : list
+        Administrative levels to convert (all if ``None``).
+
+    Examples
+    --------
+    >>> convert_geodata_h5('Piemonte_NUTS3_to_LAU2_gdf.pkl.gz', 'Piemonte_NUTS3_to_LAU2.h5')
+
+    See Also
+    --------
+    read_geodata_h5
+    """
+    with gzip.open(pickle_path, 'rb') as pickle_file:
+        frames=pickle.load(pickle_file)
+    if not hasattr(frames, 'keys'):
+        frames=dict(enumerate(frames))
+    levels=sorted(frames.keys()) if levels is None else levels
+
+    with h5py.File(path, 'w') as output_file:
+        for level in levels:
+            frame=frames[level]
+            group=output_file.create_group('level_{0}'.format(level))
+            geometry_column=getattr(frame, '_geometry_column_name', None)
+            for column in frame.columns:
+                if column != geometry_column:
+                    group.create_dataset(str(column), data=_column_array(frame[column]))
+            if geometry_column is None:
+                continue
+            rings=[_geometry_rings(geometry) for geometry in frame[geometry_column]]
+            ring_sizes=[len(ring) for geometry_rings in rings for ring in geometry_rings]
+            group.create_dataset( 'boundary_coords', dtype='f8',
+                                  data=numpy.vstack([ring for geometry_rings in rings for ring in geometry_rings]) \
+                                       if ring_sizes else numpy.empty((0, 2)) )
+            group.create_dataset('ring_offsets', data=numpy.hstack(([0], numpy.cumsum(ring_sizes))).astype('i8'))
+            group.create_dataset( 'geometry_offsets',
+                                  data=numpy.hstack(([0], numpy.cumsum([len(r) for r in rings]))).astype('i8') )
+    logging.info( 'geodata "{0}" is converted to "{1}"'.format(pickle_path, path) )
+
+def _mmap_dataset(path, dataset):
+    """ Memory-map a contiguous uncompressed dataset (``None`` if it is not possible). """
+    offset=dataset.id.get_offset()
+    if offset is None or dataset.chunks is not None or dataset.compression is not None:
+        return None
+    return numpy.memmap(path, mode='r', dtype=dataset.dtype, shape=dataset.shape, offset=offset)
+
+def read_geodata_h5(path, level, fields, comm=MPI.COMM_WORLD, mmap=False):
+    """ Read columns of administrative boundaries from HDF5 cache.
+
+    Either the root process reads requested columns and broadcasts them to other processes,
+    or every process memory-maps them.
+
+    Parameters
+    ----------
+    path : str
+        Path to HDF5 cache produced by ``convert_geodata_h5``.
+    level : int
+        Administrative level
+    fields : list
+        Names of columns to read (e.g., ``['l0', 'code']`` or ``['boundary_coords', 'ring_offsets']``).
+    comm : mpi4py.MPI.Comm
+        MPI communicator
+    mmap : bool
+        If ``True``, memory-map the columns in every process
+        (columns which cannot be memory-mapped are read).
+
+    Returns
+    -------
+    columns : dict
+        Dictionary of arrays indexed by column names.
+
+    Examples
+    --------
+    >>> codes=read_geodata_h5('Piemonte_NUTS3_to_LAU2.h5', 2, ['l0', 'code'])
+    >>> codes['code'][codes['l0'] == 0][0]
+
+    See Also
+    --------
+    convert_geodata_h5
+    """
+    group_name='level_{0}'.format(level)
+    if mmap:
+        columns={}
+        with h5py.File(path, 'r') as input_file:
+            for field in fields:
+                dataset=input_file[group_name][field]
+                columns[field]=_mmap_dataset(path, dataset)
+                if columns[field] is None:
+                    columns[field]=dataset[...]
+        return columns
+
+    columns=None
+    if comm.Get_rank() == 0:
+        with h5py.File(path, 'r') as input_file:
+            columns={ field : input_file[group_name][field][...] for field in fields }
+    return comm.bcast(columns, root=0)
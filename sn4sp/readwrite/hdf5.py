@@ -15,20 +15,37 @@ and writes similarity network as edge lists to HDF5 file.
 __author__ = '\n'.join(['Sergiy Gogolenko <gogolenko@hlrs.de>',
                         'Fabio Saracco <fabio@imt.it>'])
 __all__ = [ 'read_attr_table_h5',
-            'write_edges_probabilities_h5', ]
+            'write_edges_probabilities_h5',
+            'read_edges_probabilities_h5',
+            'read_sample_h5',
+            'update_edges_probabilities_h5',
+            'reweight_edges_h5',
+            'expand_class_network_h5',
+            'HDF5Tuning', ]
 
+import os
 import logging
 import datetime
-import psutil
+from itertools import chain
 
 from mpi4py import MPI
 import numpy
 import h5py
 
 from sn4sp.core import SimilarityGraph
+from sn4sp.core import geo
+from sn4sp.core.coarse import class_members, num_class_pairs, expand_class_edges
+from sn4sp import parallel
+from sn4sp.parallel.memory import parse_memory_size
+from sn4sp.readwrite import sinks
+from sn4sp.readwrite.region import _read_rows, region_rows
+
+# Minimal length of the edge buffer when it is shrunk to fit into the memory budget
+_min_chunk_len=1024
 
 def read_attr_table_h5(path, attr_types=None, attr_group='SPP10pc',
-                       attr_values_dataset='ppd', attr_types_dataset='da', truncate=None, **kwargs):
+                       attr_values_dataset='ppd', attr_types_dataset='da', truncate=None,
+                       region=None, region_index='region_index', **kwargs):
     """ Read node (agent) attributes in HDF5 format.
 
     Parameters
@@ -38,7 +55,13 @@ def read_attr_table_h5(path, attr_types=None, attr_group='SPP10pc',
     attr_types : list
         Sequence (list) of characters that helps to distinguish between attribute types:
         ``c`` -- categorical, ``o`` - ordinal, ``g`` - geographic (latitude/longitude).
-    
+    truncate : int
+        Maximal number of nodes to read
+    region : dict
+        Administrative codes of the region (e.g., ``{'l1' : 569}``) to read nodes from.
+        Rows of the region are found with the index `region_index` stored in `attr_group`
+        (written by ``preprocess_synpop_h5``), and only these rows are read.
+
     Returns
     -------
     G : sn4sp.SimilarityGraph
@@ -55,6 +78,7 @@ def read_attr_table_h5(path, attr_types=None, attr_group='SPP10pc',
     --------
     >>> read_attr_table_h5(filename)
     >>> read_attr_table_h5(filename, list("cocccoggggo"), attr_group="attributes")
+    >>> read_attr_table_h5(filename, region={'l0' : 0, 'l1' : 569})
 
     See Also
     --------
@@ -67,7 +91,13 @@ def read_attr_table_h5(path, attr_types=None, attr_group='SPP10pc',
             if not hasattr(attr_types, '__iter__'):
                 raise ValueError( r'List of attribute types "attr_types" is not iterable (type={0})'.format(type(attr_types)) )
 
-            vertex_attrs=numpy.array(fp[attr_group].get(attr_values_dataset))
+            if region:
+                if region_index not in fp[attr_group]:
+                    raise ValueError( r'File "{0}" has no region index "{1}"'.format(path, region_index) )
+                vertex_attrs=_read_rows( fp[attr_group][attr_values_dataset],
+                                         region_rows(fp[attr_group][region_index], 'agent', region) )
+            else:
+                vertex_attrs=numpy.array(fp[attr_group].get(attr_values_dataset))
             if truncate:
                 vertex_attrs=vertex_attrs[:truncate]
             # numpy.savetxt('test_data.csv', vertex_attrs, fmt='%3.4f', delimiter=', ', newline='],\n[',
@@ -94,9 +124,266 @@ def read_attr_table_h5(path, attr_types=None, attr_group='SPP10pc',
                                format(attr_name, len(numpy.unique(vertex_attrs[attr_name]))) )
     return SimilarityGraph(vertex_attrs, attr_types, **kwargs)
 
-def write_edges_probabilities_h5(G, path, network_group="SimNet", edges_dataset="edge_list", chunk_len=int(1e4)):
+# Type of edge lists stored in HDF5 files
+_edge_list_type=numpy.dtype([('src_node','i8'), ('trg_node','i8'), ('weight','f8')])
+
+def _edge_list_dtype(num_settings):
+    """ Type of edge lists with a weight column per (hss, damping) setting. """
+    if num_settings == 1:
+        return _edge_list_type
+    return numpy.dtype([('src_node','i8'), ('trg_node','i8'), ('weight','f8',(num_settings,))])
+
+# Type of factorized edge lists (minimum distance in meters and Lin similarity)
+_edge_factors_type=numpy.dtype([('src_node','i8'), ('trg_node','i8'), ('distance','f4'), ('similarity','f4')])
+
+def _network_settings(G):
+    """ Parameters of the network `G` stored as attributes of the network group. """
+    if G.num_settings == 1:
+        return { 'hss' : G.hss, 'damping' : G.damping }
+    return { 'hss' : numpy.array([hss for hss, _ in G.settings], dtype='f8'),
+             'damping' : numpy.array([damping for _, damping in G.settings], dtype='f8') }
+
+class HDF5Tuning(object):
+    """
+    Settings of HDF5 output of edge lists.
+
+    Settings which are not given are chosen automatically by `resolve`.
+
+    Parameters
+    ----------
+    chunk_size : int or str
+        Size of HDF5 chunks of edge lists (bytes or human-readable size like ``4M``);
+        the largest of the alignment and 1MB by default.
+    alignment : int or str
+        Alignment of large objects (e.g., chunks) in the file, set it to the Lustre stripe size
+        (the block size reported for the output directory if it is at least 64KB, otherwise no alignment).
+        Also passed to MPI-IO as the ``striping_unit`` hint.
+    cache_size : int or str
+        Size of the chunk cache of datasets (4 chunks by default)
+    preallocate : int
+        Initial length of edge lists of processes (estimated from the density of edges if ``None``)
+    preallocation_margin : float
+        Factor applied to the estimated number of edges of a writing process, so that processes
+        with more edges than the average do not spill them to temporary files
+    xfer_mode : str
+        Transfer mode of parallel HDF5 for edge lists and arrays of the network group:
+        ``independent`` (``H5FD_MPIO_INDEPENDENT``) or ``collective`` (``H5FD_MPIO_COLLECTIVE``)
+
+    Notes
+    -----
+    Parallel HDF5 allocates file space of chunked datasets when they are created, so preallocated
+    edge lists occupy the file space of their initial lengths. Edge lists are shrunk to their final lengths
+    at the end, but only the space freed at the end of the file is returned to the file system.
+    The unused space is reported (``hdf5_unused_preallocated`` attribute of the network group);
+    decrease the margin or repack the file (e.g., with ``h5repack``) if it is large.
+
+    Every process writes its own edge list. With independent transfers, processes write edges
+    while computing them. With collective transfers, every process takes part in every write
+    to every edge list, so edges are kept in temporary files and written in collective rounds at the end
+    (see ``sn4sp.readwrite.HDF5Sink``). It lets MPI-IO aggregate writes of processes,
+    but gives up overlapping computation and I/O. In a single process, transfers are always independent.
+    """
+    def __init__(self, chunk_size=None, alignment=None, cache_size=None, preallocate=None, preallocation_margin=1.25,
+                 xfer_mode='independent'):
+        self.chunk_size=parse_memory_size(chunk_size)
+        self.alignment=parse_memory_size(alignment)
+        self.cache_size=parse_memory_size(cache_size)
+        self.preallocate=preallocate
+        if preallocation_margin <= 0:
+            raise ValueError( 'preallocation margin must be positive, got {0}'.format(preallocation_margin) )
+        self.preallocation_margin=preallocation_margin
+        if xfer_mode not in ('independent', 'collective'):
+            raise ValueError( 'unknown transfer mode "{0}"'.format(xfer_mode) )
+        self.xfer_mode=xfer_mode
+
+    def __repr__(self):
+        return 'HDF5Tuning(chunk_size={0}, alignment={1}, cache_size={2}, preallocate={3}, preallocation_margin={4}, '\
+               'xfer_mode={5})'.format( self.chunk_size, self.alignment, self.cache_size, self.preallocate,
+                                        self.preallocation_margin, self.xfer_mode )
+
+    @property
+    def collective(self):
+        """ ``True`` if transfers are collective. """
+        return self.xfer_mode == 'collective'
+
+    def resolve(self, path, itemsize, comm=MPI.COMM_WORLD):
+        """ Settings with automatically chosen values (collective call).
+
+        Returns
+        -------
+        tuning : HDF5Tuning
+            Settings with chunk size rounded down to the whole number of edges of size `itemsize`
+        """
+        alignment=self.alignment
+        if alignment is None:
+            block_size=None
+            if comm.Get_rank() == 0:
+                block_size=os.stat(os.path.dirname(os.path.abspath(path))).st_blksize
+            block_size=comm.bcast(block_size, root=0)
+            alignment=block_size if block_size >= 1<<16 else 0
+        chunk_size=self.chunk_size or max(alignment, 1<<20)
+        chunk_size=max(1, chunk_size//itemsize)*itemsize
+        return HDF5Tuning( chunk_size, alignment, self.cache_size or 4*chunk_size, self.preallocate,
+                           self.preallocation_margin, self.xfer_mode )
+
+    def attrs(self):
+        """ Settings stored as attributes of the network group. """
+        return { 'hdf5_chunk_size' : self.chunk_size, 'hdf5_alignment' : self.alignment,
+                 'hdf5_cache_size' : self.cache_size, 'hdf5_preallocation_margin' : self.preallocation_margin,
+                 'hdf5_xfer_mode' : self.xfer_mode }
+
+def _create_output_file(path, comm, tuning):
+    """ Create HDF5 file for parallel output with the chunk cache and alignment of the `tuning` (collective call).
+
+    The file is opened with ``mpio`` driver (with the default driver in a single process).
+    """
+    plist=h5py.h5p.create(h5py.h5p.FILE_ACCESS)
+    plist.set_fclose_degree(h5py.h5f.CLOSE_STRONG)
+    plist.set_libver_bounds(h5py.h5f.LIBVER_LATEST, h5py.h5f.LIBVER_LATEST)
+    if tuning.alignment > 1:
+        plist.set_alignment(tuning.alignment, tuning.alignment)
+    if comm.Get_size() > 1:
+        info=MPI.Info.Create()
+        if tuning.alignment > 1:
+            info.Set('striping_unit', str(tuning.alignment))
+        plist.set_fapl_mpio(comm, info)
+        info.Free()
+    # NOTE: every chunk is written once, so fully written chunks are evicted first
+    metadata_cache_size=plist.get_cache()[0]
+    plist.set_cache(metadata_cache_size, 100*(tuning.cache_size//tuning.chunk_size) + 1, tuning.cache_size, 1.)
+    return h5py.File(h5py.h5f.create(path, h5py.h5f.ACC_TRUNC, fapl=plist))
+
+def _create_edge_lists(output_file, comm, network_group, edges_dataset, chunk_len, edge_list_type, writer=True,
+                       hdf5_chunk_len=True):
+    """ Create group of the network with an edge list dataset per writing process (collective call).
+
+    Datasets are created with initial lengths `chunk_len` of processes and HDF5 chunks of `hdf5_chunk_len` edges
+    (chosen by h5py if ``True``).
+
+    Returns
+    -------
+    network_group : h5py.Group
+        Group of the network
+    edge_list : h5py.Dataset
+        Edge list dataset of the current process (``None`` if the process does not write)
+    """
+    network_group=output_file.create_group(network_group)
+
+    # TODO: Think of how to write data in a single dataset
+    writers=comm.allgather(writer)
+    lengths=comm.allgather(chunk_len)
+    chunks=hdf5_chunk_len if hdf5_chunk_len is True else (hdf5_chunk_len,)
+    for rank in xrange(comm.Get_size()):
+        if not writers[rank]:
+            continue
+        grp = network_group.create_group(str(rank))
+        # 'adj_list'
+        grp.create_dataset( edges_dataset, shape=(lengths[rank],), maxshape=(None,),
+                            chunks=chunks, dtype=edge_list_type )
+    network_group.attrs['factorized']=edge_list_type == _edge_factors_type
+
+    return network_group, network_group[str(comm.Get_rank())][edges_dataset] if writer else None
+
+def _write_array(group, name, data, comm, collective=False):
+    """ Write array (the same in all processes) to a new dataset of the group (collective call).
+
+    The first process writes the array (with collective transfer of one-dimensional arrays if `collective` is set).
+    """
+    dataset=group.create_dataset(name, shape=data.shape, dtype=data.dtype)
+    if collective and comm.Get_size() > 1 and data.ndim == 1:
+        sinks.HDF5Sink.write_collective(dataset, 0, data if comm.Get_rank() == 0 else data[:0])
+    elif comm.Get_rank() == 0 and data.size > 0:
+        dataset[...]=data
+    return dataset
+
+def _write_network_attrs(network_group, G, collective=False):
+    """ Store parameters of `G` and the sample used to estimate Lin similarity in the network group (collective call). """
+    for name, value in _network_settings(G).items():
+        network_group.attrs[name]=value
+    network_group.attrs['num_vertices']=len(G)
+    _write_array(network_group, 'sample', G.sampled_vertex_attrs, G.comm, collective)
+
+def _write_run_summary(network_group, comm, num_edges, start_time):
+    """ Store run summary (number of edges and peak RSS of every process) as attributes of the network group. """
+    elapsed_time=datetime.datetime.now() - start_time
+    peak_rss=numpy.array(comm.allgather(parallel.memory.peak_rss() or 0), dtype='i8')
+    num_edges=numpy.array(comm.allgather(num_edges), dtype='i8')
+    network_group.attrs['peak_rss']=peak_rss
+    network_group.attrs['num_edges']=num_edges
+    if comm.Get_rank() == 0:
+        logging.info( 'run summary: {0} edges, peak RSS per process {1}MB (min) - {2}MB (max)'.\
+                      format(numpy.sum(num_edges), numpy.min(peak_rss)>>20, numpy.max(peak_rss)>>20) )
+    logging.info( 'elapsed time={0}, peak RSS={1}MB'.format(elapsed_time, peak_rss[comm.Get_rank()]>>20) )
+
+def _write_unused_preallocated(network_group, comm, num_unused, itemsize):
+    """ Store the file space of preallocated edge lists which is left unused (in bytes) as attribute of the network group. """
+    unused=comm.allreduce(max(0, num_unused), op=MPI.SUM)*itemsize
+    network_group.attrs['hdf5_unused_preallocated']=unused
+    if comm.Get_rank() == 0 and unused > 0:
+        logging.info( '{0}MB of preallocated edge lists are unused (decrease the preallocation margin or repack the file)'.\
+                      format(unused>>20) )
+
+def _edge_list_datasets(network_group, edges_dataset):
+    """ Edge list datasets of all processes (ordered by ranks of the processes which wrote them). """
+    ranks=sorted((int(name) for name in network_group if name.isdigit()))
+    return [network_group[str(rank)][edges_dataset] for rank in ranks]
+
+def _iter_edge_chunks(network_group, edges_dataset, comm, chunk_len):
+    """ Iterator over chunks of edges stored in the network group.
+
+    Edges are balanced between processes of `comm` regardless of the number of processes
+    which wrote the network.
+    """
+    datasets=_edge_list_datasets(network_group, edges_dataset)
+    offsets=numpy.hstack(([0], numpy.cumsum([len(dataset) for dataset in datasets])))
+    rank, size=comm.Get_rank(), comm.Get_size()
+    start, stop=offsets[-1]*rank//size, offsets[-1]*(rank + 1)//size
+    for dataset, offset in zip(datasets, offsets[:-1]):
+        first, last=max(start, offset) - offset, min(stop, offset + len(dataset)) - offset
+        for position in xrange(first, last, chunk_len):
+            yield dataset[position:min(position + chunk_len, last)]
+
+def _iter_row_chunks(dataset, first, last, comm, chunk_len):
+    """ Iterator over chunks of rows ``first:last`` of the dataset balanced between processes of `comm`. """
+    rank, size=comm.Get_rank(), comm.Get_size()
+    start, stop=first + (last - first)*rank//size, first + (last - first)*(rank + 1)//size
+    for position in xrange(start, stop, chunk_len):
+        yield dataset[position:min(position + chunk_len, stop)]
+
+def _open_input_file(path, comm):
+    """ Open HDF5 file for reading with ``mpio`` driver (with the default driver in a single process). """
+    if comm.Get_size() == 1:
+        return h5py.File(path, 'r')
+    return h5py.File(path, 'r', driver='mpio', comm=comm)
+
+def _open_output_file(path, comm):
+    """ Create HDF5 file for output with ``mpio`` driver (with the default driver in a single process). """
+    if comm.Get_size() == 1:
+        return h5py.File(path, 'w', libver='latest')
+    return h5py.File(path, 'w', driver='mpio', comm=comm, libver='latest')
+
+def write_edges_probabilities_h5(G, path, network_group="SimNet", edges_dataset="edge_list", chunk_len=int(1e4),
+                                 memory_budget=None, factorized=False, coarse=False, scheduling='even', io_buffers=2,
+                                 aggregators=None, aggregator_buffer_len=1<<20, tuning=None):
     """ Write edge probabilities of the similarity network G in edge-list format to HDF5 file.
 
+    Besides edge lists, the network group stores parameters of `G` (``hss``, ``damping``,
+    ``num_vertices`` attributes) and the ``sample`` used to estimate Lin similarity,
+    so that the network can be updated incrementally.
+    If `G` evaluates several (hss, damping) settings, the ``weight`` column holds
+    a weight per setting and edges are stored if any of their weights is non-zero.
+
+    In factorized mode, the ``weight`` column is replaced with the minimum distance between
+    vertices (``distance`` in meters) and their Lin similarity (``similarity``), so that weights
+    can be rebuilt for other settings with ``reweight_edges_h5``. Edges are stored if they
+    are not cut off by the most permissive setting of `G`.
+
+    In coarse-grained mode, vertices with identical attributes form classes (see ``SimilarityGraph.vertex_classes``),
+    and edge lists hold edges between classes (``src_node <= trg_node`` are classes, and edges with
+    ``src_node == trg_node`` join distinct vertices of the same class). The network group stores
+    the class of every vertex (``classes``), sizes of classes (``class_sizes``) and their representatives
+    (``class_representatives``). Expand the class-level network with ``expand_class_network_h5``.
+
     Parameters
     ----------
     G : sn4sp.SimilarityGraph
@@ -105,66 +392,526 @@ def write_edges_probabilities_h5(G, path, network_group="SimNet", edges_dataset=
         Filename (or file handle) for data output.
     chunk_len: int
         Size of chunks for writting to HDF5 file
+    memory_budget : sn4sp.parallel.MemoryBudget
+        Memory budget of the process (if ``None``, use the budget of `G`).
+        The edge buffer is shrunk to fit into the budget. If the process exceeds the budget
+        during calculations, it drops precomputed caches of `G` and halves the edge buffer.
+    factorized : bool
+        If ``True``, store distances and Lin similarities instead of edge probabilities.
+    coarse : bool
+        If ``True``, store the class-level network.
+    scheduling : str
+        Distribution of pairs of vertices between processes (see ``sn4sp.parallel.triu_index``);
+        ``cost`` scheduling balances costs of pairs estimated with ``SimilarityGraph.estimate_row_costs``.
+    io_buffers : int
+        Number of buffers written to the file by a background thread while edges are computed
+        (if 0 or MPI does not support calls from several threads, edges are written synchronously).
+        With aggregators, it is the number of chunks which are sent to the aggregator and not yet received.
+    aggregators : int or str
+        If given, processes send edges to I/O aggregators which write them in large blocks
+        (see ``sn4sp.readwrite.AggregatorSink``): ``'node'`` for an aggregator per node or
+        the number of processes per aggregator. Only aggregators store edge lists.
+    aggregator_buffer_len : int
+        Length of the edge buffer of aggregators (shrunk to fit into the memory budget)
+    tuning : HDF5Tuning
+        HDF5 chunk size, chunk cache size, alignment and preallocated lengths of edge lists
+        (chosen automatically if ``None``). Edge lists are preallocated from the estimated density of edges (with a margin)
+        (``SimilarityGraph.estimate_edge_density``) and resized collectively at the end.
+        The chosen settings are stored as ``hdf5_*`` attributes of the network group.
+
+    Raises
+    ------
+    ValueError : exception
+        Both `factorized` and `coarse` modes are requested.
+
     Examples
     --------
     >>> write_edges_probabilities_h5(G,"test.h5")
 
     See Also
     --------
-    read_attr_table_h5
+    read_attr_table_h5, read_edges_probabilities_h5, update_edges_probabilities_h5, reweight_edges_h5,
+    expand_class_network_h5
     """
     # chunk_dim=min(int(chunk_dim), num_vertices)
+    if factorized and coarse:
+        raise ValueError( 'factorized output of coarse-grained networks is not supported' )
 
-    edge_list_type=[('src_node','i8'), ('trg_node','i8'), ('weight','f8')]
-    with h5py.File( path, 'w', driver='mpio', comm=G.comm, libver='latest' ) as output_file:
-        network_group=output_file.create_group(network_group)
-
-        # TODO: Think of how to write data in a single dataset
-        for rank in xrange(G.comm.Get_size()):
-            grp = network_group.create_group(str(rank))
-            # 'adj_list'
-            grp.create_dataset( edges_dataset, shape=(chunk_len,), maxshape=(None,),
-                                chunks=True, dtype=edge_list_type )
-        process_group=network_group[str(G.comm.Get_rank())]
-        edge_list=process_group[edges_dataset]
-
+    memory_budget=memory_budget or G.memory_budget
+    edge_list_type=_edge_factors_type if factorized else _edge_list_dtype(G.num_settings)
+    if io_buffers > 0 and MPI.Query_thread() < MPI.THREAD_SERIALIZED:
+        logging.warning( 'MPI does not support I/O from background threads, edges are written synchronously' )
+        io_buffers=0
+    # NOTE: buffers of background I/O are of the same length as the buffer of edges,
+    #       and all processes agree on the length (aggregators receive buffers of other processes)
+    chunk_len=G.comm.allreduce( memory_budget.fit_length( edge_list_type.itemsize*(1 + io_buffers), chunk_len,
+                                                          min_length=_min_chunk_len ),
+                                op=MPI.MIN )
+    group_comm=None
+    if aggregators is not None:
+        group_comm=sinks.aggregator_comm(G.comm, None if aggregators == 'node' else int(aggregators))
+        aggregator_buffer_len=memory_budget.fit_length( edge_list_type.itemsize, aggregator_buffer_len,
+                                                        min_length=chunk_len )
+        logging.info( 'process {0} sends edges to aggregator {1}'.\
+                      format(G.comm.Get_rank(), G.comm.Get_rank() - group_comm.Get_rank()) )
+    # Preallocate edge lists to avoid growing them one chunk at a time
+    tuning=(tuning or HDF5Tuning()).resolve(path, edge_list_type.itemsize, G.comm)
+    hdf5_chunk_len=tuning.chunk_size//edge_list_type.itemsize
+    writer=group_comm is None or group_comm.Get_rank() == 0
+    num_writers=G.comm.allreduce(int(writer), op=MPI.SUM)
+    preallocated=tuning.preallocate
+    if preallocated is None:
+        if coarse:
+            preallocated=chunk_len
+        else:
+            density=G.estimate_edge_density()
+            preallocated=int(tuning.preallocation_margin*density*(len(G)*(len(G) - 1)//2)/num_writers)
+            logging.info( 'estimated density of edges {0:.3g}'.format(density) )
+    preallocated=-(-int(preallocated)//hdf5_chunk_len)*hdf5_chunk_len if writer else 0
+    with _create_output_file(path, G.comm, tuning) as output_file:
+        network_group, edge_list=_create_edge_lists( output_file, G.comm, network_group, edges_dataset,
+                                                     preallocated, edge_list_type, writer, hdf5_chunk_len )
+        _write_network_attrs(network_group, G, tuning.collective)
+        network_group.attrs['coarse']=coarse
+        for name, value in tuning.attrs().items():
+            network_group.attrs[name]=value
+        network_group.attrs['hdf5_preallocated']=numpy.array(G.comm.allgather(preallocated), dtype='i8')
+        edge_lists=[ network_group[str(rank)][edges_dataset] if str(rank) in network_group else None \
+                     for rank in xrange(G.comm.Get_size()) ]
         logging.info( 'Output file is created. Process {0} starts the calculation'.format(G.comm.Get_rank()) )
         start_time=datetime.datetime.now()
 
-        # k - index in edge_buffer
-        # offset - position in the dataset to write new data
-        k, offset=0, 0
-        edge_buffer=numpy.zeros(chunk_len, dtype=edge_list_type)
-        for i, j, edge_prob in G.edges_probabilities():
-            if edge_prob > 0.:  # store only non-zero entries
-                edge_buffer[k]=(i, j, edge_prob)
-                k+=1
-                # when chunk size is reached, the data is copied to file
-                if k == chunk_len:
-                    edge_list[offset:offset+chunk_len]=edge_buffer
-                    k=0
-                    offset+=chunk_len
-
-                    # Log progress
-                    # TODO: improve log to show percentage of processed entries
-                    logging.info( 'Current position {0}. Elapsed time={1}.'.\
-                                  format((i,j), (datetime.datetime.now()-start_time)) )
-                    # # Checking memory usage
-                    # if psutil.virtual_memory().available <= 104857600:  # 100MB
-                    #     #100 MB
-                    #     logging.warning( 'we are running out of memory! Remains {0}KB'.format(psutil.virtual_memory().available/1024) )
-                    # # Checking swap memory
-                    # if psutil.swap_memory().percent > .9:
-                    #     logging.warning( 'the swap is occupied at the {0}%!'.format(psutil.swap_memory().percent*100) )
-
-        # Store the last portion of edges to dataset
-        if k != 0:
-            edge_list[offset:offset+k]=edge_buffer[:k]
-            offset+=k
-
-        # Fix size of the dataset and close file
-        edge_list.resize((offset,))
+        if coarse:
+            classes=G.vertex_classes()
+            for name, data in zip(('classes', 'class_representatives', 'class_sizes'), classes):
+                _write_array(network_group, name, data.astype('i8'), G.comm, tuning.collective)
+            # NOTE: row costs are estimated for vertices, so classes fall back to even scheduling
+            edges=G.class_edges_probabilities(classes, scheduning='even' if scheduling == 'cost' else scheduling)
+            chunks=sinks.chunked(edges, edge_list_type, chunk_len)
+        elif factorized:
+            chunks=G.edges_factors_chunks(chunk_len, dtype=edge_list_type, scheduning=scheduling)
+        else:
+            chunks=G.edges_probabilities_chunks(chunk_len, dtype=edge_list_type, scheduning=scheduling)
+
+        # Store edges chunk by chunk (overlapping computation and I/O) and fix size of the dataset
+        sink=sinks.HDF5Sink(edge_list, G.comm, edge_lists, tuning.collective)
+        if group_comm is None:
+            output=sinks.BackgroundSink(sink, io_buffers) if io_buffers > 0 else sink
+        else:
+            # NOTE: aggregators receive (and write) in a helper thread only with `MPI.THREAD_MULTIPLE`,
+            #       since MPI calls of the main thread would overlap with I/O
+            output=sinks.AggregatorSink( sink, group_comm, edge_list_type, aggregator_buffer_len, max(io_buffers, 1) )
+        with output:
+            sinks.stream_edges(chunks, output, memory_budget, on_exceeded=G.drop_caches, min_chunk_len=_min_chunk_len)
+        if group_comm is not None:
+            group_comm.Free()
+        _write_unused_preallocated(network_group, G.comm, preallocated - sink.num_edges, edge_list_type.itemsize)
+        # Report accuracy of approximate frequencies of attribute values
+        G.frequencies.report()
+
+        _write_run_summary(network_group, G.comm, output.num_edges, start_time)
+
         # TODO: explore h5py file closing problem if `offset` is less than 95% of `chunk_len`
         output_file.close()
 
         logging.info( 'file "{0}" is closed'.format(path) )
+
+def read_sample_h5(path, network_group="SimNet"):
+    """ Read the sample used to estimate Lin similarity of the network stored in HDF5 file.
+
+    Pass the sample to ``SimilarityGraph`` (e.g., via ``read_attr_table_h5(..., sample=sample)``)
+    in order to freeze sample-dependent statistics when the network is updated incrementally.
+
+    Parameters
+    ----------
+    path : str
+        Path to HDF5 file with the network
+    network_group : str
+        Name of the network group
+
+    Returns
+    -------
+    sample : numpy.array
+        Attribute values of the sampled vertices
+
+    Examples
+    --------
+    >>> sample=read_sample_h5('simnet.h5')
+    >>> G=read_attr_table_h5('synpop.h5', sample=sample)
+    """
+    with h5py.File(path, 'r') as input_file:
+        return input_file[network_group]['sample'][...]
+
+def read_edges_probabilities_h5(path, network_group="SimNet", edges_dataset="edge_list", chunk_len=int(1e5),
+                                comm=MPI.COMM_WORLD, min_weight=None, setting=None, vertex_range=None):
+    """ Iterate over chunks of edges of the network stored in HDF5 file.
+
+    Edge lists of all processes which wrote the network are read in chunks of at most `chunk_len` edges,
+    and the edges are balanced between processes of `comm` regardless of the number of processes
+    which wrote the network (every process gets its own share of edges).
+
+    Parameters
+    ----------
+    path : str
+        Path to HDF5 file with the network (see ``write_edges_probabilities_h5``)
+    chunk_len : int
+        Maximum number of edges read at once
+    comm : mpi4py.MPI.Comm
+        MPI communicator (use ``MPI.COMM_SELF`` to read all edges in a single process)
+    min_weight : float
+        If given, yield only edges with weights above `min_weight`
+    setting : int
+        Index of the (hss, damping) setting whose weights are filtered
+        (if ``None``, edges with any weight above `min_weight` are retained)
+    vertex_range : tuple
+        If given, yield only edges incident to vertices ``start <= vertex < stop``
+        given by the (start, stop) pair. Consolidated networks (see ``consolidate_edges_h5``)
+        are read with their index of source vertices: symmetric networks yield incident edges
+        only in the directions with sources in the range, and other networks are scanned
+        only up to the last edge with the source in the range.
+
+    Returns
+    -------
+    chunks : iterator
+        Iterator over structured arrays of edges (skipping chunks without retained edges).
+        Edges of coarse-grained networks join classes of vertices, and
+        factorized networks hold factors of weights (``min_weight`` is not supported).
+
+    Raises
+    ------
+    ValueError : exception
+        Edges are filtered by weights of the factorized network.
+
+    Examples
+    --------
+    >>> num_edges=sum(len(edges) for edges in read_edges_probabilities_h5('simnet.h5', min_weight=0.5))
+
+    See Also
+    --------
+    write_edges_probabilities_h5, consolidate_edges_h5
+    """
+    with _open_input_file(path, comm) as input_file:
+        group=input_file[network_group]
+        if min_weight is not None and group.attrs.get('factorized', False):
+            raise ValueError( 'network "{0}" is factorized, rebuild weights with `reweight_edges_h5`'.format(path) )
+        if vertex_range is not None and 'vertex_offsets' in group:
+            # Read edges with sources in the range from the index of the consolidated network
+            vertex_offsets=group['vertex_offsets']
+            num_vertices=len(vertex_offsets) - 1
+            start, stop=[min(max(int(vertex), 0), num_vertices) for vertex in vertex_range]
+            first, last=int(vertex_offsets[start]), int(vertex_offsets[max(start, stop)])
+            edge_list=_edge_list_datasets(group, edges_dataset)[0]
+            chunks=_iter_row_chunks(edge_list, first, last, comm, chunk_len)
+            if not group.attrs.get('symmetric', False):
+                # NOTE: edges are stored with ``src_node <= trg_node``, so edges with targets in the range
+                #       precede edges with sources in the range
+                chunks=chain(_iter_row_chunks(edge_list, 0, first, comm, chunk_len), chunks)
+        else:
+            chunks=_iter_edge_chunks(group, edges_dataset, comm, chunk_len)
+        for edges in chunks:
+            retained=numpy.ones(len(edges), dtype=bool)
+            if min_weight is not None:
+                weights=edges['weight'] if setting is None or edges['weight'].ndim == 1 else edges['weight'][:,setting]
+                retained&=weights.reshape(len(edges), -1).max(axis=1) > min_weight
+            if vertex_range is not None:
+                start, stop=vertex_range
+                retained&=( (start <= edges['src_node']) & (edges['src_node'] < stop) ) | \
+                          ( (start <= edges['trg_node']) & (edges['trg_node'] < stop) )
+            if numpy.all(retained):
+                yield edges
+            elif numpy.any(retained):
+                yield edges[retained]
+
+def update_edges_probabilities_h5(G, path, out_path, changed=(), removed=(), network_group="SimNet",
+                                  edges_dataset="edge_list", chunk_len=int(1e4), freeze_sample=True, tuning=None):
+    """ Update the similarity network stored in HDF5 file after changes of the population.
+
+    Edges between unaffected vertices are copied from `path`, whereas edges incident to
+    added, modified or removed vertices are recomputed with `G` (or dropped).
+    Vertex indices must be stable: vertices of `G` with indices beyond the number
+    of vertices of the stored network are treated as added, and removed vertices
+    keep their indices in `G` (their attributes are ignored).
+
+    Parameters
+    ----------
+    G : sn4sp.SimilarityGraph
+        Similarity network of the changed population
+    path : str
+        Path to HDF5 file with the network to update
+    out_path : str
+        Path to output HDF5 file with the updated network
+    changed : list
+        Indices of modified (or added) vertices
+    removed : list
+        Indices of removed vertices
+    chunk_len: int
+        Size of chunks for reading and writting HDF5 files
+    freeze_sample : bool
+        If ``True``, require `G` to use the sample of the stored network, so that
+        probabilities of the copied edges remain valid.
+    tuning : HDF5Tuning
+        HDF5 settings of the output file (see ``write_edges_probabilities_h5``). Edge lists are preallocated
+        with the share of copied edges and the estimated number of recomputed edges of every process.
+
+    Raises
+    ------
+    ValueError : exception
+        The sample of `G` differs from the sample of the stored network and `freeze_sample` is set,
+        or (hss, damping) settings of `G` differ from the settings of the stored network,
+        or the stored network is factorized or coarse-grained.
+
+    Notes
+    -----
+    Lin similarity of vertices missing in the sample depends on the population size,
+    so adding vertices slightly changes probabilities of such copied edges.
+
+    Examples
+    --------
+    >>> G=read_attr_table_h5('synpop.h5', sample=read_sample_h5('simnet.h5'))
+    >>> update_edges_probabilities_h5(G, 'simnet.h5', 'simnet_updated.h5', changed=[7, 42])
+
+    See Also
+    --------
+    write_edges_probabilities_h5, read_sample_h5
+    """
+    with _open_input_file(path, G.comm) as input_file:
+        old_network_group=input_file[network_group]
+        if old_network_group.attrs.get('factorized', False):
+            raise ValueError( 'network "{0}" is factorized, recompute it or rebuild weights with `reweight_edges_h5`'.\
+                              format(path) )
+        if old_network_group.attrs.get('coarse', False):
+            raise ValueError( 'network "{0}" is coarse-grained, expand it with `expand_class_network_h5`'.format(path) )
+        for name, value in _network_settings(G).items():
+            if name in old_network_group.attrs and \
+               not numpy.array_equal(numpy.atleast_1d(old_network_group.attrs[name]), numpy.atleast_1d(value)):
+                raise ValueError( 'network "{0}" is computed with different {1}={2}'.\
+                                  format(path, name, old_network_group.attrs[name]) )
+        if 'sample' in old_network_group:
+            sample=old_network_group['sample'][...]
+            same_sample=sample.dtype.names == G.sampled_vertex_attrs.dtype.names and \
+                        numpy.array_equal(sample.astype(G.sampled_vertex_attrs.dtype), G.sampled_vertex_attrs)
+        else:
+            same_sample=False
+        if not same_sample:
+            if freeze_sample:
+                raise ValueError( 'network "{0}" is sampled differently, freeze the sample with `read_sample_h5`'.\
+                                  format(path) )
+            logging.warning( 'sample differs from the sample of network "{0}": copied edges are not updated'.\
+                             format(path) )
+
+        # Vertices whose edges must be recomputed or dropped
+        num_old_vertices=old_network_group.attrs.get('num_vertices', len(G))
+        affected=numpy.unique(numpy.hstack(( numpy.asarray(changed, dtype='i8'),
+                                             numpy.asarray(removed, dtype='i8'),
+                                             numpy.arange(num_old_vertices, len(G), dtype='i8') )))
+
+        # Preallocate edge lists, since parallel HDF5 resizes datasets only collectively
+        edge_list_type=_edge_list_dtype(G.num_settings)
+        tuning=(tuning or HDF5Tuning()).resolve(out_path, edge_list_type.itemsize, G.comm)
+        hdf5_chunk_len=tuning.chunk_size//edge_list_type.itemsize
+        preallocated=tuning.preallocate
+        if preallocated is None:
+            num_old_edges=sum(len(dataset) for dataset in _edge_list_datasets(old_network_group, edges_dataset))
+            num_incident_edges=tuning.preallocation_margin*G.estimate_edge_density()*len(affected)*len(G)
+            preallocated=int((num_old_edges + num_incident_edges)/G.comm.Get_size())
+        preallocated=-(-int(preallocated)//hdf5_chunk_len)*hdf5_chunk_len
+
+        with _create_output_file(out_path, G.comm, tuning) as output_file:
+            new_network_group, edge_list=_create_edge_lists( output_file, G.comm, network_group, edges_dataset,
+                                                             preallocated, edge_list_type, True, hdf5_chunk_len )
+            _write_network_attrs(new_network_group, G, tuning.collective)
+            for name, value in tuning.attrs().items():
+                new_network_group.attrs[name]=value
+            edge_lists=[new_network_group[str(rank)][edges_dataset] for rank in xrange(G.comm.Get_size())]
+            start_time=datetime.datetime.now()
+
+            with sinks.HDF5Sink(edge_list, G.comm, edge_lists, tuning.collective) as sink:
+                # Copy edges between unaffected vertices
+                for edges in _iter_edge_chunks(old_network_group, edges_dataset, G.comm, chunk_len):
+                    unaffected=~( numpy.in1d(edges['src_node'], affected) | numpy.in1d(edges['trg_node'], affected) )
+                    sink.write(edges[unaffected])
+                logging.info( 'Process {0} copied {1} edges. Elapsed time={2}.'.\
+                              format(G.comm.Get_rank(), sink.num_edges, datetime.datetime.now()-start_time) )
+
+                # Recompute edges incident to the changed vertices (store only non-zero entries)
+                for edges in G.incident_edges_probabilities_chunks(affected, removed, chunk_len, dtype=edge_list.dtype):
+                    sink.write(edges)
+
+            _write_unused_preallocated(new_network_group, G.comm, preallocated - sink.num_edges, edge_list_type.itemsize)
+            _write_run_summary(new_network_group, G.comm, sink.num_edges, start_time)
+
+    logging.info( 'file "{0}" is closed'.format(out_path) )
+
+def reweight_edges_h5(path, out_path, hss=5000, damping=0, settings=None, network_group="SimNet",
+                      edges_dataset="edge_list", chunk_len=int(1e6), similarity_threshold=1e-6):
+    """ Rebuild edge probabilities of the factorized network for other (hss, damping) settings.
+
+    Streams through the factorized network serially and requires neither the population nor MPI.
+    The output file has the same layout as the files produced by ``write_edges_probabilities_h5``.
+
+    Parameters
+    ----------
+    path : str
+        Path to HDF5 file with the factorized network
+    out_path : str
+        Path to output HDF5 file with the reweighted network
+    hss : float
+        Half-similarity scale
+    damping : float
+        Damping coefficient (if 0 use exponential damping)
+    settings : list
+        (hss, damping) pairs producing a weight column per setting (overrides `hss` and `damping`)
+    chunk_len: int
+        Number of edges processed at once
+    similarity_threshold : float
+        Lower bound of geo-induced probability (the Lin similarity contribution is disregarded below it)
+
+    Raises
+    ------
+    ValueError : exception
+        The network is not factorized.
+
+    Notes
+    -----
+    The factorized network holds only edges which are not cut off by the most permissive setting
+    it was computed with, so more permissive settings may miss some edges.
+
+    Examples
+    --------
+    >>> write_edges_probabilities_h5(G, 'simnet_factors.h5', factorized=True)
+    >>> reweight_edges_h5('simnet_factors.h5', 'simnet_hss_2000_d_0.5.h5', hss=2000, damping=0.5)
+
+    See Also
+    --------
+    write_edges_probabilities_h5
+    """
+    settings=[(hss, damping)] if settings is None else [tuple(setting) for setting in settings]
+    # NOTE: distances are stored in meters, so scale them as central angles on the unit sphere
+    scalings=numpy.array([geo.geo_scaling(hss, damping)/geo.R_EARTH for hss, damping in settings])
+    dampings=numpy.array([damping for _, damping in settings], dtype='f8')
+    edge_list_type=_edge_list_dtype(len(settings))
+
+    with h5py.File(path, 'r') as input_file, h5py.File(out_path, 'w', libver='latest') as output_file:
+        input_group=input_file[network_group]
+        if not input_group.attrs.get('factorized', False):
+            raise ValueError( 'network "{0}" is not factorized'.format(path) )
+        output_group=output_file.create_group(network_group)
+        for name, value in input_group.attrs.items():
+            if name not in ('factorized', 'peak_rss'):
+                output_group.attrs[name]=value
+        output_group.attrs['hss']=settings[0][0] if len(settings) == 1 else \
+                                  numpy.array([hss for hss, _ in settings], dtype='f8')
+        output_group.attrs['damping']=settings[0][1] if len(settings) == 1 else dampings
+        output_group.attrs['factorized']=False
+        if 'sample' in input_group:
+            input_group.copy('sample', output_group)
+
+        num_edges=[]
+        for rank in sorted((int(name) for name in input_group if name.isdigit())):
+            factors=input_group[str(rank)][edges_dataset]
+            edge_list=output_group.create_group(str(rank)).\
+                create_dataset( edges_dataset, shape=(0,), maxshape=(None,), chunks=True, dtype=edge_list_type )
+            with sinks.HDF5Sink(edge_list) as sink:
+                for start in xrange(0, len(factors), chunk_len):
+                    edges=factors[start:start+chunk_len]
+                    prob_geo=geo.geo_damping( edges['distance'][:,numpy.newaxis].astype('f8'),
+                                              scalings[numpy.newaxis,:], dampings[numpy.newaxis,:] )
+                    prob_geo[prob_geo <= similarity_threshold]=0.
+                    weights=prob_geo*edges['similarity'][:,numpy.newaxis]
+                    retained=numpy.any(weights > 0., axis=1)
+                    reweighted=numpy.empty(numpy.count_nonzero(retained), dtype=edge_list_type)
+                    reweighted['src_node']=edges['src_node'][retained]
+                    reweighted['trg_node']=edges['trg_node'][retained]
+                    reweighted['weight']=weights[retained] if len(settings) > 1 else weights[retained,0]
+                    sink.write(reweighted)
+            num_edges.append(sink.num_edges)
+        output_group.attrs['num_edges']=numpy.array(num_edges, dtype='i8')
+    logging.info( 'network "{0}" is reweighted to "{1}": {2} edges'.format(path, out_path, sum(num_edges)) )
+
+def expand_class_network_h5(path, out_path, sample=False, seed=None, comm=MPI.COMM_WORLD,
+                            network_group="SimNet", edges_dataset="edge_list", chunk_len=int(1e5), tuning=None):
+    """ Expand the coarse-grained (class-level) network to the vertex-level network.
+
+    Processes stream through balanced portions of class-level edges and write vertex-level edges
+    in the layout produced by ``write_edges_probabilities_h5``.
+
+    Parameters
+    ----------
+    path : str
+        Path to HDF5 file with the class-level network
+    out_path : str
+        Path to output HDF5 file with the vertex-level network
+    sample : bool
+        If ``True``, draw edges between vertices with their probabilities (Bernoulli trials)
+        instead of listing all vertex pairs with non-zero probabilities.
+    seed : int
+        Seed of the random generator used for sampling (shifted by ranks of processes)
+    comm : mpi4py.MPI.Comm
+        MPI communicator
+    chunk_len: int
+        Maximum number of vertex pairs expanded at once
+    tuning : HDF5Tuning
+        HDF5 settings of the output file (see ``write_edges_probabilities_h5``). Edge lists are preallocated
+        with the (expected) number of vertex-level edges of every process.
+
+    Raises
+    ------
+    ValueError : exception
+        The network is not coarse-grained.
+
+    Examples
+    --------
+    >>> write_edges_probabilities_h5(G, 'simnet_classes.h5', coarse=True)
+    >>> expand_class_network_h5('simnet_classes.h5', 'simnet_sampled.h5', sample=True, seed=42)
+
+    See Also
+    --------
+    write_edges_probabilities_h5
+    """
+    random_state=numpy.random.RandomState(None if seed is None else seed + comm.Get_rank())
+    with _open_input_file(path, comm) as input_file:
+        class_network_group=input_file[network_group]
+        if not class_network_group.attrs.get('coarse', False):
+            raise ValueError( 'network "{0}" is not coarse-grained'.format(path) )
+        members, offsets=class_members(class_network_group['classes'][...])
+        sizes=numpy.diff(offsets)
+        edge_list_type=_edge_list_datasets(class_network_group, edges_dataset)[0].dtype
+        if sample and edge_list_type['weight'].shape:
+            raise ValueError( 'edges with several weights cannot be sampled' )
+
+        # Preallocate edge lists with the (expected) number of vertex-level edges of the process,
+        # since parallel HDF5 resizes datasets only collectively
+        tuning=(tuning or HDF5Tuning()).resolve(out_path, edge_list_type.itemsize, comm)
+        hdf5_chunk_len=tuning.chunk_size//edge_list_type.itemsize
+        preallocated=tuning.preallocate
+        if preallocated is None:
+            preallocated=0.
+            for edges in _iter_edge_chunks(class_network_group, edges_dataset, comm, chunk_len):
+                num_pairs=num_class_pairs(edges['src_node'], edges['trg_node'], sizes)
+                preallocated+=numpy.sum(num_pairs*numpy.clip(edges['weight'], 0., 1.))*tuning.preallocation_margin \
+                              if sample else numpy.sum(num_pairs)
+        preallocated=-(-int(preallocated)//hdf5_chunk_len)*hdf5_chunk_len
+
+        with _create_output_file(out_path, comm, tuning) as output_file:
+            vertex_network_group, edge_list=_create_edge_lists( output_file, comm, network_group, edges_dataset,
+                                                                preallocated, edge_list_type, True, hdf5_chunk_len )
+            for name, value in class_network_group.attrs.items():
+                if name not in ('coarse', 'factorized', 'peak_rss', 'num_edges') and not name.startswith('hdf5_'):
+                    vertex_network_group.attrs[name]=value
+            vertex_network_group.attrs['coarse']=False
+            vertex_network_group.attrs['sampled']=sample
+            for name, value in tuning.attrs().items():
+                vertex_network_group.attrs[name]=value
+            if 'sample' in class_network_group:
+                _write_array(vertex_network_group, 'sample', class_network_group['sample'][...], comm, tuning.collective)
+            edge_lists=[vertex_network_group[str(rank)][edges_dataset] for rank in xrange(comm.Get_size())]
+            start_time=datetime.datetime.now()
+
+            with sinks.HDF5Sink(edge_list, comm, edge_lists, tuning.collective) as sink:
+                for edges in _iter_edge_chunks(class_network_group, edges_dataset, comm, chunk_len):
+                    for vertex_edges in expand_class_edges(edges, members, offsets, sample, random_state, chunk_len):
+                        sink.write(vertex_edges)
+
+            _write_unused_preallocated(vertex_network_group, comm, preallocated - sink.num_edges, edge_list_type.itemsize)
+            _write_run_summary(vertex_network_group, comm, sink.num_edges, start_time)
+    logging.info( 'file "{0}" is closed'.format(out_path) )
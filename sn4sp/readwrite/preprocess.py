@@ -0,0 +1,414 @@
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+"""
+**********
+Preprocess
+**********
+Convert synthetic population (agents, households and workplaces tables in HDF5 file)
+to the table of node attributes which is read by ``read_attr_table_h5``.
+"""
+from __future__ import division, absolute_import, print_function
+
+__author__ = '\n'.join(['Sergiy Gogolenko <gogolenko@hlrs.de>',
+                        'Fabio Saracco <fabio@imt.it>'])
+__all__ = [ 'preprocess_synpop_h5',
+            'stream_preprocess_synpop_h5',
+            'build_region_index_h5', ]
+
+import logging
+
+from mpi4py import MPI
+import numpy
+import h5py
+
+from sn4sp.core import geo
+from sn4sp.readwrite.region import _region_levels, _codes_dtype, _codes, _read_rows, _write_region_index, region_rows
+
+# Workaround to run on machines with old versions of numpy
+_isin=numpy.isin if hasattr(numpy, 'isin') else numpy.in1d
+
+# Types of the preprocessed attributes
+_ppd_attr_types=['c', 'o', 'c', 'c', 'c', 'o', 'g', 'g', 'g', 'g', 'o']
+# In principle this step could be automatized, but since some of the original entries (like the wp code)
+# are in a non trivial form, it would not in principle deserve the effort, since it should change from
+# synthetic population to syntehtic population.
+_ppd_dtype=numpy.dtype([('sex','i8'), ('age','i8'), ('role','i8'), ('edu','i8'), ('employed','i8'), ('income','i8'),
+                        ('wp_lon','f8'), ('wp_lat','f8'), ('hh_lon','f8'), ('hh_lat','f8'), ('wp_hh','i8')])
+
+def _join(ids, keys):
+    """ Find positions of `keys` in the array of unique `ids` with binary search.
+
+    Raises
+    ------
+    KeyError : exception
+        Some keys are missing in `ids`.
+    """
+    order=numpy.argsort(ids, kind='mergesort')
+    sorted_ids=ids[order]
+    pos=numpy.minimum(numpy.searchsorted(sorted_ids, keys), len(sorted_ids) - 1)
+    missing=sorted_ids[pos] != keys
+    if numpy.any(missing):
+        raise KeyError( 'unknown ids: {0}'.format(numpy.unique(keys[missing])[:10]) )
+    return order[pos]
+
+class _SortedIdLookup(object):
+    """ Lookup of rows by ids in the HDF5 table sorted by ids.
+
+    Only the first id of every block of `block_len` rows (fence) is kept in memory,
+    so that finding a row costs a binary search in fences and a read of one block.
+    If ids in the table are not sorted, falls back to the in-memory index of all ids.
+
+    Parameters
+    ----------
+    dataset : h5py.Dataset
+        Table with unique ids
+    comm : mpi4py.MPI.Comm
+        MPI communicator (fences are found by the root process and broadcast)
+    block_len : int
+        Number of rows in a block
+    """
+    def __init__(self, dataset, comm, block_len=1<<16, id_field='id'):
+        self.dataset=dataset
+        self.block_len=block_len
+        self.id_field=id_field
+
+        fences=None
+        if comm.Get_rank() == 0:
+            fences, last_id=[], None
+            for start in xrange(0, len(dataset), block_len):
+                ids=dataset[start:start+block_len, id_field]
+                if numpy.any(ids[1:] <= ids[:-1]) or (last_id is not None and ids[0] <= last_id):
+                    fences=None
+                    break
+                fences.append(ids[0])
+                last_id=ids[-1]
+            fences=numpy.array(fences) if fences is not None else None
+        self.fences=comm.bcast(fences, root=0)
+
+        if self.fences is None:
+            logging.warning( 'ids in "{0}" are not sorted, keep index of all ids in memory'.format(dataset.name) )
+            ids=dataset[:, id_field] if len(dataset) else numpy.empty(0, dtype=dataset.dtype[id_field])
+            self.order=numpy.argsort(ids, kind='mergesort')
+            self.sorted_ids=ids[self.order]
+
+    def __getitem__(self, ids):
+        """ Read rows with the given ids.
+
+        Raises
+        ------
+        KeyError : exception
+            Some ids are missing in the table.
+        """
+        unique_ids, inverse=numpy.unique(ids, return_inverse=True)
+        rows=numpy.empty(len(unique_ids), dtype=self.dataset.dtype)
+        if len(unique_ids) == 0:
+            return rows[inverse]
+        if self.fences is not None:
+            blocks=numpy.searchsorted(self.fences, unique_ids, side='right') - 1
+            # NOTE: `unique_ids` are sorted, hence ids of the same block are adjacent
+            bounds=numpy.flatnonzero(numpy.diff(blocks)) + 1
+            for first, last in zip(numpy.hstack(([0], bounds)), numpy.hstack((bounds, [len(blocks)]))):
+                start=max(0, blocks[first])*self.block_len
+                block=self.dataset[start:start+self.block_len]
+                rows[first:last]=block[_join(block[self.id_field], unique_ids[first:last])]
+        else:
+            pos=numpy.minimum(numpy.searchsorted(self.sorted_ids, unique_ids), len(self.sorted_ids) - 1)
+            if len(self.sorted_ids) == 0 or numpy.any(self.sorted_ids[pos] != unique_ids):
+                raise KeyError( 'unknown ids in "{0}"'.format(self.dataset.name) )
+            indices=self.order[pos]
+            order=numpy.argsort(indices)
+            # NOTE: h5py requires increasing indices for point selections
+            rows[order]=self.dataset[indices[order].tolist()]
+        return rows[inverse]
+
+def _preprocess_agents(agents, households, workplaces):
+    """ Compute node attributes for the agents by joining them with their households and workplaces.
+
+    Parameters
+    ----------
+    agents : numpy.array
+        Structured array with rows of the agent table.
+    households, workplaces : numpy.array or _SortedIdLookup
+        Structured arrays with rows of the household and workplace tables
+        (or lookups of rows in these tables).
+
+    Returns
+    -------
+    ppd : numpy.array
+        Structured array with the node attributes (one row per agent).
+    codes : numpy.array
+        Structured array with administrative codes of households of the agents.
+    """
+    ppd=numpy.empty(len(agents), dtype=_ppd_dtype)
+    if isinstance(households, _SortedIdLookup):
+        agent_households=households[agents['hh']]
+    else:
+        agent_households=households[_join(households['id'], agents['hh'])]
+    hh_lat, hh_lon=agent_households['lat'], agent_households['lon']
+
+    # Agents without workplace (wp<=0) are assumed to work at home
+    wp_lat, wp_lon=numpy.array(hh_lat, dtype='f8'), numpy.array(hh_lon, dtype='f8')
+    employed=agents['wp'] > 0
+    if numpy.any(employed):
+        if isinstance(workplaces, _SortedIdLookup):
+            agent_workplaces=workplaces[agents['wp'][employed]]
+        else:
+            agent_workplaces=workplaces[_join(workplaces['id'], agents['wp'][employed])]
+        wp_lat[employed], wp_lon[employed]=agent_workplaces['lat'], agent_workplaces['lon']
+    wp_hh=geo.R_EARTH*geo.central_angle( numpy.radians(hh_lon), numpy.radians(hh_lat),
+                                         numpy.radians(wp_lon), numpy.radians(wp_lat) )
+
+    for attr_name in ('sex', 'age', 'role', 'edu', 'employed'):
+        ppd[attr_name]=agents[attr_name]
+    # NOTE: the original preprocessor divided integer incomes by floor division (Python 2),
+    #       whereas distances are floats rounded to kilometers
+    incomes=agents['income']
+    ppd['income']=incomes//1000 if numpy.issubdtype(incomes.dtype, numpy.integer) else numpy.round(incomes/1000)
+    # NOTE: latitudes are stored in `*_lon` fields and longitudes in `*_lat` fields
+    #       in order to stay compatible with the datasets produced so far
+    ppd['wp_lon'], ppd['wp_lat']=wp_lat, wp_lon
+    ppd['hh_lon'], ppd['hh_lat']=hh_lat, hh_lon
+    ppd['wp_hh']=numpy.round(wp_hh/1000)
+    return ppd, _codes(agent_households, _codes_dtype(agent_households.dtype, _region_levels))
+
+def preprocess_synpop_h5(in_path, out_path, comm=MPI.COMM_WORLD, region=None, region_index='region_index',
+                         attr_group='SPP10pc', attr_values_dataset='ppd', attr_types_dataset='da'):
+    """ Preprocess synthetic population in HDF5 format in parallel.
+
+    Every process handles an even share of the selected agents: joins them with their households
+    and workplaces via sorted ids, computes home-workplace distances and
+    writes its share of the output table in a single hyperslab write.
+    Along with node attributes, it stores index from administrative codes of households
+    to the output rows (see ``sn4sp.readwrite.region_rows``).
+
+    Parameters
+    ----------
+    in_path : str
+        Path to HDF5 file with synthetic population (datasets ``agent``, ``household`` and ``workplace``).
+    out_path : str
+        Path to output HDF5 file with node attributes.
+    comm : mpi4py.MPI.Comm
+        MPI communicator
+    region : dict
+        Administrative codes of households to select (e.g., ``{'l0' : 0, 'l1' : 569}``
+        for Turin municipality). If ``None``, all agents are selected.
+    region_index : str
+        Name of the group with region index in the input file (built with ``build_region_index_h5``)
+        and in the output attribute group. If the input file has no index, agents are selected
+        by scanning household table.
+
+    Returns
+    -------
+    num_agents : int
+        Number of preprocessed agents.
+
+    Examples
+    --------
+    >>> preprocess_synpop_h5('synthPop_Piedimont_10pc_2011.h5', 'synthPop_Piedimont_10pc_2011_ppd.h5',
+    ...                      region={'l0' : 0, 'l1' : 569})
+
+    See Also
+    --------
+    sn4sp.readwrite.read_attr_table_h5
+    """
+    comm_rank=comm.Get_rank()
+    comm_size=comm.Get_size()
+
+    with h5py.File(in_path, 'r') as input_file:
+        agents=input_file['agent'][...]
+        households=input_file['household'][...]
+        workplaces=input_file['workplace'][...]
+        selection=region_rows(input_file[region_index], 'agent', region) \
+                  if region and region_index in input_file else None
+
+    # Select agents whose households are in the region (unless they are found with the index)
+    if selection is None and region:
+        region_mask=numpy.ones(len(households), dtype=bool)
+        for level, code in region.items():
+            region_mask&=households[level] == code
+        selection=numpy.where(_isin(agents['hh'], households['id'][region_mask]))[0]
+    elif selection is None:
+        selection=numpy.arange(len(agents))
+    num_agents=len(selection)
+
+    # Distribute agents evenly between processes
+    offsets=[num_agents*rank//comm_size for rank in range(comm_size+1)]
+    my_rows=selection[offsets[comm_rank]:offsets[comm_rank+1]]
+    logging.info( 'preprocess {0} agents [{1},{2}) out of {3}'.\
+                  format(len(my_rows), offsets[comm_rank], offsets[comm_rank+1], num_agents) )
+
+    ppd, codes=_preprocess_agents(agents[my_rows], households, workplaces)
+
+    with h5py.File(out_path, 'w', driver='mpio', comm=comm, libver='latest') as output_file:
+        group=output_file.create_group(attr_group)
+        group.create_dataset(attr_types_dataset, data=numpy.array(_ppd_attr_types))
+        dataset=group.create_dataset(attr_values_dataset, (num_agents,), dtype=_ppd_dtype)
+        if len(ppd) > 0:
+            dataset[offsets[comm_rank]:offsets[comm_rank+1]]=ppd
+        if codes.dtype.names:
+            _write_region_index(group.create_group(region_index), 'agent', codes, offsets[comm_rank], comm)
+    logging.info( 'preprocessed data is stored in "{0}"'.format(out_path) )
+    return num_agents
+
+def stream_preprocess_synpop_h5(in_path, out_path, comm=MPI.COMM_WORLD, region=None, region_index='region_index',
+                                chunk_len=int(1e5), block_len=1<<16,
+                                attr_group='SPP10pc', attr_values_dataset='ppd', attr_types_dataset='da'):
+    """ Preprocess synthetic population in HDF5 format in parallel reading only slice-local data.
+
+    Unlike ``preprocess_synpop_h5``, this function does not load whole tables.
+    Every process scans an even share of the agent table in chunks of `chunk_len` rows and
+    fetches only households and workplaces referenced by agents of the current chunk
+    by a lookup of sorted ids in the input datasets. Hence, memory consumption grows
+    with the slice size rather than with the population size.
+    If the input file has region index, agents of the region are found with the index
+    and every process reads only rows of its share of the region.
+    The output is identical to the output of ``preprocess_synpop_h5``.
+
+    Parameters
+    ----------
+    in_path : str
+        Path to HDF5 file with synthetic population (datasets ``agent``, ``household`` and ``workplace``).
+    out_path : str
+        Path to output HDF5 file with node attributes.
+    comm : mpi4py.MPI.Comm
+        MPI communicator
+    region : dict
+        Administrative codes of households to select (e.g., ``{'l0' : 0, 'l1' : 569}``
+        for Turin municipality). If ``None``, all agents are selected.
+    region_index : str
+        Name of the group with region index in the input file (built with ``build_region_index_h5``)
+        and in the output attribute group.
+    chunk_len : int
+        Number of agents read at once
+    block_len : int
+        Number of households (workplaces) read at once when looking up rows by ids
+
+    Returns
+    -------
+    num_agents : int
+        Number of preprocessed agents.
+
+    See Also
+    --------
+    preprocess_synpop_h5
+    """
+    comm_rank=comm.Get_rank()
+    comm_size=comm.Get_size()
+
+    with h5py.File(in_path, 'r') as input_file:
+        agents=input_file['agent']
+        households=_SortedIdLookup(input_file['household'], comm, block_len)
+        workplaces=_SortedIdLookup(input_file['workplace'], comm, block_len)
+
+        if region and region_index in input_file:
+            # Find agents of the region with the index and take the even share of them
+            region_agents=region_rows(input_file[region_index], 'agent', region)
+            begin, end=len(region_agents)*comm_rank//comm_size, len(region_agents)*(comm_rank+1)//comm_size
+            selections=[region_agents[start:min(end, start+chunk_len)] for start in xrange(begin, end, chunk_len)]
+        else:
+            # Find ids of households in the region
+            region_ids=None
+            if region:
+                if comm_rank == 0:
+                    region_ids=[]
+                    levels=tuple(region.keys())
+                    for start in xrange(0, len(households.dataset), block_len):
+                        block=households.dataset[(slice(start, start+block_len), 'id') + levels]
+                        region_mask=numpy.ones(len(block), dtype=bool)
+                        for level, code in region.items():
+                            region_mask&=block[level] == code
+                        region_ids.append(block['id'][region_mask])
+                    region_ids=numpy.unique(numpy.hstack(region_ids)) if region_ids else numpy.empty(0, dtype='i8')
+                region_ids=comm.bcast(region_ids, root=0)
+
+            # Select agents in the share of the agent table
+            begin, end=len(agents)*comm_rank//comm_size, len(agents)*(comm_rank+1)//comm_size
+            selections=[]
+            for start in xrange(begin, end, chunk_len):
+                stop=min(end, start+chunk_len)
+                if region_ids is None:
+                    selections.append(numpy.arange(start, stop))
+                else:
+                    selections.append(start + numpy.flatnonzero(_isin(agents[start:stop, 'hh'], region_ids)))
+        num_selected=sum(len(selection) for selection in selections)
+        offset=comm.exscan(num_selected) or 0
+        num_agents=comm.allreduce(num_selected)
+        logging.info( 'preprocess {0} agents [{1},{2}) out of {3}'.\
+                      format(num_selected, offset, offset+num_selected, num_agents) )
+
+        with h5py.File(out_path, 'w', driver='mpio', comm=comm, libver='latest') as output_file:
+            group=output_file.create_group(attr_group)
+            group.create_dataset(attr_types_dataset, data=numpy.array(_ppd_attr_types))
+            dataset=group.create_dataset(attr_values_dataset, (num_agents,), dtype=_ppd_dtype)
+
+            codes, row_offset=[], offset
+            for selection in selections:
+                if len(selection) == 0:
+                    continue
+                ppd, chunk_codes=_preprocess_agents(_read_rows(agents, selection), households, workplaces)
+                dataset[offset:offset+len(ppd)]=ppd
+                codes.append(chunk_codes)
+                offset+=len(ppd)
+            codes_dtype=_codes_dtype(households.dataset.dtype, _region_levels)
+            if codes_dtype.names:
+                codes=numpy.hstack(codes) if codes else numpy.empty(0, dtype=codes_dtype)
+                _write_region_index(group.create_group(region_index), 'agent', codes, row_offset, comm)
+    logging.info( 'preprocessed data is stored in "{0}"'.format(out_path) )
+    return num_agents
+
+def build_region_index_h5(path, comm=MPI.COMM_WORLD, levels=_region_levels, region_index='region_index',
+                          households_dataset='household', agents_dataset='agent', chunk_len=int(1e5)):
+    """ Build sidecar index from administrative codes to household and agent rows of synthetic population.
+
+    Households are indexed by their own codes, agents -- by the codes of their households.
+    Every process handles an even share of the tables in chunks of `chunk_len` rows.
+
+    Parameters
+    ----------
+    path : str
+        Path to HDF5 file with synthetic population (datasets ``agent`` and ``household``).
+        The index is stored in the group `region_index` of the same file.
+    comm : mpi4py.MPI.Comm
+        MPI communicator
+    levels : tuple
+        Administrative levels to index (levels missing in the household table are skipped)
+
+    Examples
+    --------
+    >>> build_region_index_h5('synthPop_Piedimont_10pc_2011.h5')
+    >>> with h5py.File('synthPop_Piedimont_10pc_2011.h5', 'r') as fp:
+    ...     rows=region_rows(fp['region_index'], 'agent', {'l0' : 0, 'l1' : 569})
+
+    See Also
+    --------
+    sn4sp.readwrite.region_rows
+    """
+    comm_rank=comm.Get_rank()
+    comm_size=comm.Get_size()
+    with h5py.File(path, 'a', driver='mpio', comm=comm, libver='latest') as fp:
+        households=fp[households_dataset]
+        agents=fp[agents_dataset]
+        dtype=_codes_dtype(households.dtype, levels)
+        if region_index in fp:
+            del fp[region_index]
+        group=fp.create_group(region_index)
+        group.attrs['levels']=numpy.array(dtype.names)
+
+        begin, end=len(households)*comm_rank//comm_size, len(households)*(comm_rank+1)//comm_size
+        codes=[_codes(households[(slice(start, min(end, start+chunk_len)), 'id') + dtype.names], dtype) \
+               for start in xrange(begin, end, chunk_len)]
+        codes=numpy.hstack(codes) if codes else numpy.empty(0, dtype=dtype)
+        _write_region_index(group, 'household', codes, begin, comm)
+
+        lookup=_SortedIdLookup(households, comm)
+        begin, end=len(agents)*comm_rank//comm_size, len(agents)*(comm_rank+1)//comm_size
+        codes=[_codes(lookup[agents[start:min(end, start+chunk_len), 'hh']], dtype) \
+               for start in xrange(begin, end, chunk_len)]
+        codes=numpy.hstack(codes) if codes else numpy.empty(0, dtype=dtype)
+        _write_region_index(group, 'agent', codes, begin, comm)
+    logging.info( 'region index is stored in "{0}:{1}"'.format(path, region_index) )
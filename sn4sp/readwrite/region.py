@@ -0,0 +1,134 @@
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+"""
+******
+Region
+******
+Indices from administrative codes (``l0``, ``l1``, ``l2``) to rows of
+population tables, stored in sidecar HDF5 groups.
+
+An index group holds datasets with
+- ``<table>_keys`` -- sorted unique combinations of administrative codes,
+- ``<table>_offsets`` -- offsets of row ranges of every key in ``<table>_rows``,
+- ``<table>_rows`` -- rows of the table grouped by keys (sorted within a key).
+"""
+from __future__ import division, absolute_import, print_function
+
+__author__ = '\n'.join(['Sergiy Gogolenko <gogolenko@hlrs.de>',
+                        'Fabio Saracco <fabio@imt.it>'])
+__all__ = [ 'region_rows', ]
+
+from mpi4py import MPI
+import numpy
+
+# Administrative levels supported by the index
+_region_levels=('l0', 'l1', 'l2')
+
+def _codes_dtype(dtype, levels):
+    """ Type of the administrative codes of the levels available in the table of type `dtype`. """
+    return numpy.dtype([(level, dtype[level]) for level in levels if level in dtype.names])
+
+def _codes(rows, dtype):
+    """ Copy administrative codes from the table `rows` """
+    codes=numpy.empty(len(rows), dtype=dtype)
+    for level in dtype.names:
+        codes[level]=rows[level]
+    return codes
+
+def _read_rows(dataset, rows):
+    """ Read sorted `rows` of the dataset (reads the whole span of rows if they are dense enough). """
+    if len(rows) == 0:
+        return numpy.empty(0, dtype=dataset.dtype)
+    span=rows[-1] - rows[0] + 1
+    if span <= 4*len(rows):
+        return dataset[rows[0]:rows[-1]+1][rows - rows[0]]
+    # NOTE: h5py requires increasing indices for point selections
+    return dataset[rows.tolist()]
+
+def _write_region_index(group, table, codes, row_offset, comm):
+    """ Write index from administrative codes to rows of the `table` in parallel.
+
+    Every process provides `codes` of the contiguous range of table rows starting from `row_offset`.
+    Collective call: all processes of `comm` must participate.
+
+    Parameters
+    ----------
+    group : h5py.Group
+        Index group
+    table : str
+        Name of the indexed table
+    codes : numpy.array
+        Structured array with administrative codes of the rows of the current process
+    row_offset : int
+        First row of the current process
+    comm : mpi4py.MPI.Comm
+        MPI communicator
+    """
+    keys=numpy.unique(numpy.hstack(comm.allgather(numpy.unique(codes))).astype(codes.dtype))
+    key_ids=numpy.searchsorted(keys, codes)
+    counts=numpy.bincount(key_ids, minlength=len(keys)).astype('i8')
+    total_counts=numpy.zeros_like(counts)
+    comm.Allreduce(counts, total_counts, op=MPI.SUM)
+    # Number of rows with the same key in the processes with lower ranks
+    prefix=numpy.zeros_like(counts)
+    comm.Exscan(counts, prefix, op=MPI.SUM)
+    if comm.Get_rank() == 0:
+        prefix[:]=0
+    offsets=numpy.hstack(([0], numpy.cumsum(total_counts))).astype('i8')
+
+    keys_dataset=group.create_dataset('{0}_keys'.format(table), (len(keys),), dtype=keys.dtype)
+    offsets_dataset=group.create_dataset('{0}_offsets'.format(table), (len(offsets),), dtype='i8')
+    rows_dataset=group.create_dataset('{0}_rows'.format(table), (offsets[-1],), dtype='i8')
+    if comm.Get_rank() == 0:
+        keys_dataset[...]=keys
+        offsets_dataset[...]=offsets
+
+    order=numpy.argsort(key_ids, kind='mergesort')
+    rows=row_offset + order
+    local_offsets=numpy.hstack(([0], numpy.cumsum(counts)))
+    for key_id in numpy.flatnonzero(counts):
+        start=offsets[key_id] + prefix[key_id]
+        rows_dataset[start:start+counts[key_id]]=rows[local_offsets[key_id]:local_offsets[key_id+1]]
+
+def region_rows(group, table, region):
+    """ Find rows of the `table` in the region with the sidecar index.
+
+    Parameters
+    ----------
+    group : h5py.Group
+        Index group
+    table : str
+        Name of the indexed table (e.g., ``agent`` or ``household``)
+    region : dict
+        Administrative codes of the region (e.g., ``{'l0' : 0, 'l1' : 569}``)
+
+    Returns
+    -------
+    rows : numpy.array
+        Sorted rows of the region
+
+    Raises
+    ------
+    ValueError : exception
+        Region refers to administrative levels missing in the index.
+
+    Examples
+    --------
+    >>> with h5py.File('synthPop_Piedimont_10pc_2011.h5', 'r') as fp:
+    ...     rows=region_rows(fp['region_index'], 'agent', {'l0' : 0, 'l1' : 569})
+    """
+    keys=group['{0}_keys'.format(table)][...]
+    mask=numpy.ones(len(keys), dtype=bool)
+    for level, code in region.items():
+        if level not in keys.dtype.names:
+            raise ValueError( 'index "{0}" does not contain administrative level "{1}"'.format(group.name, level) )
+        mask&=keys[level] == code
+    offsets=group['{0}_offsets'.format(table)][...]
+    dataset=group['{0}_rows'.format(table)]
+    rows=[dataset[start:stop] for start, stop in zip(offsets[:-1][mask], offsets[1:][mask])]
+    return numpy.sort(numpy.hstack(rows)) if rows else numpy.empty(0, dtype='i8')
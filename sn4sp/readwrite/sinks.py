@@ -0,0 +1,708 @@
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+"""
+*****
+Sinks
+*****
+Consumers of chunks of edges produced by ``SimilarityGraph.edges_probabilities_chunks``
+(or ``SimilarityGraph.edges_factors_chunks``).
+
+Chunks are structured arrays which are views of a buffer reused by the producer,
+so sinks store (or copy) every chunk before the next one is produced.
+"""
+from __future__ import division, absolute_import, print_function
+
+__author__ = '\n'.join(['Sergiy Gogolenko <gogolenko@hlrs.de>',
+                        'Fabio Saracco <fabio@imt.it>'])
+__all__ = [ 'EdgeSink',
+            'HDF5Sink',
+            'NPYSink',
+            'ArraySink',
+            'CountingSink',
+            'CallbackSink',
+            'BackgroundSink',
+            'AggregatorSink',
+            'aggregator_comm',
+            'StatisticsSink',
+            'network_statistics',
+            'chunked',
+            'stream_edges', ]
+
+import logging
+import datetime
+import threading
+import tempfile
+import sys
+if sys.version_info[0] >= 3:
+    import queue
+else:
+    import Queue as queue
+
+from mpi4py import MPI
+import numpy
+from numpy.lib import format as npy_format
+import h5py
+
+class EdgeSink(object):
+    """
+    Base class of sinks of edges.
+
+    Sinks are context managers which are closed on exit.
+    Subclasses implement `_write` (and `close` if needed).
+    """
+    def __init__(self):
+        self.num_edges=0
+
+    def write(self, edges):
+        """ Consume chunk of edges (structured array). """
+        self._write(edges)
+        self.num_edges+=len(edges)
+
+    def _write(self, edges):
+        raise NotImplementedError
+
+    def close(self):
+        """ Finalize the output. """
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class HDF5Sink(EdgeSink):
+    """
+    Sink appending edges to a resizable one-dimensional HDF5 dataset (e.g., edge list of a process).
+
+    If `comm` is given, datasets of all processes are resized collectively (as parallel HDF5 requires):
+    edges which do not fit into the preallocated dataset are spilled to a temporary file,
+    and `close` (a collective call) fixes sizes of all datasets and copies spilled edges.
+
+    With collective transfers, all edges are spilled and `close` writes them in rounds:
+    in every round, each process writes a piece of its edges to its dataset, while other processes
+    take part in the transfer with empty selections.
+
+    Parameters
+    ----------
+    dataset : h5py.Dataset
+        Dataset with unlimited maximum shape (``None`` if the process writes no edges)
+    comm : mpi4py.MPI.Comm
+        MPI communicator of processes sharing the file
+    datasets : list
+        Datasets of all processes of `comm` (``None`` for processes without datasets)
+    collective : bool
+        If ``True``, write edges with collective transfers (``H5FD_MPIO_COLLECTIVE``)
+        in files shared by several processes
+    """
+    def __init__(self, dataset, comm=None, datasets=None, collective=False):
+        super(HDF5Sink, self).__init__()
+        self.dataset, self.comm, self.datasets=dataset, comm, datasets
+        self.collective=collective and comm is not None and comm.Get_size() > 1
+        self.spill, self.num_spilled=None, 0
+
+    @staticmethod
+    def write_collective(dataset, offset, data):
+        """ Write `data` to ``dataset[offset:offset+len(data)]`` with collective transfer (collective call).
+
+        Processes without data take part in the transfer with empty selections.
+        """
+        dxpl=h5py.h5p.create(h5py.h5p.DATASET_XFER)
+        dxpl.set_dxpl_mpio(h5py.h5fd.MPIO_COLLECTIVE)
+        file_space=dataset.id.get_space()
+        memory_space=h5py.h5s.create_simple((max(len(data), 1),))
+        if len(data) > 0:
+            file_space.select_hyperslab((offset,), (len(data),))
+        else:
+            # NOTE: h5py skips writes of empty selections, so they are passed to HDF5 directly
+            file_space.select_none()
+            memory_space.select_none()
+            data=numpy.zeros(1, dtype=dataset.dtype)
+        dataset.id.write(memory_space, file_space, numpy.ascontiguousarray(data, dtype=dataset.dtype), dxpl=dxpl)
+
+    def _write(self, edges):
+        if len(edges) == 0:
+            return
+        offset=self.num_edges
+        if self.comm is None:
+            if offset + len(edges) > self.dataset.shape[0]:
+                self.dataset.resize((offset + len(edges),))
+            self.dataset[offset:offset+len(edges)]=edges
+            return
+        num_fitting=0 if self.collective else max(0, min(len(edges), self.dataset.shape[0] - offset))
+        if num_fitting > 0:
+            self.dataset[offset:offset+num_fitting]=edges[:num_fitting]
+        if num_fitting < len(edges):
+            if self.spill is None:
+                if not self.collective:
+                    logging.warning( 'preallocated edge list of process {0} is full, edges are spilled to a temporary file'.\
+                                     format(self.comm.Get_rank()) )
+                self.spill=tempfile.TemporaryFile()
+            self.spill.write(edges[num_fitting:].astype(self.dataset.dtype).tobytes())
+            self.num_spilled+=len(edges) - num_fitting
+
+    def _spilled_pieces(self, piece_len):
+        """ Iterator over (offset, edges) pieces of spilled edges. """
+        if self.spill is None:
+            return
+        self.spill.seek(0)
+        offset=self.num_edges - self.num_spilled
+        while offset < self.num_edges:
+            edges=numpy.frombuffer( self.spill.read(min(piece_len, self.num_edges - offset)*self.dataset.dtype.itemsize),
+                                    dtype=self.dataset.dtype )
+            yield offset, edges
+            offset+=len(edges)
+
+    def close(self):
+        """ Fix size of the dataset (of all datasets and copy spilled edges if `comm` is given). """
+        if self.comm is None:
+            self.dataset.resize((self.num_edges,))
+            return
+        datasets=self.datasets
+        if datasets is None:
+            return  # closed already
+        for dataset, num_edges in zip(datasets, self.comm.allgather(self.num_edges)):
+            if dataset is not None and dataset.shape[0] != num_edges:
+                dataset.resize((num_edges,))
+        self.datasets=None
+        # Copy spilled edges in pieces of about the chunk size of the dataset
+        piece_len=max(self.dataset.chunks[0] if self.dataset is not None and self.dataset.chunks else 0, 1<<16)
+        pieces=self._spilled_pieces(piece_len)
+        if self.collective:
+            rank=self.comm.Get_rank()
+            num_rounds=self.comm.allreduce(-(-self.num_spilled//piece_len), op=MPI.MAX)
+            for _ in xrange(num_rounds):
+                piece=next(pieces, None)
+                for owner, dataset in enumerate(datasets):
+                    if dataset is None:
+                        continue
+                    offset, edges=piece if owner == rank and piece is not None else (0, ())
+                    self.write_collective(dataset, offset, edges)
+        else:
+            for offset, edges in pieces:
+                self.dataset[offset:offset+len(edges)]=edges
+        if self.spill is not None:
+            self.spill.close()
+
+class NPYSink(EdgeSink):
+    """
+    Sink streaming edges to a file in NumPy ``.npy`` format (readable with ``numpy.load``).
+
+    Parameters
+    ----------
+    path : str
+        Path to the output file
+    dtype : numpy.dtype
+        Type of edges (chunks of other types are converted)
+    """
+    # NOTE: header is padded to fit the largest number of edges, so it is rewritten in place on close
+    _header_len=256
+
+    def __init__(self, path, dtype):
+        super(NPYSink, self).__init__()
+        self.path, self.dtype=path, numpy.dtype(dtype)
+        self.file=open(path, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        header="{{'descr': {0!r}, 'fortran_order': False, 'shape': ({1},), }}".\
+               format(npy_format.dtype_to_descr(self.dtype), self.num_edges)
+        # magic string (6 bytes), version (2 bytes), header length (2 bytes), header ending with a newline
+        header_len=self._header_len - 10
+        if len(header) + 1 > header_len:
+            raise ValueError( 'type of edges {0} is too long for the header'.format(self.dtype) )
+        self.file.write(npy_format.magic(1, 0))
+        self.file.write(numpy.array(header_len, dtype='<u2').tobytes())
+        self.file.write((header.ljust(header_len - 1) + '\n').encode('latin1'))
+
+    def _write(self, edges):
+        if edges.dtype != self.dtype:
+            edges=edges.astype(self.dtype)
+        self.file.write(numpy.ascontiguousarray(edges).tobytes())
+
+    def close(self):
+        """ Store the number of edges in the header and close the file. """
+        if self.file.closed:
+            return
+        self.file.seek(0)
+        self._write_header()
+        self.file.close()
+
+class ArraySink(EdgeSink):
+    """
+    Sink collecting copies of edges in memory.
+
+    Parameters
+    ----------
+    dtype : numpy.dtype
+        Type of edges (type of the first chunk if ``None``)
+    """
+    def __init__(self, dtype=None):
+        super(ArraySink, self).__init__()
+        self.dtype=None if dtype is None else numpy.dtype(dtype)
+        self.chunks=[]
+
+    def _write(self, edges):
+        self.dtype=self.dtype or edges.dtype
+        self.chunks.append(edges.astype(self.dtype))  # NOTE: `astype` copies the chunk
+
+    @property
+    def edges(self):
+        """ Array of all collected edges. """
+        if len(self.chunks) != 1:
+            self.chunks=[numpy.concatenate(self.chunks) if self.chunks else numpy.empty(0, dtype=self.dtype)]
+        return self.chunks[0]
+
+class CountingSink(EdgeSink):
+    """ Sink which only counts edges (e.g., to estimate size of the network). """
+    def _write(self, edges):
+        pass
+
+class CallbackSink(EdgeSink):
+    """
+    Sink passing chunks of edges to the user callback.
+
+    Parameters
+    ----------
+    callback : callable
+        Function called with every chunk (the chunk is overwritten after the call returns)
+    """
+    def __init__(self, callback):
+        super(CallbackSink, self).__init__()
+        self.callback=callback
+
+    def _write(self, edges):
+        self.callback(edges)
+
+class BackgroundSink(EdgeSink):
+    """
+    Sink which passes edges to another sink in a background thread.
+
+    Chunks are copied to one of `num_buffers` buffers, and the thread drains filled buffers
+    to the wrapped sink while the producer computes the next chunks. If all buffers are filled,
+    `write` waits for the thread, so memory stays bounded by `num_buffers` chunks.
+
+    Parameters
+    ----------
+    sink : EdgeSink
+        Wrapped sink (closed by the background sink)
+    num_buffers : int
+        Number of buffers (at least 1)
+
+    Notes
+    -----
+    Overlap of I/O and computations is limited by the GIL. h5py holds the GIL during HDF5 calls
+    (including compression and file system time), so writes of ``HDF5Sink`` overlap only with
+    NumPy operations of the producer which release the GIL. Plain file writes (``NPYSink``
+    and spills of ``HDF5Sink`` to temporary files) release the GIL.
+
+    Sinks performing MPI-IO (e.g., ``HDF5Sink`` with ``mpio`` driver) require
+    MPI thread support level ``MPI.THREAD_SERIALIZED`` or higher.
+    """
+    def __init__(self, sink, num_buffers=2):
+        super(BackgroundSink, self).__init__()
+        if num_buffers < 1:
+            raise ValueError( 'at least 1 buffer is required, got {0}'.format(num_buffers) )
+        self.sink=sink
+        self.free_buffers=queue.Queue()
+        for _ in xrange(num_buffers):
+            self.free_buffers.put(None)  # NOTE: buffers are allocated for the first chunks
+        self.filled_buffers=queue.Queue()
+        self.error=None
+        self.thread=threading.Thread(target=self._drain, name='edge-sink')
+        self.thread.daemon=True
+        self.thread.start()
+
+    def _drain(self):
+        while True:
+            item=self.filled_buffers.get()
+            if item is None:
+                break
+            buffer, length=item
+            if self.error is None:
+                try:
+                    self.sink.write(buffer[:length])
+                except Exception as error:  # reported to the producer
+                    self.error=error
+            self.free_buffers.put(buffer)
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error=self.error, None
+            raise error
+
+    def _write(self, edges):
+        self._raise_error()
+        buffer=self.free_buffers.get()  # wait until the thread drains a buffer
+        if buffer is None or len(buffer) < len(edges) or buffer.dtype != edges.dtype:
+            buffer=numpy.empty(len(edges), dtype=edges.dtype)
+        buffer[:len(edges)]=edges
+        self.filled_buffers.put((buffer, len(edges)))
+
+    def close(self):
+        """ Wait until all edges are passed to the wrapped sink and close it. """
+        if self.thread.is_alive():
+            self.filled_buffers.put(None)
+            self.thread.join()
+            self.sink.close()
+        self._raise_error()
+
+def aggregator_comm(comm, ranks_per_aggregator=None):
+    """ Split processes into groups served by I/O aggregators (collective call).
+
+    Parameters
+    ----------
+    comm : mpi4py.MPI.Intracomm
+        MPI communicator
+    ranks_per_aggregator : int
+        Number of consecutive processes per aggregator (processes of the same node if ``None``)
+
+    Returns
+    -------
+    group_comm : mpi4py.MPI.Intracomm
+        Communicator of the group of the current process (rank 0 is the aggregator)
+    """
+    if ranks_per_aggregator is None:
+        return comm.Split_type(MPI.COMM_TYPE_SHARED, key=comm.Get_rank())
+    if ranks_per_aggregator < 1:
+        raise ValueError( 'at least 1 process per aggregator is required, got {0}'.format(ranks_per_aggregator) )
+    return comm.Split(comm.Get_rank()//ranks_per_aggregator, key=comm.Get_rank())
+
+class AggregatorSink(EdgeSink):
+    """
+    Sink gathering edges of a group of processes in its I/O aggregator.
+
+    Processes of the group send copies of their chunks to the aggregator (rank 0 of `comm`)
+    with non-blocking MPI calls. The aggregator collects received edges (and its own edges)
+    in a large buffer and passes it to the wrapped sink whenever the buffer is full,
+    so the file system sees a few large contiguous writes instead of many small ones.
+
+    The aggregator computes edges too. If MPI supports ``MPI.THREAD_MULTIPLE``, a helper thread
+    of the aggregator receives messages (and writes full buffers) while the aggregator computes.
+    Otherwise, the aggregator receives pending messages only after every own chunk,
+    so other processes of the group wait for the aggregator when their buffers are sent.
+    `close` is a collective call of the group.
+
+    Parameters
+    ----------
+    sink : EdgeSink
+        Wrapped sink of the aggregator. Other processes only close it (if it is not ``None``),
+        e.g., to take part in collective calls of ``HDF5Sink``.
+    comm : mpi4py.MPI.Intracomm
+        Communicator of the group (see `aggregator_comm`)
+    dtype : numpy.dtype
+        Type of edges
+    buffer_len : int
+        Length of the buffer of the aggregator
+    num_buffers : int
+        Maximum number of chunks sent and not yet received by the aggregator (in other processes)
+    threaded : bool
+        If ``True``, receive messages in a helper thread of the aggregator
+        (if ``None``, only if MPI supports ``MPI.THREAD_MULTIPLE``)
+
+    Notes
+    -----
+    `num_edges` is the number of edges produced by the current process, and ``sink.num_edges``
+    is the number of edges written by the aggregator.
+    """
+    _tag=77
+
+    def __init__(self, sink, comm, dtype, buffer_len=1<<20, num_buffers=2, threaded=None):
+        super(AggregatorSink, self).__init__()
+        if num_buffers < 1:
+            raise ValueError( 'at least 1 buffer is required, got {0}'.format(num_buffers) )
+        self.sink, self.comm, self.dtype=sink, comm, numpy.dtype(dtype)
+        self.is_aggregator=comm.Get_rank() == 0
+        if self.is_aggregator:
+            self.buffer=numpy.empty(buffer_len, dtype=self.dtype)
+            self.k=0
+            self.num_active=comm.Get_size() - 1  # processes which have not finished sending
+            self.lock=threading.Lock()  # guards the buffer and the wrapped sink
+            self.error=None
+            self.thread=None
+            if threaded is None:
+                threaded=MPI.Query_thread() == MPI.THREAD_MULTIPLE
+            if threaded and self.num_active > 0:
+                self.thread=threading.Thread(target=self._serve, name='edge-aggregator')
+                self.thread.daemon=True
+                self.thread.start()
+        else:
+            self.num_buffers=num_buffers
+            self.requests=[]  # pending sends (request, buffer)
+            self.free_buffers=[]
+
+    def _send(self, edges):
+        if len(self.requests) == self.num_buffers:
+            request, buffer=self.requests.pop(0)
+            request.Wait()
+            self.free_buffers.append(buffer)
+        buffer=self.free_buffers.pop() if self.free_buffers else None
+        if buffer is None or len(buffer) < len(edges):
+            buffer=numpy.empty(len(edges), dtype=self.dtype)
+        message=buffer[:len(edges)]
+        message[...]=edges
+        self.requests.append((self.comm.Isend([message.view('B'), MPI.BYTE], dest=0, tag=self._tag), buffer))
+
+    def _flush(self):
+        if self.k > 0:
+            self.sink.write(self.buffer[:self.k])
+            self.k=0
+
+    def _collect(self, edges):
+        if self.k + len(edges) > len(self.buffer):
+            self._flush()
+        if len(edges) > len(self.buffer):
+            self.sink.write(edges)
+        else:
+            self.buffer[self.k:self.k+len(edges)]=edges
+            self.k+=len(edges)
+
+    def _receive(self, blocking):
+        """ Receive messages from the group (until all processes finish if `blocking`). """
+        status=MPI.Status()
+        while self.num_active > 0:
+            if not self.comm.Iprobe(source=MPI.ANY_SOURCE, tag=self._tag, status=status):
+                if not blocking:
+                    return
+                self.comm.Probe(source=MPI.ANY_SOURCE, tag=self._tag, status=status)
+            num_bytes=status.Get_count(MPI.BYTE)
+            if num_bytes == 0:  # end of edges of the process
+                self.comm.Recv([None, 0, MPI.BYTE], source=status.Get_source(), tag=self._tag)
+                self.num_active-=1
+                continue
+            length=num_bytes//self.dtype.itemsize
+            with self.lock:
+                if self.k + length > len(self.buffer):
+                    self._flush()
+                edges=self.buffer[self.k:self.k+length] if length <= len(self.buffer) else \
+                      numpy.empty(length, dtype=self.dtype)
+                self.comm.Recv([edges.view('B'), MPI.BYTE], source=status.Get_source(), tag=self._tag)
+                if length <= len(self.buffer):
+                    self.k+=length
+                else:
+                    self.sink.write(edges)
+
+    def _serve(self):
+        """ Receive messages of the group until all processes finish (target of the helper thread). """
+        try:
+            self._receive(blocking=True)
+        except Exception as error:  # reported to the aggregator
+            self.error=error
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error=self.error, None
+            raise error
+
+    def _write(self, edges):
+        if len(edges) == 0:
+            return
+        if self.is_aggregator:
+            self._raise_error()
+            with self.lock:
+                self._collect(edges)
+            if self.thread is None:
+                self._receive(blocking=False)
+        else:
+            self._send(edges)
+
+    def close(self):
+        """ Receive the rest of edges and flush the buffer (in the aggregator) or finish sending edges,
+        and close the wrapped sink.
+        """
+        if self.is_aggregator:
+            if self.thread is None:
+                self._receive(blocking=True)
+            else:
+                self.thread.join()
+                self._raise_error()
+            self._flush()
+            self.sink.close()
+        else:
+            self.comm.Send([None, 0, MPI.BYTE], dest=0, tag=self._tag)
+            MPI.Request.Waitall([request for request, _ in self.requests])
+            self.requests=[]
+            if self.sink is not None:
+                self.sink.close()
+
+class StatisticsSink(EdgeSink):
+    """
+    Sink accumulating statistics of edges instead of storing them.
+
+    Statistics hold a value per (hss, damping) setting in the last dimension
+    if edges have several weights. Combine statistics of processes with `reduce`.
+
+    Parameters
+    ----------
+    num_vertices : int
+        Number of vertices
+    groups : numpy.array
+        Group of every vertex (non-negative integers, e.g., municipality indices)
+    bins : int or numpy.array
+        Number of bins of the weight histogram between 0 and 1 or edges of the bins
+    num_settings : int
+        Number of weights of edges
+
+    Attributes
+    ----------
+    degrees : numpy.array
+        Expected degrees of vertices (sums of weights of incident edges)
+    bins : numpy.array
+        Edges of bins of the histogram
+    histogram : numpy.array
+        Numbers of edges with weights in the bins
+    group_weights : numpy.array
+        Expected numbers of edges between groups ``a <= b`` stored at ``[a,b]`` (``None`` without groups)
+    total_weight : float or numpy.array
+        Expected number of edges
+    """
+    def __init__(self, num_vertices, groups=None, bins=100, num_settings=1):
+        super(StatisticsSink, self).__init__()
+        settings_shape=() if num_settings == 1 else (num_settings,)
+        self.degrees=numpy.zeros((num_vertices,) + settings_shape)
+        self.bins=numpy.linspace(0., 1., bins + 1) if numpy.isscalar(bins) else numpy.asarray(bins, dtype='f8')
+        self.histogram=numpy.zeros((len(self.bins) - 1,) + settings_shape, dtype='i8')
+        self.groups=None if groups is None else numpy.asarray(groups, dtype='i8')
+        num_groups=0 if groups is None else int(self.groups.max()) + 1
+        self.group_weights=None if groups is None else numpy.zeros((num_groups, num_groups) + settings_shape)
+        self.total_weight=numpy.zeros(settings_shape)
+        self.num_settings=num_settings
+
+    def _write(self, edges):
+        src, trg=edges['src_node'], edges['trg_node']
+        weights=edges['weight'].reshape(len(edges), -1)
+        degrees=self.degrees.reshape(len(self.degrees), -1)
+        histogram=self.histogram.reshape(len(self.histogram), -1)
+        if self.groups is not None:
+            src_groups, trg_groups=self.groups[src], self.groups[trg]
+            num_groups=len(self.group_weights)
+            pairs=numpy.minimum(src_groups, trg_groups)*num_groups + numpy.maximum(src_groups, trg_groups)
+            group_weights=self.group_weights.reshape(num_groups*num_groups, -1)
+        for k in xrange(weights.shape[1]):
+            degrees[:,k]+=numpy.bincount(src, weights=weights[:,k], minlength=len(degrees))
+            degrees[:,k]+=numpy.bincount(trg, weights=weights[:,k], minlength=len(degrees))
+            histogram[:,k]+=numpy.histogram(weights[:,k], self.bins)[0]
+            if self.groups is not None:
+                group_weights[:,k]+=numpy.bincount(pairs, weights=weights[:,k], minlength=len(group_weights))
+        self.total_weight+=weights.sum(axis=0).reshape(self.total_weight.shape)
+
+    def reduce(self, comm):
+        """ Sum statistics of all processes (collective call). """
+        for values in (self.degrees, self.histogram, self.group_weights, self.total_weight):
+            if values is not None:
+                comm.Allreduce(MPI.IN_PLACE, values, op=MPI.SUM)
+        self.num_edges=comm.allreduce(self.num_edges, op=MPI.SUM)
+        return self
+
+def chunked(edges, dtype, chunk_len):
+    """ Group edges given as tuples (e.g., by ``SimilarityGraph.class_edges_probabilities``) into chunks.
+
+    Edges with zero last fields (probabilities or similarities) are skipped.
+    Chunks are views of the same buffer, which is shrunk to a smaller length sent to the iterator.
+    """
+    buffer=numpy.empty(chunk_len, dtype=dtype)
+    k=0
+    for edge in edges:
+        if numpy.any(edge[-1] > 0.):  # store only non-zero entries
+            buffer[k]=edge
+            k+=1
+            if k == chunk_len:
+                requested_len=yield buffer
+                k=0
+                if requested_len is not None and requested_len < chunk_len:
+                    chunk_len=requested_len
+                    buffer=numpy.empty(chunk_len, dtype=dtype)
+    if k > 0:
+        yield buffer[:k]
+
+def stream_edges(chunks, sink, memory_budget=None, on_exceeded=None, min_chunk_len=1024):
+    """ Feed chunks of edges to the sink.
+
+    Parameters
+    ----------
+    chunks : iterator
+        Iterator over chunks of edges (e.g., ``G.edges_probabilities_chunks()``)
+    sink : EdgeSink
+        Consumer of the edges
+    memory_budget : sn4sp.parallel.MemoryBudget
+        Memory budget of the process checked after every chunk
+    on_exceeded : callable
+        Function called once the memory budget is exceeded (e.g., ``G.drop_caches``)
+    min_chunk_len : int
+        Minimal length of chunks. While the memory budget is exceeded, the chunk length is halved
+        down to `min_chunk_len` (if `chunks` is a generator accepting lengths, see ``chunked``).
+
+    Returns
+    -------
+    num_edges : int
+        Number of edges consumed by the sink
+
+    Examples
+    --------
+    >>> with NPYSink('edges.npy', G.edge_dtype) as sink:
+    ...     stream_edges(G.edges_probabilities_chunks(), sink)
+    """
+    start_time=datetime.datetime.now()
+    exceeded=False
+    chunks=iter(chunks)
+    shrinkable=hasattr(chunks, 'send')
+    chunk=next(chunks, None)
+    while chunk is not None:
+        sink.write(chunk)
+        # Log progress
+        # TODO: improve log to show percentage of processed entries
+        logging.debug( 'Current position {0}. Elapsed time={1}.'.\
+                       format((chunk['src_node'][-1], chunk['trg_node'][-1]), (datetime.datetime.now()-start_time)) )
+
+        # Degrade gracefully instead of swapping
+        requested_len=None
+        if memory_budget is not None and memory_budget.exceeded():
+            if shrinkable and len(chunk) > min_chunk_len:
+                requested_len=max(min_chunk_len, len(chunk)//2)
+            if not exceeded:
+                exceeded=True
+                if on_exceeded is not None:
+                    on_exceeded()
+                logging.warning( 'memory budget is exceeded' + \
+                                 (': chunks are shrunk down to {0} edges'.format(min_chunk_len) if shrinkable else '') )
+        try:
+            chunk=next(chunks) if requested_len is None else chunks.send(requested_len)
+        except StopIteration:
+            chunk=None
+    logging.info( '{0} edges are streamed. Elapsed time={1}.'.format(sink.num_edges, datetime.datetime.now()-start_time) )
+    return sink.num_edges
+
+def network_statistics(G, groups=None, bins=100, chunk_len=1<<16, **kwargs):
+    """ Statistics of edges of the similarity network without storing the edges (collective call).
+
+    Parameters
+    ----------
+    G : sn4sp.SimilarityGraph
+        Similarity network
+    groups : numpy.array
+        Group of every vertex (see `StatisticsSink`)
+    bins : int or numpy.array
+        Bins of the weight histogram
+    chunk_len : int
+        Number of pairs of vertices evaluated at once
+
+    Other keyword arguments (e.g., ``threshold`` or ``scheduning``) are passed to ``G.edges_probabilities_chunks``.
+
+    Returns
+    -------
+    statistics : StatisticsSink
+        Statistics combined over all processes of ``G.comm``
+
+    Examples
+    --------
+    >>> statistics=network_statistics(G, groups=municipalities)
+    >>> statistics.degrees.mean(), statistics.group_weights[0,1]
+    """
+    statistics=StatisticsSink(len(G), groups, bins, G.num_settings)
+    stream_edges(G.edges_probabilities_chunks(chunk_len, **kwargs), statistics, G.memory_budget, G.drop_caches)
+    return statistics.reduce(G.comm)
@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+""" Unit tests for consolidation of edge lists
+"""
+
+from __future__ import division, absolute_import, print_function
+import unittest
+import shutil
+import tempfile
+import numpy
+import h5py
+
+from mpi4py import MPI
+
+# TODO: remove in alpha release
+import os
+import sys
+sys.path.insert( 0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))) )
+from sn4sp.readwrite import consolidate
+
+_edge_type=numpy.dtype([('src_node', 'i8'), ('trg_node', 'i8'), ('weight', 'f8')])
+
+def _edges(num_edges, num_vertices, seed=0):
+    """ Random edges with ``src_node < trg_node``. """
+    random_state=numpy.random.RandomState(seed)
+    edges=numpy.zeros(num_edges, dtype=_edge_type)
+    u, v=random_state.randint(0, num_vertices, (2, num_edges))
+    edges['src_node'], edges['trg_node']=numpy.minimum(u, v), numpy.maximum(u, v) + (u == v)
+    edges['weight']=random_state.rand(num_edges)
+    return edges[edges['trg_node'] < num_vertices]
+
+class _Comm(object):
+    """ Communicator of `size` processes gathering the same samples in every process. """
+    def __init__(self, size):
+        self.size=size
+
+    def Get_size(self):
+        return self.size
+
+    def allgather(self, samples):
+        return [samples]*self.size
+
+class TestConsolidate(unittest.TestCase):
+    """ Tests for sorting and indexing of edge lists."""
+
+    def setUp(self):
+        self.temp_dir=tempfile.mkdtemp()
+        self.num_vertices=50
+        self.edges=_edges(2000, self.num_vertices)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_mirror(self):
+        edges=numpy.array([(0, 1, 0.5), (2, 2, 1.), (1, 3, 0.25)], dtype=_edge_type)
+        self.assertEqual( consolidate._mirror(edges).tolist(),
+                          [(0, 1, 0.5), (2, 2, 1.), (1, 3, 0.25), (1, 0, 0.5), (3, 1, 0.25)] )
+
+    def test_merged_runs(self):
+        runs=consolidate._RunFile(_edge_type, self.temp_dir)
+        for start in xrange(0, len(self.edges), 300):
+            runs.write(self.edges[start:start+300], self.num_vertices)
+        runs.write(self.edges[:0], self.num_vertices)
+        self.assertEqual(len(runs), len(self.edges))
+        self.assertEqual(len(runs.runs), -(-len(self.edges)//300))
+        chunks=list(runs.merged(64, self.num_vertices))
+        runs.close()
+        merged=numpy.concatenate(chunks)
+        keys=consolidate._edge_keys(merged, self.num_vertices)
+        self.assertTrue(numpy.all(keys[1:] >= keys[:-1]))
+        self.assertEqual( sorted(merged.tolist()), sorted(self.edges.tolist()) )
+        self.assertEqual(list(consolidate._RunFile(_edge_type, self.temp_dir).merged(64, self.num_vertices)), [])
+
+    def test_vertex_splitters(self):
+        splitters=consolidate._vertex_splitters(numpy.arange(100) % 10, 20, _Comm(4))
+        self.assertEqual(splitters.tolist(), [0, 2, 5, 7, 20])
+        self.assertEqual(consolidate._vertex_splitters(numpy.arange(5), 20, MPI.COMM_SELF).tolist(), [0, 20])
+        self.assertEqual(consolidate._vertex_splitters(numpy.empty(0, 'i8'), 20, _Comm(4)).tolist(), [0, 5, 10, 15, 20])
+
+    def test_consolidate(self):
+        path=os.path.join(self.temp_dir, 'network.h5')
+        with h5py.File(path, 'w') as fp:
+            group=fp.create_group('SimNet')
+            group.attrs['num_vertices']=self.num_vertices
+            group.create_dataset('sample', data=numpy.arange(5))
+            for rank, edges in enumerate(numpy.array_split(self.edges, 3)):
+                group.create_group(str(rank)).create_dataset('edge_list', data=edges)
+        for symmetric in (False, True):
+            expected=consolidate._mirror(self.edges) if symmetric else self.edges
+            expected=expected[numpy.argsort(consolidate._edge_keys(expected, self.num_vertices), kind='mergesort')]
+            # NOTE: consolidated networks are consolidated again with a new index
+            for k, source in enumerate((path, os.path.join(self.temp_dir, 'consolidated_0.h5'))):
+                out_path=os.path.join(self.temp_dir, 'consolidated_{0}.h5'.format(k))
+                consolidate.consolidate_edges_h5( source, out_path, symmetric=symmetric and k == 0, comm=MPI.COMM_SELF,
+                                                  chunk_len=256, temp_dir=self.temp_dir )
+                with h5py.File(out_path, 'r') as fp:
+                    group=fp['SimNet']
+                    self.assertEqual(list(group['sample'][...]), range(5))
+                    self.assertEqual(bool(group.attrs['symmetric']), symmetric and k == 0)
+                    edges=group['0']['edge_list'][...]
+                    vertex_offsets=group['vertex_offsets'][...]
+                self.assertEqual(sorted(edges.tolist()), sorted(expected.tolist()))
+                self.assertEqual(edges[['src_node', 'trg_node']].tolist(), expected[['src_node', 'trg_node']].tolist())
+                self.assertEqual( vertex_offsets.tolist(),
+                                  numpy.searchsorted(edges['src_node'], numpy.arange(self.num_vertices + 1)).tolist() )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+""" Unit tests for columnar HDF5 cache of administrative boundaries
+"""
+
+from __future__ import division, absolute_import, print_function
+import unittest
+import shutil
+import tempfile
+import collections
+import numpy
+import h5py
+
+from mpi4py import MPI
+
+# TODO: remove in alpha release
+import os
+import sys
+sys.path.insert( 0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))) )
+from sn4sp.readwrite import geodata
+
+# Polygons with the attributes of ``shapely`` geometries used by the converter
+_Ring=collections.namedtuple('_Ring', ['coords'])
+_Polygon=collections.namedtuple('_Polygon', ['exterior', 'interiors', 'is_empty'])
+_MultiPolygon=collections.namedtuple('_MultiPolygon', ['geoms', 'is_empty'])
+
+class TestGeodata(unittest.TestCase):
+    """ Tests for the cache of administrative boundaries."""
+
+    def setUp(self):
+        self.temp_dir=tempfile.mkdtemp()
+        self.path=os.path.join(self.temp_dir, 'geodata.h5')
+        with h5py.File(self.path, 'w') as fp:
+            group=fp.create_group('level_2')
+            group.create_dataset('code', data=numpy.arange(10, dtype='i4')*7)
+            group.create_dataset('name', data=geodata._column_array(numpy.array(['a', 'bb']*5, dtype=object)))
+            group.create_dataset('l0', data=numpy.arange(10, dtype='i2') % 3, chunks=(5,))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_geometry_rings(self):
+        square=_Ring([(0., 0.), (1., 0.), (1., 1.), (0., 0.)])
+        hole=_Ring([(.2, .2, 0.), (.4, .2, 0.), (.2, .2, 0.)])
+        polygon=_Polygon(square, [hole], False)
+        rings=geodata._geometry_rings(_MultiPolygon([polygon, _Polygon(square, [], False)], False))
+        self.assertEqual([ring.shape for ring in rings], [(4, 2), (3, 2), (4, 2)])
+        self.assertEqual(geodata._geometry_rings(None), [])
+        self.assertEqual(geodata._geometry_rings(_Polygon(None, [], True)), [])
+
+    def test_read_geodata(self):
+        for mmap in (False, True):
+            columns=geodata.read_geodata_h5(self.path, 2, ['code', 'name', 'l0'], comm=MPI.COMM_SELF, mmap=mmap)
+            self.assertEqual(columns['code'].tolist(), range(0, 70, 7))
+            self.assertEqual(columns['name'].tolist(), ['a', 'bb']*5)
+            self.assertEqual(columns['l0'].tolist(), [k % 3 for k in range(10)])
+            # NOTE: contiguous datasets are memory-mapped, while chunked ones are read
+            self.assertEqual(isinstance(columns['code'], numpy.memmap), mmap)
+            self.assertFalse(isinstance(columns['l0'], numpy.memmap))
+
+if __name__ == '__main__':
+    unittest.main()
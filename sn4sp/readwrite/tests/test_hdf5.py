@@ -0,0 +1,220 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+""" Unit tests for HDF5 files with similarity networks (serial parts)
+"""
+
+from __future__ import division, absolute_import, print_function
+import unittest
+import shutil
+import tempfile
+import numpy
+import h5py
+
+from mpi4py import MPI
+
+# TODO: remove in alpha release
+import os
+import sys
+sys.path.insert( 0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))) )
+from sn4sp.core import SimilarityGraph
+from sn4sp.readwrite import hdf5
+
+def _population(num_vertices, seed=0):
+    """ Random population with the attributes of preprocessed synthetic populations. """
+    random_state=numpy.random.RandomState(seed)
+    vertex_attrs=numpy.zeros(num_vertices, dtype=[ ('sex', 'i1'), ('age', 'i1'), ('role', 'i1'), ('edu', 'i1'),
+                                                   ('employed', 'i1'), ('income', 'i2'),
+                                                   ('wp_lon', 'f4'), ('wp_lat', 'f4'), ('hh_lon', 'f4'), ('hh_lat', 'f4'),
+                                                   ('wp_hh', 'i1') ])
+    for name, high in (('sex', 2), ('age', 90), ('role', 3), ('edu', 3), ('employed', 3), ('income', 40), ('wp_hh', 10)):
+        vertex_attrs[name]=random_state.randint(0, high, num_vertices)
+    for name, low, span in (('wp_lon', 45., 0.1), ('hh_lon', 45., 0.1), ('wp_lat', 7.6, 0.2), ('hh_lat', 7.6, 0.2)):
+        vertex_attrs[name]=low + span*random_state.rand(num_vertices)
+    return vertex_attrs
+
+def _write_network(path, chunks, dtype, num_writers=2, **attrs):
+    """ Write edges to the network group in the layout of ``write_edges_probabilities_h5`` (serially). """
+    edges=numpy.concatenate([chunk.astype(dtype) for chunk in chunks])
+    with h5py.File(path, 'w') as fp:
+        group=fp.create_group('SimNet')
+        for name, value in attrs.items():
+            group.attrs[name]=value
+        bounds=numpy.linspace(0, len(edges), num_writers + 1).astype('i8')
+        for rank, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            group.create_group(str(rank)).create_dataset('edge_list', data=edges[start:stop], maxshape=(None,))
+    return edges
+
+def _sorted_rows(edges):
+    """ Sorted (src_node, trg_node, weight) rows of edges. """
+    return sorted(zip(edges['src_node'].tolist(), edges['trg_node'].tolist(), edges['weight'].tolist()))
+
+class TestHDF5(unittest.TestCase):
+    """ Tests for HDF5 files with similarity networks."""
+
+    def setUp(self):
+        self.temp_dir=tempfile.mkdtemp()
+        self.sim_net=SimilarityGraph( _population(60), list("cocccoggggo"), settings=[(500, 0.), (2000, 0.5)],
+                                      sample_fraction=0.5, comm=MPI.COMM_SELF )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_reweight(self):
+        path, out_path=os.path.join(self.temp_dir, 'factors.h5'), os.path.join(self.temp_dir, 'reweighted.h5')
+        _write_network( path, self.sim_net.edges_factors_chunks(64, dtype=hdf5._edge_factors_type),
+                        hdf5._edge_factors_type, factorized=True, num_vertices=len(self.sim_net) )
+        expected={ (i, j) : p.copy() for chunk in self.sim_net.edges_probabilities_chunks(64) for i, j, p in chunk }
+        hdf5.reweight_edges_h5(path, out_path, settings=self.sim_net.settings, chunk_len=50)
+        with h5py.File(out_path, 'r') as fp:
+            group=fp['SimNet']
+            self.assertFalse(group.attrs['factorized'])
+            self.assertEqual(group.attrs['hss'].tolist(), [500., 2000.])
+            edges=numpy.concatenate([group[str(rank)]['edge_list'][...] for rank in (0, 1)])
+            self.assertEqual(group.attrs['num_edges'].sum(), len(edges))
+        self.assertTrue(len(edges) > 0)
+        self.assertEqual(sorted(zip(edges['src_node'], edges['trg_node'])), sorted(expected))
+        for i, j, p in edges:
+            numpy.testing.assert_allclose(p, expected[(i, j)], rtol=1e-5)
+        # Networks with edge probabilities are not reweighted
+        self.assertRaises(ValueError, hdf5.reweight_edges_h5, out_path, os.path.join(self.temp_dir, 'x.h5'))
+
+    def test_read_edges(self):
+        path=os.path.join(self.temp_dir, 'network.h5')
+        edges=_write_network(path, self.sim_net.edges_probabilities_chunks(64), self.sim_net.edge_dtype, num_writers=3)
+        def read(path, **kwargs):
+            chunks=list(hdf5.read_edges_probabilities_h5(path, chunk_len=100, comm=MPI.COMM_SELF, **kwargs))
+            return _sorted_rows(numpy.concatenate(chunks)) if chunks else []
+        self.assertEqual(read(path), _sorted_rows(edges))
+        retained=edges['weight'][:,1] > 0.1
+        self.assertEqual(read(path, min_weight=0.1, setting=1), _sorted_rows(edges[retained]))
+        incident=lambda edges: ((10 <= edges['src_node']) & (edges['src_node'] < 20)) | \
+                               ((10 <= edges['trg_node']) & (edges['trg_node'] < 20))
+        self.assertEqual(read(path, vertex_range=(10, 20)), _sorted_rows(edges[incident(edges)]))
+
+        # Consolidated networks are read with the index of source vertices
+        for symmetric in (False, True):
+            consolidated=edges.copy()
+            if symmetric:
+                mirrored=edges.copy()
+                mirrored['src_node'], mirrored['trg_node']=edges['trg_node'], edges['src_node']
+                consolidated=numpy.concatenate((edges, mirrored))
+            consolidated=consolidated[numpy.lexsort((consolidated['trg_node'], consolidated['src_node']))]
+            consolidated_path=os.path.join(self.temp_dir, 'consolidated.h5')
+            _write_network(consolidated_path, [consolidated], edges.dtype, num_writers=1, symmetric=symmetric)
+            with h5py.File(consolidated_path, 'a') as fp:
+                fp['SimNet'].create_dataset( 'vertex_offsets',
+                                             data=numpy.searchsorted(consolidated['src_node'], numpy.arange(61)) )
+            expected=consolidated[(10 <= consolidated['src_node']) & (consolidated['src_node'] < 20)] if symmetric else \
+                     consolidated[incident(consolidated)]
+            self.assertEqual(read(consolidated_path, vertex_range=(10, 20)), _sorted_rows(expected))
+            self.assertEqual(read(consolidated_path, vertex_range=(50, 100)), read(path, vertex_range=(50, 100)) \
+                             if not symmetric else _sorted_rows(consolidated[consolidated['src_node'] >= 50]))
+
+    def test_update(self):
+        path, out_path=os.path.join(self.temp_dir, 'network.h5'), os.path.join(self.temp_dir, 'updated.h5')
+        _write_network( path, self.sim_net.edges_probabilities_chunks(64), self.sim_net.edge_dtype,
+                        num_vertices=len(self.sim_net), hss=[500., 2000.], damping=[0., 0.5] )
+        with h5py.File(path, 'a') as fp:
+            fp['SimNet'].create_dataset('sample', data=self.sim_net.sampled_vertex_attrs)
+
+        # Modify vertices 3 and 7, remove vertex 5 and add 2 vertices
+        vertex_attrs=numpy.concatenate((self.sim_net.vertex_attrs, _population(2, seed=1)))
+        vertex_attrs[[3, 7]]=_population(2, seed=2)
+        changed, removed=[3, 7], [5]
+        sim_net=SimilarityGraph( vertex_attrs, list("cocccoggggo"), settings=self.sim_net.settings,
+                                 sample=self.sim_net.sampled_vertex_attrs, comm=MPI.COMM_SELF )
+        hdf5.update_edges_probabilities_h5(sim_net, path, out_path, changed=changed, removed=removed, chunk_len=50)
+        with h5py.File(out_path, 'r') as fp:
+            group=fp['SimNet']
+            self.assertEqual(group.attrs['num_vertices'], len(vertex_attrs))
+            edges=group['0']['edge_list'][...]
+            self.assertEqual(group.attrs['num_edges'].sum(), len(edges))
+        self.assertTrue(len(edges) > 0)
+        self.assertFalse(numpy.any(numpy.in1d(edges['src_node'], removed) | numpy.in1d(edges['trg_node'], removed)))
+        expected={ (i, j) : p.copy() for chunk in sim_net.edges_probabilities_chunks(64) for i, j, p in chunk
+                   if i not in removed and j not in removed }
+        self.assertEqual(sorted(zip(edges['src_node'], edges['trg_node'])), sorted(expected))
+        for i, j, p in edges:
+            numpy.testing.assert_allclose(p, expected[(i, j)])
+
+        # Edges between unaffected vertices are copied
+        old_edges=numpy.concatenate([chunk.copy() for chunk in self.sim_net.edges_probabilities_chunks(64)])
+        affected=changed + removed + [60, 61]
+        unaffected=~(numpy.in1d(old_edges['src_node'], affected) | numpy.in1d(old_edges['trg_node'], affected))
+        copied=~(numpy.in1d(edges['src_node'], affected) | numpy.in1d(edges['trg_node'], affected))
+        self.assertEqual(_sorted_rows(edges[copied]), _sorted_rows(old_edges[unaffected]))
+
+        # Networks of other samples or settings are not updated
+        resampled=SimilarityGraph( vertex_attrs, list("cocccoggggo"), settings=self.sim_net.settings,
+                                   sample=self.sim_net.sampled_vertex_attrs[:10], comm=MPI.COMM_SELF )
+        self.assertRaises(ValueError, hdf5.update_edges_probabilities_h5, resampled, path, out_path, changed)
+        resettled=SimilarityGraph( vertex_attrs, list("cocccoggggo"), settings=[(500, 0.), (5000, 0.5)],
+                                   sample=self.sim_net.sampled_vertex_attrs, comm=MPI.COMM_SELF )
+        self.assertRaises(ValueError, hdf5.update_edges_probabilities_h5, resettled, path, out_path, changed)
+
+    def test_expand_class_network(self):
+        # NOTE: every agent has 2 identical agents
+        vertex_attrs=self.sim_net.vertex_attrs[numpy.arange(60) % 20]
+        for settings in (self.sim_net.settings, [(2000, 0.5)]):
+            sim_net=SimilarityGraph( vertex_attrs, list("cocccoggggo"), settings=settings, sample_fraction=0.5,
+                                     comm=MPI.COMM_SELF )
+            paths=[os.path.join(self.temp_dir, name) for name in ('network.h5', 'classes.h5', 'expanded.h5')]
+            hdf5.write_edges_probabilities_h5(sim_net, paths[0], chunk_len=64, io_buffers=0)
+            hdf5.write_edges_probabilities_h5(sim_net, paths[1], chunk_len=64, io_buffers=0, coarse=True)
+            hdf5.expand_class_network_h5(paths[1], paths[2], comm=MPI.COMM_SELF, chunk_len=50)
+            with h5py.File(paths[0], 'r') as fp:
+                expected=fp['SimNet']['0']['edge_list'][...]
+            with h5py.File(paths[2], 'r') as fp:
+                group=fp['SimNet']
+                self.assertFalse(group.attrs['coarse'])
+                self.assertEqual(group.attrs['num_vertices'], len(vertex_attrs))
+                edges=group['0']['edge_list'][...]
+            self.assertTrue(len(edges) > 0)
+            self.assertEqual(edges.dtype, expected.dtype)
+            edges, expected=[edges[numpy.lexsort((edges['trg_node'], edges['src_node']))] for edges in (edges, expected)]
+            self.assertEqual(edges[['src_node', 'trg_node']].tolist(), expected[['src_node', 'trg_node']].tolist())
+            numpy.testing.assert_allclose(edges['weight'], expected['weight'])
+            if len(settings) > 1:
+                # Edges with several weights are not sampled
+                self.assertRaises(ValueError, hdf5.expand_class_network_h5, paths[1], paths[2], True, 0, MPI.COMM_SELF)
+        # Sampled edges are drawn from the vertex-level network
+        hdf5.expand_class_network_h5(paths[1], paths[2], sample=True, seed=0, comm=MPI.COMM_SELF, chunk_len=50)
+        with h5py.File(paths[2], 'r') as fp:
+            self.assertTrue(fp['SimNet'].attrs['sampled'])
+            sampled=fp['SimNet']['0']['edge_list'][...]
+        self.assertTrue(0 < len(sampled) < len(expected))
+        self.assertTrue(set(zip(sampled['src_node'], sampled['trg_node'])) <= set(zip(expected['src_node'], expected['trg_node'])))
+        # Vertex-level networks are not expanded
+        self.assertRaises(ValueError, hdf5.expand_class_network_h5, paths[0], paths[2], comm=MPI.COMM_SELF)
+
+    def test_tuning(self):
+        tuning=hdf5.HDF5Tuning('64K', 0, xfer_mode='collective').resolve(self.temp_dir, 24, MPI.COMM_SELF)
+        self.assertEqual(tuning.chunk_size, (1<<16)//24*24)
+        self.assertTrue(tuning.collective)
+        self.assertEqual(tuning.attrs()['hdf5_xfer_mode'], 'collective')
+        self.assertFalse(hdf5.HDF5Tuning().collective)
+        self.assertRaises(ValueError, hdf5.HDF5Tuning, xfer_mode='unknown')
+        # NOTE: transfers of a single process are independent
+        path=os.path.join(self.temp_dir, 'network.h5')
+        hdf5.write_edges_probabilities_h5(self.sim_net, path, chunk_len=64, io_buffers=0, tuning=tuning)
+        with h5py.File(path, 'r') as fp:
+            group=fp['SimNet']
+            self.assertEqual(group.attrs['hdf5_xfer_mode'], 'collective')
+            self.assertEqual(group['sample'].shape, self.sim_net.sampled_vertex_attrs.shape)
+            self.assertEqual(len(group['0']['edge_list']), group.attrs['num_edges'].sum())
+
+    def test_edge_list_dtype(self):
+        self.assertEqual(hdf5._edge_list_dtype(1), hdf5._edge_list_type)
+        self.assertEqual(hdf5._edge_list_dtype(3)['weight'].shape, (3,))
+        self.assertEqual(hdf5._edge_list_dtype(self.sim_net.num_settings), self.sim_net.edge_dtype)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+""" Unit tests for preprocessing of synthetic populations
+"""
+
+from __future__ import division, absolute_import, print_function
+import unittest
+import shutil
+import tempfile
+import numpy
+import h5py
+
+from mpi4py import MPI
+
+# TODO: remove in alpha release
+import os
+import sys
+sys.path.insert( 0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))) )
+from sn4sp.readwrite import preprocess
+
+_agent_dtype=numpy.dtype([ ('hh', 'i8'), ('wp', 'i8'), ('sex', 'i1'), ('age', 'i1'), ('role', 'i1'),
+                           ('edu', 'i1'), ('employed', 'i1'), ('income', 'i4') ])
+_location_dtype=numpy.dtype([ ('id', 'i8'), ('lat', 'f8'), ('lon', 'f8'), ('l0', 'i4'), ('l1', 'i4') ])
+
+class TestPreprocess(unittest.TestCase):
+    """ Tests for joins of agents with their households and workplaces."""
+
+    def setUp(self):
+        self.households=numpy.array( [(30, 45.0, 7.6, 0, 1), (10, 45.1, 7.7, 0, 2), (20, 45.2, 7.8, 1, 3)],
+                                     dtype=_location_dtype )
+        self.workplaces=numpy.array( [(5, 45.0, 7.7, 0, 1), (7, 45.3, 7.6, 1, 3)], dtype=_location_dtype )
+        self.agents=numpy.array( [ (10, 5, 1, 30, 0, 1, 1, 2500),
+                                   (20, 0, 0, 40, 1, 2, 0, 2499),
+                                   (30, 7, 1, 50, 2, 3, 1, 31999),
+                                   (10, -1, 0, 60, 1, 0, 0, 0) ], dtype=_agent_dtype )
+
+    def test_join(self):
+        ids=numpy.array([30, 10, 20])
+        self.assertEqual(preprocess._join(ids, numpy.array([20, 30, 30, 10])).tolist(), [2, 0, 0, 1])
+        self.assertRaises(KeyError, preprocess._join, ids, numpy.array([10, 11]))
+
+    def test_preprocess_agents(self):
+        ppd, codes=preprocess._preprocess_agents(self.agents, self.households, self.workplaces)
+        self.assertEqual(ppd.dtype, preprocess._ppd_dtype)
+        self.assertEqual(ppd['age'].tolist(), [30, 40, 50, 60])
+        # NOTE: incomes are divided by floor division as in the original preprocessor
+        self.assertEqual(ppd['income'].tolist(), [2, 2, 31, 0])
+        # Latitudes are stored in `*_lon` fields
+        self.assertEqual(ppd['hh_lon'].tolist(), [45.1, 45.2, 45.0, 45.1])
+        self.assertEqual(ppd['wp_lon'].tolist(), [45.0, 45.2, 45.3, 45.1])
+        self.assertEqual(ppd['wp_lat'].tolist(), [7.7, 7.8, 7.6, 7.7])
+        # Unemployed agents work at home
+        self.assertEqual(ppd['wp_hh'].tolist(), [11, 0, 33, 0])
+        self.assertEqual(codes.dtype.names, ('l0', 'l1'))
+        self.assertEqual(codes['l1'].tolist(), [2, 3, 1, 2])
+
+    def test_sorted_id_lookup(self):
+        temp_dir=tempfile.mkdtemp()
+        try:
+            with h5py.File(os.path.join(temp_dir, 'synpop.h5'), 'w') as fp:
+                rows=numpy.zeros(100, dtype=_location_dtype)
+                rows['id']=numpy.arange(100)*3 + 1
+                rows['lat']=numpy.arange(100)
+                fp.create_dataset('sorted', data=rows)
+                fp.create_dataset('unsorted', data=rows[::-1])
+                ids=numpy.array([298, 1, 4, 4, 151, 31])
+                for name in ('sorted', 'unsorted'):
+                    lookup=preprocess._SortedIdLookup(fp[name], MPI.COMM_SELF, block_len=16)
+                    self.assertEqual(lookup.fences is None, name == 'unsorted')
+                    self.assertEqual(lookup[ids]['lat'].tolist(), ((ids - 1)//3).tolist())
+                    self.assertEqual(len(lookup[numpy.empty(0, 'i8')]), 0)
+                    self.assertRaises(KeyError, lookup.__getitem__, numpy.array([2]))
+        finally:
+            shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    unittest.main()
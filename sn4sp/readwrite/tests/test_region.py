@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+""" Unit tests for indices from administrative codes to rows of population tables
+"""
+
+from __future__ import division, absolute_import, print_function
+import unittest
+import shutil
+import tempfile
+import numpy
+import h5py
+
+from mpi4py import MPI
+
+# TODO: remove in alpha release
+import os
+import sys
+sys.path.insert( 0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))) )
+from sn4sp.readwrite import region
+
+class TestRegion(unittest.TestCase):
+    """ Tests for region indices."""
+
+    def setUp(self):
+        self.temp_dir=tempfile.mkdtemp()
+        random_state=numpy.random.RandomState(0)
+        self.codes=numpy.empty(200, dtype=[('l0', 'i4'), ('l1', 'i4')])
+        self.codes['l0']=random_state.randint(0, 3, len(self.codes))
+        self.codes['l1']=random_state.randint(0, 5, len(self.codes))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_region_rows(self):
+        with h5py.File(os.path.join(self.temp_dir, 'index.h5'), 'w') as fp:
+            group=fp.create_group('region_index')
+            region._write_region_index(group, 'agent', self.codes, 0, MPI.COMM_SELF)
+            for selection, mask in [ ({'l0' : 1}, self.codes['l0'] == 1),
+                                     ({'l0' : 2, 'l1' : 4}, (self.codes['l0'] == 2) & (self.codes['l1'] == 4)),
+                                     ({'l0' : 7}, numpy.zeros(len(self.codes), bool)),
+                                     ({}, numpy.ones(len(self.codes), bool)) ]:
+                rows=region.region_rows(group, 'agent', selection)
+                self.assertEqual(rows.tolist(), numpy.flatnonzero(mask).tolist())
+            self.assertRaises(ValueError, region.region_rows, group, 'agent', {'l2' : 0})
+
+    def test_read_rows(self):
+        with h5py.File(os.path.join(self.temp_dir, 'table.h5'), 'w') as fp:
+            dataset=fp.create_dataset('table', data=numpy.arange(1000)*2)
+            for rows in ([], [3, 4, 6], [0, 500, 999]):
+                rows=numpy.array(rows, dtype='i8')
+                self.assertEqual(region._read_rows(dataset, rows).tolist(), (rows*2).tolist())
+
+if __name__ == '__main__':
+    unittest.main()
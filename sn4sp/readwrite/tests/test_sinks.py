@@ -0,0 +1,202 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+""" Unit tests for consumers of chunks of edges
+"""
+
+from __future__ import division, absolute_import, print_function
+import unittest
+import shutil
+import tempfile
+import numpy
+import h5py
+
+from mpi4py import MPI
+
+# TODO: remove in alpha release
+import os
+import sys
+sys.path.insert( 0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))) )
+from sn4sp import parallel
+from sn4sp.core import SimilarityGraph
+from sn4sp.readwrite import sinks
+
+_edge_type=numpy.dtype([('src_node', 'i8'), ('trg_node', 'i8'), ('weight', 'f8')])
+
+def _edges(num_edges, seed=0):
+    """ Random edges sorted by vertices. """
+    random_state=numpy.random.RandomState(seed)
+    edges=numpy.zeros(num_edges, dtype=_edge_type)
+    edges['src_node']=numpy.sort(random_state.randint(0, 100, num_edges))
+    edges['trg_node']=edges['src_node'] + 1 + random_state.randint(0, 100, num_edges)
+    edges['weight']=random_state.rand(num_edges)
+    return edges
+
+class _Comm(object):
+    """ Communicator of the first process, where other processes gather and reduce (by maximum) the given values. """
+    def __init__(self, gathered, reduced):
+        self.gathered, self.reduced=gathered, reduced
+
+    def Get_rank(self):
+        return 0
+
+    def Get_size(self):
+        return len(self.gathered) + 1
+
+    def allgather(self, value):
+        return [value] + self.gathered
+
+    def allreduce(self, value, op):
+        return max([value] + self.reduced)
+
+class TestSinks(unittest.TestCase):
+    """ Tests for edge sinks and streaming of edges."""
+
+    def setUp(self):
+        self.edges=_edges(1000)
+
+    def test_chunked(self):
+        edges=self.edges.copy()
+        edges['weight'][::3]=0.
+        chunks=[chunk.copy() for chunk in sinks.chunked(edges.tolist(), _edge_type, 64)]
+        self.assertEqual([len(chunk) for chunk in chunks[:-1]], [64]*(len(chunks) - 1))
+        self.assertEqual(numpy.concatenate(chunks).tolist(), edges[edges['weight'] > 0.].tolist())
+
+    def test_stream_edges(self):
+        lengths=[]
+        sink=sinks.CallbackSink(lambda chunk: lengths.append(len(chunk)))
+        self.assertEqual(sinks.stream_edges(sinks.chunked(self.edges.tolist(), _edge_type, 128), sink), len(self.edges))
+        self.assertEqual(lengths[:-1], [128]*(len(lengths) - 1))
+
+        # Exceeded budgets shrink chunks down to the minimal length and call back once
+        calls=[]
+        del lengths[:]
+        with sinks.ArraySink() as sink:
+            num_edges=sinks.stream_edges( sinks.chunked(self.edges.tolist(), _edge_type, 128),
+                                          sinks.CallbackSink(lambda chunk: (lengths.append(len(chunk)), sink.write(chunk))),
+                                          parallel.MemoryBudget(1, comm=MPI.COMM_SELF), lambda: calls.append(1), 32 )
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(lengths[:4], [128, 64, 32, 32])
+        self.assertEqual(num_edges, len(self.edges))
+        self.assertEqual(sink.edges.tolist(), self.edges.tolist())
+
+        # Plain iterators are streamed without shrinking
+        sink=sinks.CountingSink()
+        chunks=[self.edges[:500], self.edges[500:]]
+        self.assertEqual(sinks.stream_edges(chunks, sink, parallel.MemoryBudget(1, comm=MPI.COMM_SELF)), len(self.edges))
+
+    def test_hdf5_sink(self):
+        temp_dir=tempfile.mkdtemp()
+        try:
+            with h5py.File(os.path.join(temp_dir, 'edges.h5'), 'w') as fp:
+                datasets=[ fp.create_dataset(name, shape=(300,), maxshape=(None,), chunks=(100,), dtype=_edge_type)
+                           for name in ('0', '1') ]
+                # Edges beyond the preallocated length are spilled and copied on close
+                with sinks.HDF5Sink(datasets[0], _Comm([300], [0]), datasets) as sink:
+                    for start in xrange(0, len(self.edges), 128):
+                        sink.write(self.edges[start:start+128])
+                self.assertEqual(sink.num_spilled, len(self.edges) - 300)
+                self.assertEqual(datasets[0][...].tolist(), self.edges.tolist())
+                self.assertEqual(datasets[1].shape, (300,))
+
+                # Collective transfers write all edges at the end in rounds over datasets of all processes
+                writes=[]
+                def write_collective(dataset, offset, data):
+                    writes.append((dataset.name, len(data)))
+                    if len(data) > 0:
+                        dataset[offset:offset+len(data)]=data
+                # NOTE: the second process writes its edges in 2 rounds, and the third one has no dataset
+                with sinks.HDF5Sink(datasets[1], _Comm([400, 0], [2, 0]), [datasets[1], datasets[0], None], True) as sink:
+                    sink.write_collective=write_collective
+                    sink.write(self.edges[:600])
+                    sink.write(self.edges[600:])
+                    self.assertEqual(writes, [])
+                self.assertEqual(datasets[1][...].tolist(), self.edges.tolist())
+                self.assertEqual(datasets[0].shape, (400,))
+                self.assertEqual(writes, [('/1', len(self.edges)), ('/0', 0), ('/1', 0), ('/0', 0)])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_array_sink(self):
+        with sinks.ArraySink('i8, i8, f4') as sink:
+            for start in xrange(0, len(self.edges), 300):
+                sink.write(self.edges[start:start+300])
+        self.assertEqual(sink.num_edges, len(self.edges))
+        self.assertEqual(sink.edges.dtype, numpy.dtype('i8, i8, f4'))
+        self.assertEqual(sink.edges['f0'].tolist(), self.edges['src_node'].tolist())
+        with sinks.CountingSink() as sink:
+            sink.write(self.edges[:10])
+            sink.write(self.edges[10:15])
+        self.assertEqual(sink.num_edges, 15)
+
+    def test_aggregator_sink(self):
+        # NOTE: the aggregator of a single process collects its own edges without receiving
+        for threaded in (None, False, True):
+            with sinks.ArraySink() as sink:
+                lengths=[]
+                output=sinks.AggregatorSink( sinks.CallbackSink(lambda chunk: (lengths.append(len(chunk)), sink.write(chunk))),
+                                             MPI.COMM_SELF, _edge_type, buffer_len=256, threaded=threaded )
+                with output:
+                    for start, stop in ((0, 100), (100, 200), (200, 200), (200, 700), (700, 900), (900, 1000)):
+                        output.write(self.edges[start:stop])
+                self.assertTrue(output.thread is None)
+            self.assertEqual(output.num_edges, len(self.edges))
+            # Chunks larger than the buffer are written directly
+            self.assertEqual(lengths, [200, 500, 200, 100])
+            self.assertEqual(sink.edges.tolist(), self.edges.tolist())
+        self.assertRaises(ValueError, sinks.AggregatorSink, None, MPI.COMM_SELF, _edge_type, num_buffers=0)
+
+    def test_statistics_sink(self):
+        groups=numpy.arange(200) % 3
+        for num_settings in (1, 2):
+            edges=numpy.zeros(len(self.edges), dtype=[ ('src_node', 'i8'), ('trg_node', 'i8'),
+                                                       ('weight', 'f8', (num_settings,) if num_settings > 1 else ()) ])
+            edges['src_node'], edges['trg_node']=self.edges['src_node'], self.edges['trg_node']
+            weights=numpy.outer(self.edges['weight'], [1., 0.5][:num_settings]).reshape(edges['weight'].shape)
+            edges['weight']=weights
+            with sinks.StatisticsSink(200, groups, bins=4, num_settings=num_settings) as statistics:
+                for start in xrange(0, len(edges), 128):
+                    statistics.write(edges[start:start+128])
+            statistics.reduce(MPI.COMM_SELF)
+            self.assertEqual(statistics.num_edges, len(edges))
+            weights=weights.reshape(len(edges), -1)
+            for k in xrange(num_settings):
+                settings=(Ellipsis, k) if num_settings > 1 else (Ellipsis,)
+                degrees=numpy.bincount(edges['src_node'], weights[:,k], 200) + \
+                        numpy.bincount(edges['trg_node'], weights[:,k], 200)
+                numpy.testing.assert_allclose(statistics.degrees[settings], degrees)
+                self.assertEqual( statistics.histogram[settings].tolist(),
+                                  numpy.histogram(weights[:,k], [0., .25, .5, .75, 1.])[0].tolist() )
+                self.assertAlmostEqual(numpy.sum(statistics.total_weight[settings]), weights[:,k].sum())
+                # Edges between groups are counted in the upper triangle
+                group_weights=statistics.group_weights[settings]
+                self.assertAlmostEqual(numpy.sum(group_weights), weights[:,k].sum())
+                self.assertEqual(numpy.sum(numpy.tril(group_weights, -1)), 0.)
+                within=groups[edges['src_node']] == groups[edges['trg_node']]
+                self.assertAlmostEqual(numpy.trace(group_weights), weights[within,k].sum())
+
+    def test_network_statistics(self):
+        random_state=numpy.random.RandomState(0)
+        vertex_attrs=numpy.zeros(150, dtype=[('sex', 'i1'), ('age', 'i1'), ('hh_lon', 'f4'), ('hh_lat', 'f4')])
+        vertex_attrs['sex']=random_state.randint(0, 2, len(vertex_attrs))
+        vertex_attrs['age']=random_state.randint(0, 90, len(vertex_attrs))
+        vertex_attrs['hh_lon']=7.6 + 0.1*random_state.rand(len(vertex_attrs))
+        vertex_attrs['hh_lat']=45.0 + 0.1*random_state.rand(len(vertex_attrs))
+        sim_net=SimilarityGraph(vertex_attrs, list("cogg"), hss=2000, damping=0.5, comm=MPI.COMM_SELF)
+        edges=numpy.concatenate([chunk.copy() for chunk in sim_net.edges_probabilities_chunks(64, threshold=0.1)])
+        statistics=sinks.network_statistics(sim_net, bins=10, chunk_len=64, threshold=0.1)
+        self.assertEqual(statistics.num_edges, len(edges))
+        self.assertAlmostEqual(statistics.total_weight, edges['weight'].sum())
+        self.assertTrue(statistics.group_weights is None)
+        # Arguments of edge iterators are passed by keywords only
+        self.assertRaises(TypeError, sinks.network_statistics, sim_net, None, 10, 64, 0.1)
+
+if __name__ == '__main__':
+    unittest.main()
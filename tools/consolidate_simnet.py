@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright (C) 2018 by
+#    Sergiy Gogolenko <gogolenko@hlrs.de>   HLRS
+#    Fabio Saracco    <fabio@imt.it>        IMT
+#    All rights reserved.
+#
+# Authors:      Sergiy Gogolenko <gogolenko@hlrs.de>
+#               Fabio Saracco <fabio@imt.it>
+"""
+.. module:: sn4sp
+   :platform: Unix, Windows
+   :synopsis: Consolidate edge lists of a similarity network into a single edge list sorted by vertices
+"""
+from __future__ import division, absolute_import, print_function
+
+__author__ = '\n'.join( ['Sergiy Gogolenko <gogolenko@hlrs.de>',
+                         'Fabio Saracco <fabio@imt.it>'] )
+
+import os
+import sys
+import logging
+import datetime
+import argparse
+
+from mpi4py import MPI
+
+# TODO: remove in alpha release
+sys.path.insert( 0, os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))) )
+from sn4sp import readwrite
+from sn4sp import parallel
+
+def get_arguments():
+    """ Get the argument from the command line. """
+    parser = argparse.ArgumentParser(description="Consolidate edge lists of a similarity network (run with MPI)")
+    parser.add_argument( "input", metavar="HDF5_FILE", type=str,
+                         help="input HDF5 file with the similarity network" )
+    parser.add_argument( "-o", "--output",
+                         dest="output", type=str, required=True,
+                         help="output HDF5 file with the edge list sorted by (source, target) vertices" )
+    parser.add_argument( "--symmetric",
+                         dest="symmetric", action="store_true",
+                         help="store every edge in both directions",
+                         default=False )
+    parser.add_argument( "--chunk-len",
+                         dest="chunk_len", type=int,
+                         help="number of edges held in a buffer (shrunk if it does not fit into the memory budget)",
+                         default=int(1e6) )
+    parser.add_argument( "--temp-dir",
+                         dest="temp_dir", type=str,
+                         help="directory of temporary files with sorted runs of edges (e.g., node-local storage)",
+                         default=None )
+    parser.add_argument( "--memory-budget",
+                         dest="memory_budget", type=str, metavar="SIZE",
+                         help="memory budget per process (e.g., 2G)",
+                         default=None )
+    parser.add_argument( "--memory-budget-per-node",
+                         dest="memory_budget_per_node", type=str, metavar="SIZE",
+                         help="memory budget per node shared by all processes of the node (e.g., 64G)",
+                         default=None )
+    return parser.parse_args()
+
+def main():
+    logger_fmt='%(asctime)s [process_id={0:03}:{1}] %(message)s'.format(MPI.COMM_WORLD.Get_rank(), MPI.COMM_WORLD.Get_size())
+    logging.basicConfig(format=logger_fmt, datefmt=':%Y-%m-%d %H:%M:%S', level=logging.INFO)
+
+    args=get_arguments()
+    memory_budget=parallel.MemoryBudget(args.memory_budget, args.memory_budget_per_node)
+
+    start_time=MPI.Wtime()
+    readwrite.consolidate_edges_h5( args.input, args.output, symmetric=args.symmetric, chunk_len=args.chunk_len,
+                                    memory_budget=memory_budget, temp_dir=args.temp_dir )
+    elapsed_time=MPI.Wtime() - start_time
+    logging.info( 'total elapsed time={0}'.format(datetime.timedelta(seconds=elapsed_time)) )
+
+    return 0
+
+if __name__ == "__main__":
+    main()
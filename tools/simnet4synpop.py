@@ -25,11 +25,44 @@ import datetime
 import argparse
 
 from mpi4py import MPI
+import numpy
 
 # TODO: remove in alpha release
 sys.path.insert( 0, os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))) )
 import sn4sp
 from sn4sp import readwrite
+from sn4sp import parallel
+
+def parse_region(region):
+    """ Convert region specification ``l0=0,l1=569`` to dictionary of administrative codes. """
+    try:
+        return { level.strip() : int(code) for level, code in (item.split('=') for item in region.split(',')) }
+    except ValueError:
+        raise argparse.ArgumentTypeError( 'invalid region "{0}"'.format(region) )
+
+def parse_aggregators(aggregators):
+    """ Convert aggregator specification (``node`` or number of processes per aggregator). """
+    if aggregators == 'node':
+        return aggregators
+    try:
+        return int(aggregators)
+    except ValueError:
+        raise argparse.ArgumentTypeError( 'invalid aggregators "{0}"'.format(aggregators) )
+
+def write_statistics(sim_net, args):
+    """ Compute statistics of the network without storing edges and save them in NPZ file. """
+    groups, group_labels=None, None
+    if args.statistics_groups:
+        group_labels, groups=numpy.unique(sim_net.vertex_attrs[args.statistics_groups], return_inverse=True)
+    statistics=readwrite.network_statistics( sim_net, groups, bins=args.statistics_bins, chunk_len=args.chunk_len,
+                                             scheduning=args.scheduling )
+    if sim_net.comm.Get_rank() == 0:
+        arrays={ 'degrees' : statistics.degrees, 'bins' : statistics.bins, 'histogram' : statistics.histogram,
+                 'total_weight' : statistics.total_weight, 'num_edges' : statistics.num_edges }
+        if groups is not None:
+            arrays.update(group_weights=statistics.group_weights, group_labels=group_labels)
+        numpy.savez(args.statistics, **arrays)
+        logging.info( 'statistics of {0} edges are saved to "{1}"'.format(statistics.num_edges, args.statistics) )
 
 def get_arguments():
     """ Get the argument from the command line.
@@ -46,22 +79,130 @@ def get_arguments():
                          default=os.getcwd() )
 
     parser.add_argument( "-hss", "--half-sim-scale",
-                         dest="hss", type=float,
-                         help="half-similarity scale",
-                         default=5000 )
+                         dest="hss", type=float, nargs='+',
+                         help="half-similarity scale (several values are evaluated in a single pass)",
+                         default=[5000] )
     parser.add_argument( "-d", "--damping",
-                         dest="damping", type=float,
-                         help="damping function",
-                         default=0.0 )
+                         dest="damping", type=float, nargs='+',
+                         help="damping function (several values are evaluated in a single pass)",
+                         default=[0.0] )
     parser.add_argument( "-p", "--sampling-percentage",
                          dest="sample_fraction", type=float,
                          help="fraction of the sample (stripe size) for the parallel similarity calculation",
                          default=0.1 )
+    parser.add_argument( "--frequencies",
+                         dest="frequencies", choices=("sample", "exact", "sketch"),
+                         help="estimate frequencies for Lin similarity on the sample or compute them over the whole population",
+                         default="sample" )
+    parser.add_argument( "--sketch-error",
+                         dest="sketch_error", type=float,
+                         help="error bound of sketched frequencies relative to the population size",
+                         default=1e-3 )
+    parser.add_argument( "--sketch-memory",
+                         dest="sketch_memory", type=str, metavar="SIZE",
+                         help="memory footprint of sketched frequencies (e.g., 256M)",
+                         default=None )
     parser.add_argument( "-n", "--num-agents",
                          dest="num_agents", type=int,
                          help="maxim size of the population (if input file has more records, it will be truncated)",
                          default=0 )
-    return parser.parse_args()
+    parser.add_argument( "-r", "--region",
+                         dest="region", type=parse_region, metavar="LEVEL=CODE[,LEVEL=CODE...]",
+                         help="administrative codes of the region to read the population from (e.g., l0=0,l1=569)",
+                         default=None )
+    parser.add_argument( "--chunk-len",
+                         dest="chunk_len", type=int,
+                         help="length of the edge buffer (shrunk if it does not fit into the memory budget)",
+                         default=int(1e4) )
+    parser.add_argument( "--io-buffers",
+                         dest="io_buffers", type=int,
+                         help="number of edge buffers written by a background thread (0 to write synchronously)",
+                         default=2 )
+    parser.add_argument( "--aggregators",
+                         dest="aggregators", type=parse_aggregators, metavar="node|K",
+                         help="send edges to I/O aggregators (one per node or per K processes) which write them in large blocks",
+                         default=None )
+    parser.add_argument( "--aggregator-buffer-len",
+                         dest="aggregator_buffer_len", type=int,
+                         help="length of the edge buffer of I/O aggregators",
+                         default=1<<20 )
+    parser.add_argument( "--hdf5-chunk-size",
+                         dest="hdf5_chunk_size", type=str,
+                         help="size of HDF5 chunks of edge lists (e.g., 4M; chosen automatically by default)",
+                         default=None )
+    parser.add_argument( "--hdf5-alignment",
+                         dest="hdf5_alignment", type=str,
+                         help="alignment of HDF5 chunks in the output file, e.g., Lustre stripe size (detected by default)",
+                         default=None )
+    parser.add_argument( "--hdf5-cache-size",
+                         dest="hdf5_cache_size", type=str,
+                         help="size of HDF5 chunk cache of edge lists (4 chunks by default)",
+                         default=None )
+    parser.add_argument( "--hdf5-xfer-mode",
+                         dest="hdf5_xfer_mode", choices=('independent', 'collective'),
+                         help="transfer mode of parallel HDF5 (collective writes all edges at the end)",
+                         default='independent' )
+    parser.add_argument( "--preallocate",
+                         dest="preallocate", type=int,
+                         help="initial length of edge lists of processes (estimated from the density of edges by default)",
+                         default=None )
+    parser.add_argument( "--preallocation-margin",
+                         dest="preallocation_margin", type=float,
+                         help="factor applied to the estimated number of edges of processes when preallocating edge lists",
+                         default=1.25 )
+    parser.add_argument( "--statistics",
+                         dest="statistics", type=str, metavar="NPZ_FILE",
+                         help="save expected degrees, weight histogram and group aggregates to NPZ_FILE instead of storing edges",
+                         default=None )
+    parser.add_argument( "--statistics-groups",
+                         dest="statistics_groups", type=str, metavar="FIELD",
+                         help="attribute of agents (e.g., municipality code) grouping vertices for the statistics",
+                         default=None )
+    parser.add_argument( "--statistics-bins",
+                         dest="statistics_bins", type=int,
+                         help="number of bins of the weight histogram",
+                         default=100 )
+    parser.add_argument( "--factorized",
+                         dest="factorized", action="store_true",
+                         help="store distances and Lin similarities instead of edge probabilities (see reweight_edges_h5)",
+                         default=False )
+    parser.add_argument( "--coarse",
+                         dest="coarse", action="store_true",
+                         help="store network between classes of agents with identical attributes (see expand_class_network_h5)",
+                         default=False )
+    parser.add_argument( "--ordering",
+                         dest="ordering", choices=("hilbert", "morton"),
+                         help="order agents by households along space-filling curve and skip distant tiles of agents",
+                         default=None )
+    parser.add_argument( "--scheduling",
+                         dest="scheduling", choices=("even", "round_robin", "cost"),
+                         help="distribution of pairs of agents between processes",
+                         default="even" )
+    parser.add_argument( "--memory-budget",
+                         dest="memory_budget", type=str, metavar="SIZE",
+                         help="memory budget per process (e.g., 512M or 2G)",
+                         default=None )
+    parser.add_argument( "--memory-budget-per-node",
+                         dest="memory_budget_per_node", type=str, metavar="SIZE",
+                         help="memory budget per node shared by all processes of the node (e.g., 64G)",
+                         default=None )
+    parser.add_argument( "--profile",
+                         dest="profile", type=str, metavar="PSTATS_FILE",
+                         help="profile all processes and store merged cProfile statistics in PSTATS_FILE",
+                         default=None )
+    parser.add_argument( "--profile-top",
+                         dest="profile_top", type=int,
+                         help="number of the hottest functions reported per process and across processes",
+                         default=20 )
+    parser.add_argument( "--flamegraph",
+                         dest="flamegraph", action="store_true",
+                         help="sample call stacks and store them in the collapsed format to PSTATS_FILE.collapsed"
+                              " (requires --profile)",
+                         default=False )
+    args=parser.parse_args()
+    if args.flamegraph and not args.profile:
+        parser.error( "--flamegraph requires --profile" )
+    return args
 
 def main():
     # Set up logger
@@ -78,20 +219,49 @@ def main():
 
     # Handle command line arguments
     args=get_arguments()
+    if len(args.hss) > 1 and len(args.damping) > 1 and len(args.hss) != len(args.damping):
+        raise ValueError( "Numbers of hss and damping values do not match" )
+    # A single hss (or damping) value is shared by all settings
+    num_settings=max(len(args.hss), len(args.damping))
+    settings=list(zip(args.hss*num_settings if len(args.hss) == 1 else args.hss,
+                      args.damping*num_settings if len(args.damping) == 1 else args.damping))
 
     output_filename=os.path.abspath(args.output)
     if   os.path.isdir(output_filename):
-        output_filename=os.path.join(args.output, 'synthetic_network_hss_{0}_d_{1}.h5'.format(args.hss,args.damping))
+        output_filename=os.path.join(args.output, 'synthetic_network_hss_{0}_d_{1}.h5'.\
+                                     format('_'.join(map(str, args.hss)), '_'.join(map(str, args.damping))))
     elif not os.path.isdir(os.path.dirname(output_filename)):
         raise ValueError( "Invalid output path '{0}'".fortmat(output_filename) )
 
+    memory_budget=parallel.MemoryBudget(args.memory_budget, args.memory_budget_per_node)
+    frequencies_options={ 'error' : args.sketch_error,
+                          'memory' : parallel.memory.parse_memory_size(args.sketch_memory) } \
+                        if args.frequencies == 'sketch' else None
+
     # Read input synthetic population and produce similarity network object out of it
-    sim_net=readwrite.read_attr_table_h5( args.input, truncate=args.num_agents,
-                                          hss=args.hss, damping=args.damping, sample_fraction=args.sample_fraction )
+    sim_net=readwrite.read_attr_table_h5( args.input, truncate=args.num_agents, region=args.region,
+                                          settings=settings, sample_fraction=args.sample_fraction,
+                                          frequencies=args.frequencies, frequencies_options=frequencies_options,
+                                          memory_budget=memory_budget, ordering=args.ordering )
 
     # Compute similarity network edge probabilities and store in HDF5 edgelist file
+    tuning=readwrite.HDF5Tuning( args.hdf5_chunk_size, args.hdf5_alignment, args.hdf5_cache_size,
+                                 args.preallocate, args.preallocation_margin, args.hdf5_xfer_mode )
+    def compute():
+        if args.statistics:
+            write_statistics(sim_net, args)
+            return
+        readwrite.write_edges_probabilities_h5( sim_net, output_filename, chunk_len=args.chunk_len,
+                                                factorized=args.factorized, coarse=args.coarse,
+                                                scheduling=args.scheduling, io_buffers=args.io_buffers,
+                                                aggregators=args.aggregators,
+                                                aggregator_buffer_len=args.aggregator_buffer_len, tuning=tuning )
     start_time=MPI.Wtime()
-    readwrite.write_edges_probabilities_h5( sim_net, output_filename, chunk_len=int(1e4) )
+    if args.profile:
+        with parallel.profiling( args.profile, sim_net.comm, top=args.profile_top, collapsed=args.flamegraph ):
+            compute()
+    else:
+        compute()
     elapsed_time=MPI.Wtime() - start_time
     logging.info( 'total elapsed time={0}'.format(datetime.timedelta(seconds=elapsed_time)) )
 